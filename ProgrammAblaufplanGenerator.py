@@ -0,0 +1,177 @@
+# Command line batch converter.
+#
+#   python ProgrammAblaufplanGenerator.py SOURCE [SOURCE ...] -o OUTPUT [--jobs N] [--format all|mmd|nsd|pap ...]
+#
+# Every .py, .ino and .mmd file under the given files/directories is converted
+# in parallel worker processes. .py and .ino files become a Mermaid flowchart
+# (.mmd) and a structogram (.nsd.svg); .mmd files become a structogram. The
+# output directory mirrors the layout of the input directories; inputs whose
+# outputs would have the same name (a/x.py and b/x.py as two sources, x.py
+# next to x.ino) are rejected before anything is converted. --format pap
+# (or all) also draws the flowchart as SVG (.pap.svg).
+#
+# With --sketch every SOURCE is one multi-file Arduino sketch (a folder or a
+# .zip) and becomes a single flowchart/structogram named after the sketch.
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from arduino_sketch import Sketch, convert_sketch_to_mermaid, convert_sketch_to_nsd, convert_sketch_to_pap
+from batch import DEFAULT_FORMATS, FORMATS, is_supported, iter_converted
+
+def collect_inputs(sources):
+    # (name relative to its source directory, path) of every supported file
+    found = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for filename in sorted(files):
+                    path = os.path.join(root, filename)
+                    name = os.path.relpath(path, source).replace(os.sep, '/')
+                    if is_supported(name):
+                        found.append((name, path))
+        elif os.path.isfile(source):
+            found.append((os.path.basename(source), source))
+        else:
+            raise FileNotFoundError(source)
+    return found
+
+def find_collisions(named):
+    # Pairs of paths whose outputs would get the same name, e.g. a/x.py and
+    # b/x.py given as two sources, or x.py next to x.ino; named holds
+    # (output name without extension, path)
+    seen = {}
+    collisions = []
+    for stem, path in named:
+        if stem in seen:
+            collisions.append((seen[stem], path))
+        else:
+            seen[stem] = path
+    return collisions
+
+def report_collisions(collisions):
+    for first, second in collisions:
+        print(f'{first} and {second} would write the same output files; '
+              f'rename one or convert them separately', file=sys.stderr)
+
+def read_inputs(found, counter):
+    # Read lazily so only the files currently in flight are held in memory
+    for name, path in found:
+        with open(path, 'rb') as f:
+            data = f.read()
+        counter['bytes'] += len(data)
+        yield name, data
+
+def write_outputs(output_dir, outputs):
+    for name, text in outputs.items():
+        path = os.path.join(output_dir, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+def sketch_name(source):
+    return os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+
+def convert_sketches(sources, output_dir, formats, quiet):
+    # --sketch mode: one flowchart/structogram per sketch folder or zip
+    failed = 0
+    for source in sources:
+        name = sketch_name(source)
+        try:
+            if os.path.isdir(source):
+                sketch = Sketch.from_folder(source)
+            else:
+                with open(source, 'rb') as f:
+                    sketch = Sketch.from_zip(f.read())
+            outputs = {}
+            if 'mmd' in formats:
+                outputs[name + '.mmd'] = convert_sketch_to_mermaid(sketch)
+            if 'nsd' in formats:
+                outputs[name + '.nsd.svg'] = convert_sketch_to_nsd(sketch)
+            if 'pap' in formats:
+                outputs[name + '.pap.svg'] = convert_sketch_to_pap(sketch)
+        except Exception as e:
+            failed += 1
+            print(f'{source}: {type(e).__name__}: {e}', file=sys.stderr)
+            continue
+        write_outputs(output_dir, outputs)
+        if not quiet:
+            print(f'{source}: {len(sketch.files)} files -> {", ".join(sorted(outputs))}', file=sys.stderr)
+    print(f'{len(sources)} sketches - {len(sources) - failed} ok, {failed} failed')
+    return 1 if failed else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert Python, Arduino and Mermaid files into flowcharts (.mmd) and structograms (.nsd.svg).')
+    parser.add_argument('sources', nargs='+', help='files or directories to convert')
+    parser.add_argument('-o', '--output', default='output', help='output directory (default: output)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes (default: number of cores)')
+    parser.add_argument('-f', '--format', choices=('all',) + FORMATS, action='append',
+                        help='what to produce, may be repeated: mmd (flowchart), nsd (structogram), '
+                             'pap (flowchart as SVG) or all (default: mmd and nsd)')
+    parser.add_argument('-s', '--sketch', action='store_true',
+                        help='treat every source as one multi-file Arduino sketch (folder or .zip)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print the summary')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.format:
+        formats = DEFAULT_FORMATS
+    elif 'all' in args.format:
+        formats = FORMATS
+    else:
+        formats = tuple(args.format)
+
+    if args.sketch:
+        missing = [source for source in args.sources if not os.path.exists(source)]
+        if missing:
+            print(f'No such file or directory: {missing[0]}', file=sys.stderr)
+            return 2
+        collisions = find_collisions((sketch_name(source), source) for source in args.sources)
+        if collisions:
+            report_collisions(collisions)
+            return 2
+        return convert_sketches(args.sources, args.output, formats, args.quiet)
+
+    try:
+        found = collect_inputs(args.sources)
+    except FileNotFoundError as e:
+        print(f'No such file or directory: {e}', file=sys.stderr)
+        return 2
+    # Checked up front, so no output overwrites another
+    collisions = find_collisions((os.path.splitext(name)[0], path) for name, path in found if is_supported(name))
+    if collisions:
+        report_collisions(collisions)
+        return 2
+
+    counter = {'bytes': 0}
+    summary = {'ok': 0, 'error': 0, 'skipped': 0}
+    total = len(found)
+    start = time.perf_counter()
+
+    for done, (outputs, status) in enumerate(iter_converted(read_inputs(found, counter), args.jobs, formats), 1):
+        write_outputs(args.output, outputs)
+        summary[status['status']] += 1
+        if status['status'] == 'error':
+            print(f'[{done}/{total}] {status["name"]}: {status["error"]}', file=sys.stderr)
+        elif not args.quiet:
+            print(f'[{done}/{total}] {status["name"]}: {status["status"]}', file=sys.stderr)
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'{total} files in {elapsed:.2f}s ({total / elapsed:.1f} files/s, '
+          f'{counter["bytes"] / elapsed / 1024:.1f} KiB/s) - '
+          f'{summary["ok"]} ok, {summary["error"]} failed, {summary["skipped"]} skipped')
+    return 1 if summary['error'] else 0
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -1,10 +1,241 @@
-from flask import Flask, render_template, request, send_file
+from flask import Flask, Response, jsonify, render_template, request, send_file, url_for
+import atexit
+import io
+import itertools
+import multiprocessing
 import os
-from converter import convert_mermaid_to_nsd
-from python_to_mermaid import convert_python_to_mermaid
-from arduino_to_mermaid import convert_arduino_to_mermaid
+import secrets
+import threading
+import time
+import zipfile
+import zlib
+from batch import DEFAULT_FORMATS, FORMATS, iter_batch_zip
+from cache import LRUCache, content_key
+from converter import convert_mermaid_to_nsd, iter_nsd_svg, CONVERTER_VERSION, STREAM_CHUNK_SIZE
+from python_to_mermaid import convert_python_to_mermaid, convert_python_to_nsd
+from arduino_to_mermaid import convert_arduino_to_mermaid, convert_arduino_to_nsd
+from arduino_sketch import convert_sketch_archive
+import function_index
+import limits
+import metrics
+from pap_renderer import convert_source_to_pap, PAP_VERSION
+import nsd_layout
+import profiling
+from job_queue import JobQueue, JobFailed, JobTimeout, QueueFull, completed_job
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import brotli
+except ImportError:  # Optional; responses are then gzip-compressed only
+    brotli = None
 
 app = Flask(__name__)
+app.config.setdefault('RESULT_CACHE_BYTES', 64 * 1024 * 1024)
+app.config.setdefault('BATCH_WORKERS', None)  # None: one worker process per core
+# Conversions run in JOB_WORKERS worker processes (None: one per core). At most
+# JOB_QUEUE_DEPTH jobs wait for a worker, further requests get a 503. A job
+# running longer than JOB_TIMEOUT seconds is stopped. Uploads of at least
+# LARGE_JOB_BYTES never take every worker, so small ones stay fast.
+app.config.setdefault('JOB_WORKERS', None)
+app.config.setdefault('JOB_QUEUE_DEPTH', 32)
+app.config.setdefault('JOB_TIMEOUT', 30.0)
+app.config.setdefault('LARGE_JOB_BYTES', 256 * 1024)
+# Jobs submitted to /jobs may run for ASYNC_JOB_TIMEOUT seconds; finished ones
+# and their results are kept for JOB_RESULT_TTL seconds
+app.config.setdefault('ASYNC_JOB_TIMEOUT', 600.0)
+app.config.setdefault('JOB_RESULT_TTL', 600.0)
+# Per-conversion limits: upload size (larger requests get a 413 before the body
+# is read), flowchart nodes/edges and Python AST nodes (a 422); JOB_TIMEOUT is
+# the wall-clock limit
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config.setdefault('MAX_NODES', limits.MAX_NODES)
+app.config.setdefault('MAX_EDGES', limits.MAX_EDGES)
+app.config.setdefault('MAX_AST_NODES', limits.MAX_AST_NODES)
+# Per-stage timings, graph sizes and cache counters on /metrics
+app.config.setdefault('METRICS_ENABLED', True)
+# ?profile=1 on the conversion routes answers with a cProfile report; only
+# when the server runs with PAP_PROFILE=1
+app.config.setdefault('PROFILING_ENABLED', os.environ.get('PAP_PROFILE') == '1')
+# SVG, text and JSON responses of at least COMPRESS_MIN_BYTES are compressed
+# with brotli or gzip, whichever the client accepts (brotli if installed)
+app.config.setdefault('COMPRESS_RESPONSES', True)
+app.config.setdefault('COMPRESS_MIN_BYTES', 1024)
+COMPRESSIBLE_TYPES = ('image/svg+xml', 'text/plain', 'application/json', 'application/octet-stream')
+
+# Conversion results by hash of (route, converter version, input bytes)
+result_cache = LRUCache(app.config['RESULT_CACHE_BYTES'])
+metrics.register_cache('result', result_cache)
+not_modified_count = 0
+# Sources uploaded to /functions by module id, as (kind, bytes); the function
+# diagrams are drawn from them in whichever worker process is free
+function_uploads = LRUCache(16 * 1024 * 1024, sizeof=lambda upload: len(upload[1]))
+
+jobs = None  # Started on first use, once app.config is final
+_jobs_lock = threading.Lock()
+
+def conversion_limits():
+    return {'max_nodes': app.config['MAX_NODES'], 'max_edges': app.config['MAX_EDGES'],
+            'max_ast_nodes': app.config['MAX_AST_NODES']}
+
+def job_queue():
+    global jobs
+    with _jobs_lock:
+        if jobs is None:
+            metrics.configure(app.config['METRICS_ENABLED'])
+            jobs = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_DEPTH'],
+                            app.config['JOB_TIMEOUT'], app.config['LARGE_JOB_BYTES'],
+                            initializers=[(limits.configure, (conversion_limits(),)),
+                                          (metrics.configure, (app.config['METRICS_ENABLED'],))],
+                            report=metrics.drain, on_report=metrics.merge)
+            atexit.register(jobs.shutdown)
+        return jobs
+
+def limit_response(status, error, message, details):
+    # Structured error for an input over one of the limits
+    response = jsonify(error=error, message=message, **details)
+    response.status_code = status
+    return response
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return limit_response(413, 'too_large', 'Upload too large',
+                          {'limit': 'max_upload_bytes', 'value': request.content_length,
+                           'maximum': app.config['MAX_CONTENT_LENGTH']})
+
+@app.after_request
+def compress_response(response):
+    if (not app.config['COMPRESS_RESPONSES'] or response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        # Compressed chunk by chunk, so the response still streams
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        response.set_data(brotli.compress(data) if encoding == 'br' else gzip_compress(data))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # Same content, different bytes: the ETag is weak now (If-None-Match
+        # compares weakly, so revalidation still works)
+        response.set_etag(etag, weak=True)
+    return response
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return compressor.compress(data) + compressor.flush()
+
+def _compress_stream(chunks, encoding):
+    compressor = brotli.Compressor() if encoding == 'br' else zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if encoding == 'br':
+            data = compressor.process(chunk) + compressor.flush()
+        else:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.finish() if encoding == 'br' else compressor.flush()
+
+def job_error_response(job, error):
+    # Response for a job that failed on a limit, or None
+    if isinstance(error, JobTimeout):
+        return limit_response(422, 'limit_exceeded', 'Conversion took too long',
+                              {'limit': 'wall_clock_seconds', 'maximum': job.timeout})
+    if isinstance(error, JobFailed) and error.type_name == 'LimitExceeded':
+        return limit_response(422, 'limit_exceeded', error.message, error.details)
+    return None
+
+def cached_response(route, data, convert, mimetype, text=True, args=()):
+    # Serve a conversion from the result cache, or run convert(data, *args) in
+    # a worker process and remember the result. convert must be a module-level
+    # function. The ETag is the cache key, so a client that already holds the
+    # result gets a 304 without any conversion, even if the entry has been
+    # evicted since.
+    global not_modified_count
+    if request.args.get('profile') == '1':
+        return profile_response(convert, data.decode('utf-8') if text else data, args)
+    etag = content_key(route, CONVERTER_VERSION, data)
+
+    if request.if_none_match.contains_weak(etag):
+        not_modified_count += 1
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    cached = result_cache.get(etag)
+    if cached is not None:
+        response = Response(cached, mimetype=mimetype)
+    else:
+        try:
+            job = job_queue().submit(convert, data.decode('utf-8') if text else data, *args, size=len(data))
+        except QueueFull as e:
+            return busy_response(e)
+        chunks = job.iter_chunks()
+        try:
+            # Wait until the output starts (or the job ends), so errors still
+            # get a proper status
+            first = next(chunks, '')
+        except (JobTimeout, JobFailed) as e:
+            response = job_error_response(job, e)
+            if response is None:
+                raise
+            return response
+        if job.streamed:
+            response = Response(_store_when_done(etag, itertools.chain([first], chunks)), mimetype=mimetype)
+        else:
+            encoded = first if isinstance(first, bytes) else first.encode('utf-8')
+            result_cache.put(etag, encoded)
+            response = Response(encoded, mimetype=mimetype)
+    response.set_etag(etag)
+    return response
+
+def busy_response(error):
+    return Response('Server busy, try again later', status=503, mimetype='text/plain',
+                    headers={'Retry-After': str(error.retry_after)})
+
+def profile_response(convert, payload, args):
+    # Run the conversion under cProfile and answer with the report (JSON):
+    # ?top=N functions, sorted by ?sort=cumulative|tottime|calls
+    if not app.config['PROFILING_ENABLED']:
+        return 'Profiling is disabled; start the server with PAP_PROFILE=1', 403
+    top = request.args.get('top', profiling.DEFAULT_TOP, type=int)
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in profiling.SORT_KEYS:
+        return 'Unknown sort key', 400
+    try:
+        job = job_queue().submit(profiling.profile_conversion, convert, (payload,) + tuple(args), top, sort,
+                                 size=len(payload))
+    except QueueFull as e:
+        return busy_response(e)
+    try:
+        report = job.result()
+    except (JobTimeout, JobFailed) as e:
+        response = job_error_response(job, e)
+        if response is None:
+            raise
+        return response
+    return jsonify(report)
+
+def _store_when_done(key, chunks):
+    # Pass streamed chunks through and cache the document once it is complete
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    result_cache.put(key, "".join(parts).encode('utf-8'))
+
+def compact_svg():
+    # ?compact=1 on the structogram routes: smaller SVG (see converter.COMPACT_STYLE)
+    return request.args.get('compact') == '1'
 
 @app.route('/')
 def index():
@@ -20,9 +251,11 @@ def convert():
         return 'No file selected', 400
 
     if file:
-        mermaid_content = file.read().decode('utf-8')
-        svg_output = convert_mermaid_to_nsd(mermaid_content)
-        return svg_output
+        # Layout happens up front; on a cache miss the SVG is rendered while it is sent
+        if compact_svg():
+            return cached_response('convert/compact', file.read(), iter_nsd_svg, 'image/svg+xml',
+                                   args=(STREAM_CHUNK_SIZE, True))
+        return cached_response('convert', file.read(), iter_nsd_svg, 'image/svg+xml')
 
 @app.route('/convert_python', methods=['POST'])
 def convert_python():
@@ -34,9 +267,7 @@ def convert_python():
         return 'No file selected', 400
 
     if file:
-        python_content = file.read().decode('utf-8')
-        mermaid_output = convert_python_to_mermaid(python_content)
-        return mermaid_output
+        return cached_response('convert_python', file.read(), convert_python_to_mermaid, 'text/plain')
 
 @app.route('/convert_arduino', methods=['POST'])
 def convert_arduino():
@@ -48,9 +279,379 @@ def convert_arduino():
         return 'No file selected', 400
 
     if file:
-        arduino_content = file.read().decode('utf-8')
-        mermaid_output = convert_arduino_to_mermaid(arduino_content)
-        return mermaid_output
+        return cached_response('convert_arduino', file.read(), convert_arduino_to_mermaid, 'text/plain')
+
+@app.route('/convert_python_nsd', methods=['POST'])
+def convert_python_nsd():
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    if file:
+        # Straight from the source to the structogram, no Mermaid text in between
+        compact = compact_svg()
+        return cached_response('convert_python_nsd' + ('/compact' if compact else ''), file.read(),
+                               convert_python_to_nsd, 'image/svg+xml', args=(True,) if compact else ())
+
+@app.route('/convert_arduino_nsd', methods=['POST'])
+def convert_arduino_nsd():
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    if file:
+        compact = compact_svg()
+        return cached_response('convert_arduino_nsd' + ('/compact' if compact else ''), file.read(),
+                               convert_arduino_to_nsd, 'image/svg+xml', args=(True,) if compact else ())
+
+# Inputs of /render_pap and /layout by file extension; anything else is Mermaid text
+PAP_SOURCES = {'.py': 'python', '.ino': 'arduino'}
+
+def pap_source(filename):
+    return PAP_SOURCES.get(os.path.splitext(filename)[1].lower(), 'mermaid')
+
+@app.route('/render_pap', methods=['POST'])
+def render_pap():
+    # The flowchart as SVG, laid out on the server (no mermaid.js needed)
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    kind = pap_source(file.filename)
+    return cached_response(f'render_pap/{PAP_VERSION}/{kind}', file.read(), convert_source_to_pap, 'image/svg+xml',
+                           args=(kind,))
+
+LAYOUT_TYPES = {'json': 'application/json', 'bin': 'application/octet-stream'}
+
+@app.route('/layout', methods=['POST'])
+def layout():
+    # The structogram layout as data (see nsd_layout.py), ?format=json|bin,
+    # for clients that render it themselves
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    output_format = request.args.get('format', 'json')
+    if output_format not in nsd_layout.FORMATS:
+        return 'Unknown format', 400
+    kind = pap_source(file.filename)
+    return cached_response(f'layout/{nsd_layout.LAYOUT_VERSION}/{kind}/{output_format}', file.read(),
+                           nsd_layout.convert_source_to_layout, LAYOUT_TYPES[output_format],
+                           args=(kind, output_format))
+
+@app.route('/convert_sketch', methods=['POST'])
+def convert_sketch():
+    # A zipped multi-file Arduino sketch. ?format=mmd|nsd|pap, ?function=name for
+    # the flowchart of one function instead of setup()/loop()
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    archive = file.read()
+    if not zipfile.is_zipfile(io.BytesIO(archive)):
+        return 'Upload a .zip archive', 400
+
+    output_format = request.args.get('format', 'mmd')
+    if output_format not in FORMATS:
+        return 'Unknown format', 400
+    function = request.args.get('function') or None
+
+    try:
+        return cached_response(f'convert_sketch/{output_format}/{function or ""}', archive, convert_sketch_archive,
+                               'text/plain' if output_format == 'mmd' else 'image/svg+xml', text=False,
+                               args=(output_format, function))
+    except JobFailed as e:
+        if e.type_name == 'KeyError':
+            return f'Unknown function: {function}', 404
+        raise
+
+# Upload types the function index understands, by file extension
+FUNCTION_SOURCES = {'.py': 'python', '.ino': 'arduino', '.zip': 'sketch'}
+
+@app.route('/functions', methods=['POST'])
+def list_functions():
+    # Parse a source once and list its functions; the diagrams of single
+    # functions are then fetched from /functions/<id>/<name>
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    kind = FUNCTION_SOURCES.get(os.path.splitext(file.filename)[1].lower())
+    if kind is None:
+        return 'Upload a .py, .ino or .zip file', 400
+
+    data = file.read()
+    try:
+        job = function_job(function_index.module_index, kind, data)
+    except QueueFull as e:
+        return busy_response(e)
+    if isinstance(job.error, JobFailed) and job.error.type_name == 'SyntaxError':
+        return f'Syntax Error: {job.error.message}', 422
+    if job.error is not None:
+        return failed_job_response(job)
+    module_id, index = job.result()
+    function_uploads.put(module_id, (kind, data))
+    return jsonify({'id': module_id, 'functions': index})
+
+@app.route('/functions/<module_id>/<path:name>')
+def function_diagram(module_id, name):
+    output_format = request.args.get('format', 'mmd')
+    if output_format not in function_index.FORMATS:
+        return 'Unknown format', 400
+
+    etag = content_key(module_id, name, output_format, CONVERTER_VERSION)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    text = result_cache.get(etag)
+    if text is None:
+        upload = function_uploads.get(module_id)
+        if upload is None:
+            return 'Unknown function, or the upload has expired; upload the file again', 404
+        try:
+            job = function_job(function_index.source_function_diagram, *upload, name, output_format)
+        except QueueFull as e:
+            return busy_response(e)
+        if isinstance(job.error, JobFailed) and job.error.type_name == 'KeyError':
+            return 'Unknown function, or the upload has expired; upload the file again', 404
+        if job.error is not None:
+            return failed_job_response(job)
+        text = job.result().encode('utf-8')
+        result_cache.put(etag, text)
+    response = Response(text, mimetype='image/svg+xml' if output_format == 'nsd' else 'text/plain')
+    response.set_etag(etag)
+    return response
+
+def function_job(fn, kind, data, *args):
+    # Parse (and draw) in a worker process like every conversion. The worker
+    # is handed the upload, so it does not matter which one parsed it before.
+    job = job_queue().submit(fn, kind, data, *args, size=len(data))
+    job.wait()
+    return job
+
+def failed_job_response(job):
+    # job_error_response of a finished job; other errors are raised
+    response = job_error_response(job, job.error)
+    if response is None:
+        raise job.error
+    return response
+
+def batch_formats():
+    # ?format=mmd,nsd,pap (default mmd,nsd); None if a format is unknown
+    formats = tuple(f for f in request.args.get('format', ','.join(DEFAULT_FORMATS)).split(',') if f)
+    if not formats or any(f not in FORMATS for f in formats):
+        return None
+    return formats
+
+@app.route('/convert_batch', methods=['POST'])
+def convert_batch():
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    archive = file.read()
+    if not zipfile.is_zipfile(io.BytesIO(archive)):
+        return 'Upload a .zip archive', 400
+    formats = batch_formats()
+    if formats is None:
+        return 'Unknown format', 400
+
+    # The result archive is streamed while the files are being converted; every
+    # file has JOB_TIMEOUT seconds
+    return Response(iter_batch_zip(archive, app.config['BATCH_WORKERS'], formats, conversion_limits(),
+                                   app.config['JOB_TIMEOUT']),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=converted.zip'})
+
+# Conversions of the job API by route: (function, mimetype, upload is text)
+JOB_KINDS = {
+    'convert': (convert_mermaid_to_nsd, 'image/svg+xml', True),
+    'convert_python': (convert_python_to_mermaid, 'text/plain', True),
+    'convert_arduino': (convert_arduino_to_mermaid, 'text/plain', True),
+    'convert_python_nsd': (convert_python_to_nsd, 'image/svg+xml', True),
+    'convert_arduino_nsd': (convert_arduino_to_nsd, 'image/svg+xml', True),
+    'render_pap': (convert_source_to_pap, 'image/svg+xml', True),
+    'layout': (nsd_layout.convert_source_to_layout, 'application/json', True),
+    'convert_sketch': (convert_sketch_archive, 'text/plain', False),
+    'convert_batch': (iter_batch_zip, 'application/zip', False),
+}
+
+# Submitted jobs by id: {'job', 'mimetype', 'key'}; key is the result cache
+# key, under which the result is stored once it is fetched
+submitted_jobs = {}
+_submitted_lock = threading.Lock()
+
+def _expire_jobs():
+    now = time.monotonic()
+    for job_id, entry in list(submitted_jobs.items()):
+        job = entry['job']
+        if job.done() and now - job.finished > app.config['JOB_RESULT_TTL']:
+            del submitted_jobs[job_id]
+
+def _find_job(job_id):
+    with _submitted_lock:
+        _expire_jobs()
+        return submitted_jobs.get(job_id)
+
+def _job_status(job_id, job):
+    status = {'id': job_id, 'status': job.state}
+    if job.state == 'done':
+        status['result'] = url_for('job_result', job_id=job_id)
+    elif job.error is not None:
+        status['error'] = str(job.error)
+        if getattr(job.error, 'details', None):
+            status.update(job.error.details)
+    return status
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    # Start a conversion in the background. Answers 202 with the job id right
+    # away; poll GET /jobs/<id> and fetch GET /jobs/<id>/result when done.
+    # kind is the route of the synchronous conversion, e.g. convert_python.
+    if kind not in JOB_KINDS:
+        return 'Unknown conversion', 404
+    if 'file' not in request.files:
+        return 'No file uploaded', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return 'No file selected', 400
+
+    data = file.read()
+    convert, mimetype, text = JOB_KINDS[kind]
+    args = ()
+    key = content_key(kind, CONVERTER_VERSION, data)
+    if not text and not zipfile.is_zipfile(io.BytesIO(data)):
+        return 'Upload a .zip archive', 400
+    if kind == 'render_pap':
+        source = pap_source(file.filename)
+        args = (source,)
+        key = content_key(f'render_pap/{PAP_VERSION}/{source}', CONVERTER_VERSION, data)
+    elif kind == 'convert_sketch':
+        output_format = request.args.get('format', 'mmd')
+        if output_format not in FORMATS:
+            return 'Unknown format', 400
+        function = request.args.get('function') or None
+        args = (output_format, function)
+        if output_format != 'mmd':
+            mimetype = 'image/svg+xml'
+        key = content_key(f'convert_sketch/{output_format}/{function or ""}', CONVERTER_VERSION, data)
+    elif kind == 'layout':
+        output_format = request.args.get('format', 'json')
+        if output_format not in nsd_layout.FORMATS:
+            return 'Unknown format', 400
+        source = pap_source(file.filename)
+        args = (source, output_format)
+        mimetype = LAYOUT_TYPES[output_format]
+        key = content_key(f'layout/{nsd_layout.LAYOUT_VERSION}/{source}/{output_format}', CONVERTER_VERSION, data)
+    elif kind in ('convert', 'convert_python_nsd', 'convert_arduino_nsd') and compact_svg():
+        args = (True,)
+        key = content_key(f'{kind}/compact', CONVERTER_VERSION, data)
+    elif kind == 'convert_batch':
+        formats = batch_formats()
+        if formats is None:
+            return 'Unknown format', 400
+        args = (app.config['BATCH_WORKERS'], formats, conversion_limits(), app.config['JOB_TIMEOUT'])
+        key = None  # Batch results are not cached
+
+    cached = result_cache.get(key) if key else None
+    if cached is not None:
+        job = completed_job(cached)
+    else:
+        try:
+            job = job_queue().submit(convert, data.decode('utf-8') if text else data, *args,
+                                     size=len(data), timeout=app.config['ASYNC_JOB_TIMEOUT'])
+        except QueueFull as e:
+            return busy_response(e)
+
+    job_id = secrets.token_urlsafe(16)
+    with _submitted_lock:
+        _expire_jobs()
+        submitted_jobs[job_id] = {'job': job, 'mimetype': mimetype, 'key': key}
+    response = jsonify(_job_status(job_id, job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job_id)
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    entry = _find_job(job_id)
+    if entry is None:
+        return 'Unknown job, or its result has expired', 404
+    return jsonify(_job_status(job_id, entry['job']))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    entry = _find_job(job_id)
+    if entry is None:
+        return 'Unknown job, or its result has expired', 404
+    job = entry['job']
+    if not job.done():
+        job_queue().cancel(job)
+        job.wait(1)  # A running job stops within a moment
+    return jsonify(_job_status(job_id, job))
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    entry = _find_job(job_id)
+    if entry is None:
+        return 'Unknown job, or its result has expired', 404
+    job = entry['job']
+    if not job.done():
+        return jsonify(_job_status(job_id, job)), 202
+    if job.state != 'done':
+        return jsonify(_job_status(job_id, job)), 409
+
+    output = job.result()
+    if isinstance(output, str):
+        output = output.encode('utf-8')
+    if entry['key'] is not None and entry['key'] not in result_cache:
+        result_cache.put(entry['key'], output)
+    response = Response(output, mimetype=entry['mimetype'])
+    if entry['mimetype'] == 'application/zip':
+        response.headers['Content-Disposition'] = 'attachment; filename=converted.zip'
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not app.config['METRICS_ENABLED']:
+        return 'Metrics are disabled', 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats')
+def cache_stats():
+    # Caches of this process; the hits of the caches in the worker processes
+    # (layout memo, PAP, Arduino parsing) are counted on /metrics
+    stats = result_cache.stats()
+    stats['not_modified'] = not_modified_count
+    stats['function_uploads'] = function_uploads.stats()
+    stats['jobs'] = jobs.stats() if jobs is not None else None
+    stats['submitted_jobs'] = len(submitted_jobs)
+    return jsonify(stats)
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # worker processes in the PyInstaller build
     app.run(debug=True)
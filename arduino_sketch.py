@@ -0,0 +1,302 @@
+# Multi-file Arduino sketches.
+#
+# A sketch folder holds several .ino tabs (which the Arduino IDE joins into one
+# file, main tab first) plus .h/.cpp files. Every file runs through a light
+# preprocessor (#define, #undef, #ifdef/#ifndef/#if/#elif/#else/#endif and
+# local #include "..." for defines), then is parsed into tokens, bracket table
+# and function table. Parse results are cached by the hash of the preprocessed
+# text, so after editing one tab only that tab is parsed again.
+
+import os
+import posixpath
+import re
+
+from arduino_to_mermaid import ArduinoToMermaidConverter, parse_source, strip_comments
+from batch import iter_zip_inputs
+from cache import LRUCache, content_key
+from converter import convert_graph_to_nsd
+from flowgraph import to_mermaid
+import metrics
+from pap_renderer import convert_graph_to_pap
+
+TAB_EXTENSIONS = ('.ino', '.pde')
+HEADER_EXTENSIONS = ('.h', '.hpp')
+SKETCH_EXTENSIONS = TAB_EXTENSIONS + HEADER_EXTENSIONS + ('.cpp', '.c')
+PARSE_CACHE_BYTES = 32 * 1024 * 1024
+
+def _parsed_size(parsed):
+    # Source text plus roughly 100 bytes per token for the three token lists,
+    # the bracket table and the list overhead
+    return len(parsed.source) + 100 * len(parsed.tokens)
+
+parse_cache = LRUCache(PARSE_CACHE_BYTES, sizeof=_parsed_size)
+metrics.register_cache('arduino_parse', parse_cache)
+
+_CONTINUATION_RE = re.compile(r'\\\r?\n')
+_DIRECTIVE_RE = re.compile(r'\s*#\s*(\w+)\s*(.*?)\s*$')
+_DEFINE_RE = re.compile(r'([A-Za-z_]\w*)(\([^)]*\))?\s*(.*)$')
+_INCLUDE_RE = re.compile(r'"([^"]+)"')
+_DEFINED_RE = re.compile(r'\bdefined\s*(?:\(\s*([A-Za-z_]\w*)\s*\)|([A-Za-z_]\w*))')
+_SIMPLE_VALUE_RE = re.compile(r'0[xX][0-9a-fA-F]+|\d+|[A-Za-z_]\w*')
+_EXPR_TOKEN_RE = re.compile(r'\s*(0[xX][0-9a-fA-F]+|\d+|[A-Za-z_]\w*|&&|\|\||[=!<>]=|[-+*/%()!<>])')
+
+def preprocess(source, defines=None, include=None):
+    """Resolve preprocessor directives in source.
+
+    Returns (text, defines): directive lines and inactive #if sections are
+    blanked out, defines are the macros defined at the end of the file.
+    include(name) is called for every active #include "name" and returns the
+    defines of that header (or None if it is not part of the sketch).
+    """
+    defines = dict(defines or {})
+    out = []
+    stack = []  # Per open #if: (enclosing section active, a branch was taken)
+    active = True
+
+    for line in _CONTINUATION_RE.sub(' ', strip_comments(source)).split('\n'):
+        m = _DIRECTIVE_RE.match(line)
+        if not m:
+            out.append(line if active else '')
+            continue
+        out.append('')
+        directive, rest = m.groups()
+
+        if directive in ('ifdef', 'ifndef', 'if'):
+            if directive == 'if':
+                taken = active and evaluate(rest, defines)
+            else:
+                taken = active and (rest.split()[0] in defines if rest else False) == (directive == 'ifdef')
+            stack.append((active, taken))
+            active = taken
+        elif directive == 'elif' and stack:
+            enclosing, taken = stack[-1]
+            active = enclosing and not taken and evaluate(rest, defines)
+            stack[-1] = (enclosing, taken or active)
+        elif directive == 'else' and stack:
+            enclosing, taken = stack[-1]
+            active = enclosing and not taken
+            stack[-1] = (enclosing, True)
+        elif directive == 'endif' and stack:
+            active = stack.pop()[0]
+        elif not active:
+            continue
+        elif directive == 'define':
+            d = _DEFINE_RE.match(rest)
+            if d:
+                # Function-like macros only count as defined
+                defines[d.group(1)] = None if d.group(2) else d.group(3)
+        elif directive == 'undef':
+            defines.pop(rest.split()[0] if rest else '', None)
+        elif directive == 'include' and include is not None:
+            name = _INCLUDE_RE.match(rest)
+            exported = include(name.group(1)) if name else None
+            if exported:
+                defines.update(exported)
+
+    return '\n'.join(out), defines
+
+def evaluate(expr, defines):
+    # Value of an #if expression. Unknown identifiers are 0 as in C;
+    # expressions that cannot be evaluated count as true, so the code stays.
+    expr = _DEFINED_RE.sub(lambda m: '1' if (m.group(1) or m.group(2)) in defines else '0', expr)
+    tokens = []
+    pos = 0
+    while pos < len(expr):
+        m = _EXPR_TOKEN_RE.match(expr, pos)
+        if not m:
+            if expr[pos:].strip():
+                return True
+            break
+        tokens.append(m.group(1))
+        pos = m.end()
+    try:
+        value, pos = _parse_expr(tokens, 0, defines, 0)
+    except (IndexError, ValueError, ZeroDivisionError, RecursionError):
+        return True
+    return pos != len(tokens) or bool(value)
+
+# Binary operators by precedence, lowest first
+_BINARY = (('||',), ('&&',), ('==', '!='), ('<', '<=', '>', '>='), ('+', '-'), ('*', '/', '%'))
+
+def _parse_expr(tokens, pos, defines, level):
+    if level == len(_BINARY):
+        return _parse_unary(tokens, pos, defines)
+    value, pos = _parse_expr(tokens, pos, defines, level + 1)
+    while pos < len(tokens) and tokens[pos] in _BINARY[level]:
+        op = tokens[pos]
+        right, pos = _parse_expr(tokens, pos + 1, defines, level + 1)
+        if op == '||': value = int(bool(value) or bool(right))
+        elif op == '&&': value = int(bool(value) and bool(right))
+        elif op == '==': value = int(value == right)
+        elif op == '!=': value = int(value != right)
+        elif op == '<': value = int(value < right)
+        elif op == '<=': value = int(value <= right)
+        elif op == '>': value = int(value > right)
+        elif op == '>=': value = int(value >= right)
+        elif op == '+': value += right
+        elif op == '-': value -= right
+        elif op == '*': value *= right
+        elif op == '/': value = int(value / right)
+        else: value = value - right * int(value / right)
+    return value, pos
+
+def _parse_unary(tokens, pos, defines):
+    token = tokens[pos]
+    if token == '!':
+        value, pos = _parse_unary(tokens, pos + 1, defines)
+        return int(not value), pos
+    if token == '-':
+        value, pos = _parse_unary(tokens, pos + 1, defines)
+        return -value, pos
+    if token == '(':
+        value, pos = _parse_expr(tokens, pos + 1, defines, 0)
+        if tokens[pos] != ')':
+            raise ValueError(')')
+        return value, pos + 1
+    return _macro_value(token, defines), pos + 1
+
+def _macro_value(token, defines, depth=0):
+    # Integer value of a number or of a macro defined as a number (or as
+    # another such macro)
+    if token[:2] in ('0x', '0X'):
+        return int(token, 16)
+    if token[0].isdigit():
+        return int(token)
+    value = (defines.get(token) or '').strip()
+    if not value or depth > 8 or not _SIMPLE_VALUE_RE.fullmatch(value):
+        return 0
+    return _macro_value(value, defines, depth + 1)
+
+class Sketch:
+    """The files of one Arduino sketch, by name relative to the sketch folder."""
+
+    def __init__(self, files, main=None):
+        self.files = dict(files)
+        self.main = main
+        self._headers = {}
+        self._parsed = None
+
+    @classmethod
+    def from_folder(cls, path):
+        files = {}
+        for root, dirs, filenames in os.walk(path):
+            dirs.sort()
+            for filename in filenames:
+                if filename.lower().endswith(SKETCH_EXTENSIONS):
+                    full = os.path.join(root, filename)
+                    with open(full, encoding='utf-8', errors='replace') as f:
+                        files[os.path.relpath(full, path).replace(os.sep, '/')] = f.read()
+        # The main tab is named after the sketch folder
+        folder = os.path.basename(os.path.normpath(path))
+        return cls(files, main=next((n for n in files if posixpath.splitext(n)[0] == folder), None))
+
+    @classmethod
+    def from_zip(cls, archive):
+        files = {name: data.decode('utf-8', errors='replace')
+                 for name, data in iter_zip_inputs(archive)
+                 if name.lower().endswith(SKETCH_EXTENSIONS)}
+        # A zipped sketch folder has all files under one top-level directory
+        prefixes = {name.split('/', 1)[0] for name in files}
+        if len(prefixes) == 1 and all('/' in name for name in files):
+            folder = prefixes.pop()
+            files = {name.split('/', 1)[1]: text for name, text in files.items()}
+            return cls(files, main=next((n for n in files if posixpath.splitext(n)[0] == folder), None))
+        return cls(files)
+
+    def update(self, name, text):
+        # Replace (or add) one file; only this file is parsed again
+        self.files[name] = text
+        self._headers = {}
+        self._parsed = None
+
+    def order(self):
+        # .ino tabs as the IDE joins them (main tab first, then by name),
+        # then the other source files and headers by name
+        tabs = sorted(n for n in self.files if n.lower().endswith(TAB_EXTENSIONS))
+        if self.main in tabs:
+            tabs.remove(self.main)
+            tabs.insert(0, self.main)
+        others = sorted(n for n in self.files if not n.lower().endswith(TAB_EXTENSIONS))
+        return tabs + others
+
+    def parsed_files(self):
+        # [(name, ParsedSource)] in order(). Defines flow from tab to tab, as
+        # in the joined .ino file; other files start from their own includes.
+        if self._parsed is None:
+            self._parsed = []
+            defines = {}
+            for name in self.order():
+                is_tab = name.lower().endswith(TAB_EXTENSIONS)
+                text, file_defines = preprocess(self.files[name], defines if is_tab else None,
+                                                self._include_from(name, set()))
+                if is_tab:
+                    defines = file_defines
+                self._parsed.append((name, self._parse(text)))
+        return self._parsed
+
+    def _parse(self, text):
+        key = content_key('arduino-parse', text)
+        parsed = parse_cache.get(key)
+        if parsed is None:
+            parsed = parse_source(text)
+            parse_cache.put(key, parsed)
+        return parsed
+
+    def _include_from(self, name, seen):
+        # include() callback for preprocess: defines of a local header,
+        # looked up next to the including file, then in the sketch folder
+        def include(header):
+            directory = posixpath.dirname(name)
+            for candidate in (posixpath.normpath(posixpath.join(directory, header)), header):
+                if candidate in self.files:
+                    return self._header_defines(candidate, seen)
+            return None
+        return include
+
+    def _header_defines(self, name, seen):
+        if name in self._headers:
+            return self._headers[name]
+        if name in seen:
+            return None  # Include cycle without guards
+        _, defines = preprocess(self.files[name], None, self._include_from(name, seen | {name}))
+        self._headers[name] = defines
+        return defines
+
+    def functions(self):
+        # {function name: file name}; the first definition wins
+        found = {}
+        for name, parsed in self.parsed_files():
+            for function in parsed.functions:
+                found.setdefault(function, name)
+        return found
+
+    def graph(self, function=None):
+        # Flowchart of the whole program (setup() then loop()), or of one function
+        parsed = dict(self.parsed_files())
+        functions = self.functions()
+        converter = ArduinoToMermaidConverter()
+        if function is None:
+            setup_file = parsed.get(functions.get('setup'))
+            loop_file = parsed.get(functions.get('loop'))
+            return converter.build_program(setup_file, loop_file)
+        if function not in functions:
+            raise KeyError(function)
+        return converter.build_function(parsed[functions[function]], function)
+
+def convert_sketch_to_mermaid(sketch, function=None):
+    return to_mermaid(sketch.graph(function))
+
+def convert_sketch_to_nsd(sketch, function=None):
+    return convert_graph_to_nsd(sketch.graph(function))
+
+def convert_sketch_to_pap(sketch, function=None):
+    return convert_graph_to_pap(sketch.graph(function))
+
+def convert_sketch_archive(archive, output_format='mmd', function=None):
+    # Zipped sketch straight to text; a plain function so it can run in a worker process
+    sketch = Sketch.from_zip(archive)
+    if output_format == 'nsd':
+        return convert_sketch_to_nsd(sketch, function)
+    if output_format == 'pap':
+        return convert_sketch_to_pap(sketch, function)
+    return convert_sketch_to_mermaid(sketch, function)
@@ -1,8 +1,101 @@
 import re
+from collections import namedtuple
+from converter import convert_graph_to_nsd
+from flowgraph import create_graph, to_mermaid
+import metrics
+
+# Node type in the flowchart graph per shape name used by the converter
+NODE_TYPES = {'box': 'process', 'diamond': 'decision', 'rounded': 'terminal', 'circle': 'terminal'}
+
+# The sketch is tokenized once and parsed by token index. Only the tokens the
+# parser needs (brackets, ';' and keywords) are kept; statement and condition
+# text is sliced from the source between them. match_brackets pairs every
+# bracket in a single stack pass, so finding the end of a block or condition
+# is a table lookup instead of a rescan of the text.
+_COMMENT_RE = re.compile(r'("(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\')|//[^\n]*|/\*.*?\*/', re.DOTALL)
+_TOKEN_RE = re.compile(r"""
+    "(?:\\.|[^"\\\n])*" | '(?:\\.|[^'\\\n])*'     # literals, skipped
+  | \b(?:if|else|while|for)\b
+  | [(){};]
+""", re.VERBOSE)
+
+_NAME_BEFORE_RE = re.compile(r'([A-Za-z_]\w*)\s*$')
+
+def strip_comments(source_code):
+    # Drop // and /* */ comments, leaving string and char literals alone. Line
+    # breaks inside block comments are kept so line numbers stay valid.
+    return _COMMENT_RE.sub(lambda m: m.group(1) or '\n' * m.group().count('\n'), source_code)
+
+def tokenize(source_code):
+    # Parallel lists of token text, start and end offsets
+    texts = []
+    starts = []
+    ends = []
+    for m in _TOKEN_RE.finditer(source_code):
+        text = m.group()
+        if text[0] in '"\'':
+            continue
+        texts.append(text)
+        starts.append(m.start())
+        ends.append(m.end())
+    return texts, starts, ends
+
+ParsedSource = namedtuple('ParsedSource', 'source tokens starts ends match functions')
+
+def parse_source(source_code):
+    # Tokens, bracket table and function table of one source file
+    source_code = strip_comments(source_code)
+    tokens, starts, ends = tokenize(source_code)
+    match = match_brackets(tokens)
+    functions = find_functions(source_code, tokens, starts, ends, match)
+    return ParsedSource(source_code, tokens, starts, ends, match, functions)
+
+def find_functions(source_code, tokens, starts, ends, match):
+    # {name: index of the '{' opening the body} of every top-level function
+    # definition, i.e. 'name(...) {' outside of any braces
+    functions = {}
+    n = len(tokens)
+    i = 0
+    while i < n:
+        token = tokens[i]
+        if token == '{':
+            i = match[i] + 1
+            continue
+        if token == '(':
+            close = match[i]
+            if close + 1 < n and tokens[close + 1] == '{' and not source_code[ends[close]:starts[close + 1]].strip():
+                m = _NAME_BEFORE_RE.search(source_code, ends[i - 1] if i else 0, starts[i])
+                if m:
+                    functions.setdefault(m.group(1), close + 1)
+                i = match[close + 1] + 1
+            else:
+                i = close + 1
+            continue
+        i += 1
+    return functions
+
+def match_brackets(texts):
+    # match[i] is the index of the bracket closing texts[i] (for '(' and
+    # '{'), or len(texts) if it is never closed
+    match = [len(texts)] * len(texts)
+    stack = []
+    for i, text in enumerate(texts):
+        if text == '(' or text == '{':
+            stack.append(i)
+        elif text == ')':
+            if stack and texts[stack[-1]] == '(':
+                match[stack.pop()] = i
+        elif text == '}':
+            # Parentheses left open inside the block end with it
+            while stack and texts[stack[-1]] == '(':
+                stack.pop()
+            if stack:
+                match[stack.pop()] = i
+    return match
 
 class ArduinoToMermaidConverter:
     def __init__(self):
-        self.lines = ["graph TD"]
+        self.graph = create_graph()
         self.node_counter = 0
         self.last_id = None
         self.loop_start_id = None
@@ -17,15 +110,7 @@ class ArduinoToMermaidConverter:
         label = label.replace('"', "'").strip()
         if not label: label = "Statement"
         
-        if shape == "box":
-            self.lines.append(f'{nid}["{label}"]')
-        elif shape == "diamond":
-            self.lines.append(f'{nid}{{"{label}"}}')
-        elif shape == "rounded":
-            self.lines.append(f'{nid}(["{label}"])')
-        elif shape == "circle":
-             self.lines.append(f'{nid}(({label}))')
-            
+        self.graph.add_node(nid, label=label, type=NODE_TYPES[shape])
         return nid
 
     def add_edge(self, from_id, to_id, label=None):
@@ -36,317 +121,193 @@ class ArduinoToMermaidConverter:
                 self.add_edge(fid, to_id, label)
             return
 
-        arrow = "-->"
-        if label:
-            arrow = f"-->|{label}|"
-        self.lines.append(f"{from_id} {arrow} {to_id}")
+        self.graph.add_edge(from_id, to_id, label=label or '')
 
     def convert(self, source_code):
-        # Remove comments
-        source_code = re.sub(r'//.*', '', source_code)
-        source_code = re.sub(r'/\*.*?\*/', '', source_code, flags=re.DOTALL)
-        
-        self.source = source_code
-        
-        # Find setup and loop
-        setup_match = re.search(r'void\s+setup\s*\(\s*\)\s*\{', source_code)
-        loop_match = re.search(r'void\s+loop\s*\(\s*\)\s*\{', source_code)
-        
+        return to_mermaid(self.build(source_code))
+
+    def build(self, source_code):
+        with metrics.stage('arduino_parse'):
+            parsed = parse_source(source_code)
+        with metrics.stage('arduino_build'):
+            return self.build_program(parsed, parsed)
+
+    def use(self, parsed):
+        # Parse from this file (a ParsedSource) from now on
+        self.source = parsed.source
+        self.tokens = parsed.tokens
+        self.starts = parsed.starts
+        self.ends = parsed.ends
+        self.match = parsed.match
+
+    def build_program(self, setup_file, loop_file):
+        # Flowchart of setup() followed by the repeated loop(); each comes
+        # from the given ParsedSource (they may differ in a multi-file sketch)
         start_node = self.add_node("Start", "rounded")
-        self.last_id = start_node
+        self.last_id = [start_node]
         
-        if setup_match:
-            setup_start = setup_match.end()
-            setup_end = self.find_matching_brace(source_code, setup_start - 1)
-            setup_body = source_code[setup_start:setup_end]
-            self.parse_block(setup_body)
-            
-        if loop_match:
-            loop_start = loop_match.end()
-            loop_end = self.find_matching_brace(source_code, loop_start - 1)
-            loop_body = source_code[loop_start:loop_end]
+        setup_start = setup_file.functions.get('setup') if setup_file else None
+        if setup_start is not None:
+            self.use(setup_file)
+            self.parse_block(setup_start + 1, self.match[setup_start], self.last_id)
             
+        loop_start = loop_file.functions.get('loop') if loop_file else None
+        if loop_start is not None:
+            self.use(loop_file)
             # Loop entry point
             loop_entry = self.add_node("Loop Start", "diamond")
             self.add_edge(self.last_id, loop_entry)
-            self.last_id = loop_entry
+            self.last_id = [loop_entry]
             
-            # Pass loop_entry as the current_id for the block, and indicate it's a loop body
-            self.parse_block(loop_body, current_id=loop_entry, is_loop_body=True)
+            # The loop body starts at loop_entry
+            self.parse_block(loop_start + 1, self.match[loop_start], [loop_entry])
             
             # Connect back to loop start if the loop body wasn't terminal
-            if self.last_id: # If last_id is None, it means the loop body was terminal
+            if self.last_id: # If last_id is empty, it means the loop body was terminal
                 self.add_edge(self.last_id, loop_entry)
             
             # Technically Arduino loop never ends, but for visualization we might show it
             # But here we just loop back.
             
-        return "\n".join(self.lines)
-
-    def find_matching_brace(self, text, start_index):
-        brace_count = 0
-        for i in range(start_index, len(text)):
-            if text[i] == '{':
-                brace_count += 1
-            elif text[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    return i
-        return len(text)
-
-    def extract_block(self, text):
-        """Helper to extract content within the first { } block."""
-        brace_count = 0
-        start = -1
-        for i, char in enumerate(text):
-            if char == '{':
-                if start == -1:
-                    start = i + 1
-                brace_count += 1
-            elif char == '}':
-                brace_count -= 1
-                if brace_count == 0 and start != -1:
-                    return text[start:i]
-        return "" # Should not happen for valid code
-
-    def parse_block(self, content, current_id=None, is_loop_body=False):
-        # Simple recursive descent parser for block content
-        # We look for: if, while, for, and statements ending in ;
-        
-        if current_id is None:
-            current_id = self.last_id
-
-        i = 0
-        while i < len(content):
-            # Skip whitespace
-            while i < len(content) and content[i].isspace():
-                i += 1
-            if i >= len(content): break
-    def parse_block(self, block_content, current_id=None, is_loop_body=False):
-        # Split into statements (basic implementation)
-        
-        # Initialize current_ids
-        if current_id is None:
-            current_ids = [self.last_id] if self.last_id else []
-        elif isinstance(current_id, list):
-            current_ids = current_id
-        else:
-            current_ids = [current_id]
-            
-        # Remove None values
+        return self.graph
+
+    def build_function(self, parsed, name):
+        # Flowchart of a single function defined in parsed
+        self.use(parsed)
+        body_start = parsed.functions[name]
+        start_node = self.add_node(f"Start {name}", "rounded")
+        self.last_id = [start_node]
+        self.parse_block(body_start + 1, self.match[body_start], self.last_id)
+        if self.last_id:
+            end_node = self.add_node(f"End {name}", "rounded")
+            self.add_edge(self.last_id, end_node)
+        return self.graph
+
+    def text(self, after, before):
+        # Source text between token 'after' (-1: start of the sketch) and token 'before'
+        start = self.ends[after] if after >= 0 else 0
+        return self.source[start:self.starts[before]].strip()
+
+    def parse_block(self, start, end, current_ids):
+        # Statements of tokens[start:end]. Returns the IDs the next statement
+        # connects from (an empty list if the block never finishes, e.g. an
+        # infinite loop) and keeps self.last_id in sync. An exit is a node ID
+        # or (node ID, edge label), e.g. the No branch of an if without else.
         current_ids = [pid for pid in current_ids if pid is not None]
         
-        remaining = block_content.strip()
-        
-        while remaining:
-            # Check for control structures
-            if remaining.startswith('if'):
-                # Handle If
-                match = re.search(r'if\s*\(.*\)\s*\{', remaining)
-                if match:
-                    if_body_start_idx = match.end() - 1
-                    if_body_end_idx = self.find_matching_brace(remaining, if_body_start_idx)
-                    
-                    full_if_part_len = if_body_end_idx + 1
-                    
-                    # Check for else
-                    temp_remaining = remaining[full_if_part_len:].strip()
-                    full_statement_len = full_if_part_len
-                    
-                    if temp_remaining.startswith('else'):
-                         # Extract else part
-                         else_match = re.search(r'else\s*(\s*if\s*\(.*?\)\s*)?\{', temp_remaining)
-                         if else_match:
-                             else_brace_rel_idx = else_match.end() - 1
-                             else_brace_abs_idx = full_statement_len + (len(remaining[full_statement_len:]) - len(temp_remaining)) + else_brace_rel_idx
-                             
-                             else_body_end_idx = self.find_matching_brace(remaining, else_brace_abs_idx)
-                             full_statement_len = else_body_end_idx + 1
-                    
-                    exits = self.parse_if(remaining[:full_statement_len], current_ids)
-                    
-                    current_ids = exits if isinstance(exits, list) else ([exits] if exits else [])
-                    remaining = remaining[full_statement_len:].strip()
-                    continue
-
-            elif remaining.startswith('while'):
-                 # Handle While
-                 match = re.search(r'while\s*\(.*\)\s*\{', remaining)
-                 if match:
-                     body_start_idx = match.end() - 1
-                     body_end_idx = self.find_matching_brace(remaining, body_start_idx)
-                     full_statement_len = body_end_idx + 1
-                     
-                     loop_exit = self.parse_while(remaining[:full_statement_len], current_ids)
-                     
-                     current_ids = [loop_exit] if loop_exit else []
-                     remaining = remaining[full_statement_len:].strip()
-                     continue
-
-            elif remaining.startswith('for'):
-                 # Handle For
-                 match = re.search(r'for\s*\(.*\)\s*\{', remaining)
-                 if match:
-                     body_start_idx = match.end() - 1
-                     body_end_idx = self.find_matching_brace(remaining, body_start_idx)
-                     full_statement_len = body_end_idx + 1
-                     
-                     loop_exit = self.parse_for(remaining[:full_statement_len], current_ids)
-                     
-                     current_ids = [loop_exit] if loop_exit else []
-                     remaining = remaining[full_statement_len:].strip()
-                     continue
-            
-            # Basic statement (ends with ;)
-            semicolon = remaining.find(';')
-            brace = remaining.find('{')
-            
-            if semicolon != -1 and (brace == -1 or semicolon < brace):
-                statement = remaining[:semicolon].strip()
-                remaining = remaining[semicolon+1:].strip()
-                
-                if not statement: continue
-                
-                # Create node
-                node_id = self.add_node(statement)
-                
-                # Connect all parents to this node
-                self.add_edge(current_ids, node_id)
-                
-                current_ids = [node_id]
-            else:
+        i = start
+        while i < end:
+            i, current_ids = self.parse_statement(i, end, current_ids)
+            if i is None:
                 # Unknown or complex structure
                 break
-                
-        # Return the last node ID(s) of this block
-        # If current_ids is empty, it means the block is terminal (e.g. infinite loop)
-        if not current_ids: 
-            self.last_id = None
-            return None
-            
-        final_id = current_ids[0] if len(current_ids) == 1 else current_ids
-        self.last_id = final_id
-        return final_id
 
-    def parse_if(self, content, current_id):
-        # Match if (condition) {
-        
-        open_paren = content.find('(')
-        if open_paren == -1: return current_id
-        
-        close_paren = self.find_matching_paren(content, open_paren)
-        condition = content[open_paren+1:close_paren].strip()
-        
-        brace_start = content.find('{', close_paren)
-        if brace_start == -1: return current_id
-        
-        brace_end = self.find_matching_brace(content, brace_start)
-        true_body = content[brace_start+1:brace_end]
+        self.last_id = current_ids
+        return current_ids
+
+    def parse_statement(self, i, end, current_ids):
+        # Parse one statement at tokens[i]. Returns (next index, exit IDs);
+        # the index is None if the statement cannot be parsed.
+        token = self.tokens[i]
+        if token in ('if', 'while', 'for') and i + 1 < end and self.tokens[i + 1] == '(':
+            close = self.match[i + 1]
+            if close + 1 < end:
+                return getattr(self, 'parse_' + token)(i + 1, close, end, current_ids)
+        if token == '{':
+            close = min(self.match[i], end)
+            return close + 1, self.parse_block(i + 1, close, current_ids)
+
+        # Basic statement (ends with ;)
+        j = i
+        while j < end and self.tokens[j] != ';':
+            if self.tokens[j] in ('{', '}'):
+                return None, current_ids
+            j += 1
+        if j == end:
+            return None, current_ids
+        
+        statement = self.text(i - 1, j)
+        if not statement:
+            return j + 1, current_ids
+        
+        # Create node
+        node_id = self.add_node(statement)
+        
+        # Connect all parents to this node
+        self.add_edge(current_ids, node_id)
+        
+        return j + 1, [node_id]
+
+    def parse_body(self, i, end, current_ids):
+        # Body of a control structure: a { } block or a single statement
+        if self.tokens[i] == '{':
+            close = min(self.match[i], end)
+            return close + 1, self.parse_block(i + 1, close, current_ids)
+        next_i, exits = self.parse_statement(i, end, current_ids)
+        return (end if next_i is None else next_i), exits
+
+    def parse_if(self, open_paren, close_paren, end, current_ids):
+        condition = self.text(open_paren, close_paren)
         
         # Create decision node
         decision_id = self.add_node(f"{condition}?", "diamond")
-        self.add_edge(current_id, decision_id)
+        self.add_edge(current_ids, decision_id)
         
         # True Branch
         self.pending_label = "Yes"
-        end_true = self.parse_block(true_body, decision_id)
+        i, end_true = self.parse_body(close_paren + 1, end, [decision_id])
         self.pending_label = None
         
-        # Check for else
-        remaining = content[brace_end+1:].strip()
-        end_false = None
-        
-        if remaining.startswith('else'):
-            else_brace_start = remaining.find('{')
-            if else_brace_start != -1:
-                else_brace_end = self.find_matching_brace(remaining, else_brace_start)
-                false_body = remaining[else_brace_start+1:else_brace_end]
-                
-                self.pending_label = "No"
-                end_false = self.parse_block(false_body, decision_id)
-                self.pending_label = None
-            else:
-                pass
-        
         # Collect exits
-        exits = []
-        if end_true:
-            if isinstance(end_true, list): exits.extend(end_true)
-            else: exits.append(end_true)
-            
-        if end_false:
-            if isinstance(end_false, list): exits.extend(end_false)
-            else: exits.append(end_false)
-        elif not remaining.startswith('else'):
-             # If no else, decision_id is an exit (No branch)
-             # We label it "No"
-             exits.append((decision_id, "No"))
+        exits = list(end_true)
+        
+        # Check for else; an 'else if' becomes a nested decision
+        if i + 1 < end and self.tokens[i] == 'else':
+            self.pending_label = "No"
+            i, end_false = self.parse_body(i + 1, end, [decision_id])
+            self.pending_label = None
+            exits.extend(end_false)
+        else:
+            # If no else, decision_id is an exit (No branch)
+            # We label it "No"
+            exits.append((decision_id, "No"))
              
-        return exits
+        return i, exits
 
-    def parse_while(self, content, current_id):
-        open_paren = content.find('(')
-        close_paren = self.find_matching_paren(content, open_paren)
-        condition = content[open_paren+1:close_paren].strip()
+    def parse_while(self, open_paren, close_paren, end, current_ids):
+        condition = self.text(open_paren, close_paren)
         
         # Check for infinite loop
         is_infinite = condition == 'true' or condition == '1'
         
-        brace_start = content.find('{', close_paren)
-        brace_end = self.find_matching_brace(content, brace_start)
-        body = content[brace_start+1:brace_end]
-        
-        loop_id = self.add_node(f"while({condition})", "diamond" if not is_infinite else "diamond")
-        # If infinite, maybe use a different shape or label?
-        # User wants "while(true)" in a diamond.
+        loop_id = self.add_node(f"while({condition})", "diamond")
+        self.add_edge(current_ids, loop_id)
         
-        self.add_edge(current_id, loop_id)
-        
-        self.pending_label = "True" if not is_infinite else None # Infinite loop body is just the path
-        # Actually, for while(true), we usually don't label the entry to body as "True" if it's the only path.
-        # But consistency is good.
-        
-        end_body = self.parse_block(body, loop_id, is_loop_body=True)
+        # Infinite loop body is just the path
+        self.pending_label = "True" if not is_infinite else None
+        i, end_body = self.parse_body(close_paren + 1, end, [loop_id])
         self.pending_label = None
         
         # Connect back
         self.add_edge(end_body, loop_id)
         
         if is_infinite:
-            return None # No exit
-        else:
-            return loop_id # Exit is the loop header (False branch)
+            return i, [] # No exit
+        return i, [loop_id] # Exit is the loop header (False branch)
 
-    def parse_for(self, content, current_id):
-        open_paren = content.find('(')
-        close_paren = self.find_matching_paren(content, open_paren)
-        header = content[open_paren+1:close_paren].strip()
-        
-        brace_start = content.find('{', close_paren)
-        brace_end = self.find_matching_brace(content, brace_start)
-        body = content[brace_start+1:brace_end]
+    def parse_for(self, open_paren, close_paren, end, current_ids):
+        header = self.text(open_paren, close_paren)
         
         loop_id = self.add_node(f"For {header}", "diamond")
-        self.add_edge(current_id, loop_id)
+        self.add_edge(current_ids, loop_id)
         
         self.pending_label = "Next"
-        end_body = self.parse_block(body, loop_id, is_loop_body=True)
+        i, end_body = self.parse_body(close_paren + 1, end, [loop_id])
         self.pending_label = None
         
         self.add_edge(end_body, loop_id)
         
-        return loop_id # Exit is loop header (Done)
-
-    def find_matching_paren(self, text, start_index):
-        count = 0
-        for i in range(start_index, len(text)):
-            if text[i] == '(':
-                count += 1
-            elif text[i] == ')':
-                count -= 1
-                if count == 0:
-                    return i
-        return len(text)
+        return i, [loop_id] # Exit is loop header (Done)
         
     # Override add_edge to handle pending label
     def add_edge(self, from_id, to_id, label=None):
@@ -358,18 +319,22 @@ class ArduinoToMermaidConverter:
             
         if isinstance(from_id, list):
             for item in from_id:
-                if isinstance(item, tuple):
-                    fid, lbl = item
-                    self.add_edge(fid, to_id, lbl or label)
-                else:
-                    self.add_edge(item, to_id, label)
+                self.add_edge(item, to_id, label)
             return
+        if isinstance(from_id, tuple):
+            # An exit with its own label, e.g. (decision ID, "No")
+            from_id, exit_label = from_id
+            label = exit_label or label
 
-        arrow = "-->"
-        if label:
-            arrow = f"-->|{label}|"
-        self.lines.append(f"{from_id} {arrow} {to_id}")
+        self.graph.add_edge(from_id, to_id, label=label or '')
 
 def convert_arduino_to_mermaid(source_code):
     converter = ArduinoToMermaidConverter()
     return converter.convert(source_code)
+
+def arduino_to_graph(source_code):
+    # Flowchart of an Arduino sketch as an in-memory graph (see flowgraph.py)
+    return ArduinoToMermaidConverter().build(source_code)
+
+def convert_arduino_to_nsd(source_code, compact=False):
+    return convert_graph_to_nsd(arduino_to_graph(source_code), compact)
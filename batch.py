@@ -0,0 +1,164 @@
+# Batch conversion of many files (e.g. a zipped assignment folder).
+#
+# Files are converted in worker processes of a JobQueue, so a file that runs
+# past its timeout is stopped on its own; results are written into a zip
+# archive as they complete, so the archive can be streamed to the client while
+# later files are still being converted. A failing file is recorded in the
+# manifest and never aborts the batch.
+
+import io
+import json
+import os
+import posixpath
+import time
+import zipfile
+
+from converter import convert_mermaid_to_nsd, convert_graph_to_nsd
+from flowgraph import to_mermaid
+from pap_renderer import convert_graph_to_pap, convert_mermaid_to_pap
+from python_to_mermaid import python_to_graph
+from arduino_to_mermaid import arduino_to_graph
+from job_queue import JobQueue, POLL_INTERVAL
+import limits
+
+# Source file converters, each building the flowchart graph of a file
+SOURCE_CONVERTERS = {
+    '.py': python_to_graph,
+    '.ino': arduino_to_graph,
+}
+MERMAID_EXTENSIONS = ('.mmd', '.mermaid')
+MANIFEST_NAME = 'manifest.json'
+FORMATS = ('mmd', 'nsd', 'pap')  # Mermaid flowchart text, structogram SVG, flowchart SVG
+DEFAULT_FORMATS = ('mmd', 'nsd')
+
+def is_supported(name):
+    ext = posixpath.splitext(name)[1].lower()
+    return ext in SOURCE_CONVERTERS or ext in MERMAID_EXTENSIONS
+
+def convert_file(name, data, formats=DEFAULT_FORMATS):
+    # Convert one file. Returns (outputs, status) where outputs maps output
+    # names to text. Runs in a worker process, so it must never raise.
+    base, ext = posixpath.splitext(name)
+    ext = ext.lower()
+    outputs = {}
+    try:
+        text = data.decode('utf-8')
+        if ext in SOURCE_CONVERTERS:
+            graph = SOURCE_CONVERTERS[ext](text)
+            if 'mmd' in formats:
+                outputs[base + '.mmd'] = to_mermaid(graph)
+            if 'nsd' in formats:
+                outputs[base + '.nsd.svg'] = convert_graph_to_nsd(graph)
+            if 'pap' in formats:
+                outputs[base + '.pap.svg'] = convert_graph_to_pap(graph)
+        elif ext in MERMAID_EXTENSIONS:
+            if 'nsd' in formats:
+                outputs[base + '.nsd.svg'] = convert_mermaid_to_nsd(text)
+            if 'pap' in formats:
+                outputs[base + '.pap.svg'] = convert_mermaid_to_pap(text)
+        else:
+            return outputs, {'name': name, 'status': 'skipped', 'outputs': []}
+        if not outputs:
+            return outputs, {'name': name, 'status': 'skipped', 'outputs': []}
+    except Exception as e:
+        return {}, {'name': name, 'status': 'error', 'outputs': [], 'error': f'{type(e).__name__}: {e}'}
+    return outputs, {'name': name, 'status': 'ok', 'outputs': sorted(outputs)}
+
+def safe_name(name):
+    # Archive member name without absolute paths or '..' components
+    parts = [p for p in posixpath.normpath(name.replace('\\', '/')).split('/') if p not in ('', '.', '..')]
+    return '/'.join(parts)
+
+def iter_zip_inputs(archive):
+    # (name, bytes) of every regular file in a zip archive (bytes or file-like)
+    if isinstance(archive, (bytes, bytearray)):
+        archive = io.BytesIO(archive)
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            name = safe_name(info.filename)
+            if info.is_dir() or not name or name.startswith('__MACOSX/'):
+                continue
+            yield name, zf.read(info)
+
+def iter_converted(inputs, max_workers=None, formats=DEFAULT_FORMATS, conversion_limits=None,
+                   timeout=None):
+    # Yield (outputs, status) per input file, in completion order. Unsupported
+    # files are reported as skipped without being sent to a worker. At most
+    # two files per worker are in flight, which bounds memory on large batches.
+    # conversion_limits ({limit name: maximum}, see limits.py) apply in every
+    # worker; a file over a limit, or one still converting after timeout
+    # seconds (its worker is killed), is recorded as an error.
+    max_workers = max_workers or os.cpu_count() or 1
+    inputs = iter(inputs)
+    workers = JobQueue(max_workers, max_depth=max_workers * 2, timeout=timeout,
+                       initializers=[(limits.configure, (conversion_limits or {},))])
+    pending = {}
+    try:
+        while True:
+            while len(pending) < max_workers * 2:
+                item = next(inputs, None)
+                if item is None:
+                    break
+                name, data = item
+                if not is_supported(name):
+                    yield {}, {'name': name, 'status': 'skipped', 'outputs': []}
+                    continue
+                pending[workers.submit(convert_file, name, data, formats)] = name
+            if not pending:
+                break
+            done = [job for job in pending if job.done()]
+            if not done:
+                time.sleep(POLL_INTERVAL)
+            for job in done:
+                name = pending.pop(job)
+                if job.error is None:
+                    yield job.result()
+                else:
+                    # Timed out, or the worker itself died (e.g. out of memory)
+                    e = job.error
+                    yield {}, {'name': name, 'status': 'error', 'outputs': [], 'error': f'{type(e).__name__}: {e}'}
+    finally:
+        workers.shutdown()
+
+class _ChunkSink:
+    # Write-only file object collecting what zipfile writes. It has no
+    # seek/tell, so zipfile streams entries with data descriptors.
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_batch_zip(archive, max_workers=None, formats=DEFAULT_FORMATS, conversion_limits=None,
+                   timeout=None):
+    # Convert every supported file of a zip archive and yield the result
+    # archive piece by piece: converted files plus manifest.json
+    sink = _ChunkSink()
+    statuses = []
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as out:
+        for outputs, status in iter_converted(iter_zip_inputs(archive), max_workers, formats,
+                                                  conversion_limits, timeout):
+            statuses.append(status)
+            for name, text in outputs.items():
+                out.writestr(name, text)
+            data = sink.take()
+            if data:
+                yield data
+        out.writestr(MANIFEST_NAME, json.dumps(build_manifest(statuses), indent=2))
+    yield sink.take()
+
+def build_manifest(statuses):
+    statuses = sorted(statuses, key=lambda s: s['name'])
+    summary = {'ok': 0, 'error': 0, 'skipped': 0}
+    for status in statuses:
+        summary[status['status']] += 1
+    return {'files': statuses, 'summary': summary}
@@ -0,0 +1,60 @@
+# Benchmark for the Arduino sketch parser on large generated sketches.
+#
+#   python -m benchmarks.bench_arduino_parser [lines]
+#
+# Parsing must stay linear: doubling the sketch may at most about double the
+# time (checked with MAX_SCALING), and 20,000 lines parse well within a second.
+
+import sys
+import time
+
+from arduino_to_mermaid import arduino_to_graph
+
+MAX_SCALING = 2.6  # Allowed time ratio between a sketch and one half its size
+
+def generate_sketch(lines):
+    # Sequences of statements with nested if/else, while and for blocks,
+    # repeated until the sketch has about the requested number of lines
+    block = [
+        "  digitalWrite(LED_BUILTIN, HIGH); // LED on",
+        "  if (analogRead(A{i}) > 512) {{",
+        "    for (int j = 0; j < {i}; j++) {{",
+        "      value{i} += j; /* accumulate */",
+        "      if (value{i} > 100) {{",
+        "        Serial.println(\"overflow {{}} (\" );",
+        "      }}",
+        "    }}",
+        "  }} else {{",
+        "    while (digitalRead({i}) == LOW) {{",
+        "      delay(10);",
+        "    }}",
+        "  }}",
+    ]
+    body = []
+    i = 0
+    while len(body) < lines - 6:
+        body.extend(line.format(i=i) for line in block)
+        i += 1
+    half = len(body) // 2
+    return "\n".join(["void setup() {"] + body[:half] + ["}", "", "void loop() {"] + body[half:] + ["}"])
+
+def time_parse(source):
+    start = time.perf_counter()
+    graph = arduino_to_graph(source)
+    return time.perf_counter() - start, graph
+
+def main(lines=20_000):
+    seconds, graph = time_parse(generate_sketch(lines))
+    half_seconds, _ = time_parse(generate_sketch(lines // 2))
+    scaling = seconds / half_seconds
+    print(f"sketch lines:      {lines}")
+    print(f"graph:             {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges")
+    print(f"parse time:        {seconds:.3f} s ({lines / seconds:,.0f} lines/s)")
+    print(f"time x2 lines:     {scaling:.2f}x")
+    ok = scaling <= MAX_SCALING
+    print(f"linear scaling: {'met' if ok else 'MISSED'}")
+    return ok
+
+if __name__ == "__main__":
+    ok = main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,89 @@
+# Memory benchmark: slotted block tree vs. the dict-per-block layout it replaced.
+#
+#   python -m benchmarks.bench_block_memory [statements]
+#
+# Builds and lays out one structogram, then rebuilds the same laid-out tree as
+# plain dicts (the representation used before blocks.py) and compares what the
+# two trees themselves take: the blocks (or dicts) and their child lists. The
+# labels, subtree keys and layout numbers are the same objects in both trees
+# and are left out of both figures.
+
+import sys
+
+from converter import (parse_mermaid, find_loops, find_post_dominators, build_structure,
+                       calculate_min_widths, calculate_heights, iter_blocks)
+
+def generate_mermaid(statements):
+    # Repeating pattern of a loop around an if/else plus a few plain statements
+    lines = ["graph TD", "n0([Start])"]
+    prev = "n0"
+    i = 1
+    while i < statements:
+        h, d, a, b, c = (f"n{i + k}" for k in range(5))
+        lines.append(f'{h}{{"i{i} < 10?"}}')
+        lines.append(f'{d}{{"x{i} > 5?"}}')
+        lines.append(f'{a}["print(x{i})"]')
+        lines.append(f'{b}["x{i} = x{i} - 1"]')
+        lines.append(f'{c}["i{i} = i{i} + 1"]')
+        lines.append(f"{prev} --> {h}")
+        lines.append(f"{h} -->|True| {d}")
+        lines.append(f"{d} -->|Yes| {a}")
+        lines.append(f"{d} -->|No| {b}")
+        lines.append(f"{a} --> {c}")
+        lines.append(f"{b} --> {c}")
+        lines.append(f"{c} --> {h}")
+        prev = h
+        i += 5
+    lines.append(f"{prev} -->|False| stop([End])")
+    return "\n".join(lines)
+
+def to_dicts(blocks):
+    # The same tree with every block as a dict carrying the same fields
+    converted = {}
+    for block in iter_blocks(blocks):
+        d = {'type': block.type}
+        for cls in type(block).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                value = getattr(block, name)
+                d[name] = [] if isinstance(value, list) else value
+        converted[id(block)] = d
+    for block in iter_blocks(blocks):
+        d = converted[id(block)]
+        for name in ('yes', 'no', 'body'):
+            if name in d:
+                d[name] = [converted[id(child)] for child in getattr(block, name)]
+    return [converted[id(block)] for block in blocks]
+
+def tree_bytes(blocks, children):
+    # Size of the nodes and child lists of a tree; children(node) gives the
+    # child lists of a node
+    total = sys.getsizeof(blocks)
+    stack = list(blocks)
+    while stack:
+        node = stack.pop()
+        total += sys.getsizeof(node)
+        for seq in children(node):
+            total += sys.getsizeof(seq)
+            stack.extend(seq)
+    return total
+
+def main(statements=20000):
+    graph, start = parse_mermaid(generate_mermaid(statements))
+    loops = find_loops(graph, start)
+    post_doms = find_post_dominators(graph, start, loops)
+
+    blocks = build_structure(graph, start, None, set(), loops, post_doms)
+    width = max(800, calculate_min_widths(blocks))
+    calculate_heights(blocks, width)
+    count = sum(1 for _ in iter_blocks(blocks))
+    slotted_bytes = tree_bytes(blocks, lambda block: block.children())
+    dict_bytes = tree_bytes(to_dicts(blocks), lambda d: [d[name] for name in ('yes', 'no', 'body') if name in d])
+
+    print(f"blocks:        {count}")
+    print(f"slotted tree:  {slotted_bytes / 1024:10.1f} KiB  ({slotted_bytes / count:6.1f} B/block)")
+    print(f"dict tree:     {dict_bytes / 1024:10.1f} KiB  ({dict_bytes / count:6.1f} B/block)")
+    print(f"saving:        {100 * (1 - slotted_bytes / dict_bytes):9.1f} %")
+    return slotted_bytes, dict_bytes
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,57 @@
+# Throughput benchmark for the Mermaid tokenizer behind parse_mermaid.
+#
+#   python -m benchmarks.bench_mermaid_tokenizer [edge_lines]
+#
+# Target: at least 1,000,000 edge lines per minute on one core.
+
+import sys
+import time
+
+from converter import parse_mermaid
+from mermaid_parser import iter_statements
+
+TARGET_LINES_PER_MINUTE = 1_000_000
+
+def generate_edge_lines(count):
+    # Mix of the edge forms the converters and hand-written files use
+    forms = [
+        'n{a}["x{a} = x{a} + 1"] --> n{b}["print(x{a})"]',
+        'n{a}{{"i{a} < 10?"}} -->|Yes| n{b}',
+        'n{a} -- no --> n{b}([End {b}])',
+        'n{a} -.-> n{b} --> n{c}',
+        'n{a} & n{b} ==> n{c}',
+        'n{a} --> n{b}',
+    ]
+    lines = ["flowchart TD"]
+    for i in range(count):
+        lines.append(forms[i % len(forms)].format(a=i, b=i + 1, c=i + 2))
+    return "\n".join(lines)
+
+def run(count):
+    content = generate_edge_lines(count)
+
+    start = time.perf_counter()
+    for _ in iter_statements(content):
+        pass
+    tokenize_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parse_mermaid(content)
+    parse_seconds = time.perf_counter() - start
+
+    return tokenize_seconds, parse_seconds
+
+def main(count=200_000):
+    tokenize_seconds, parse_seconds = run(count)
+    tokenize_rate = count / tokenize_seconds * 60
+    parse_rate = count / parse_seconds * 60
+    print(f"edge lines:          {count}")
+    print(f"tokenizer only:      {tokenize_rate:12,.0f} lines/min")
+    print(f"parse_mermaid total: {parse_rate:12,.0f} lines/min")
+    ok = parse_rate >= TARGET_LINES_PER_MINUTE
+    print(f"target {TARGET_LINES_PER_MINUTE:,} lines/min: {'met' if ok else 'MISSED'}")
+    return ok
+
+if __name__ == "__main__":
+    ok = main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,157 @@
+# Benchmark suite: time and peak memory per stage on synthetic workloads.
+#
+#   python -m benchmarks.bench_suite [--quick] [-o results.json] [--baseline old.json]
+#                                    [--threshold 0.25] [--only NAME ...]
+#
+# Every workload of benchmarks/workloads.py runs through the stages of its
+# converter: parse, structure, layout and render for Mermaid input
+# (convert_mermaid_to_nsd), build and mermaid_text for Python and Arduino
+# sources. The time of a stage is the best of --repeat runs; its peak memory
+# is measured in a separate traced run, as tracemalloc slows everything down.
+#
+# With --baseline, a stage that got slower (or needs more memory) by more
+# than --threshold compared to an earlier results file is a regression and
+# the exit status is 1. Differences below MIN_SECONDS / MIN_BYTES are noise.
+
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from arduino_to_mermaid import ArduinoToMermaidConverter, parse_source
+from benchmarks.workloads import WORKLOADS
+from converter import (parse_mermaid, find_loops, find_post_dominators, build_structure,
+                       calculate_min_widths, calculate_heights, render_blocks, layout_memo)
+from flowgraph import to_mermaid
+from python_to_mermaid import python_to_graph
+
+MIN_SECONDS = 0.01
+MIN_BYTES = 256 * 1024
+
+def _structure(parsed):
+    graph, start = parsed
+    loops = find_loops(graph, start)
+    post_doms = find_post_dominators(graph, start, loops)
+    return build_structure(graph, start, None, set(), loops, post_doms)
+
+def _layout(blocks):
+    width = max(800, calculate_min_widths(blocks, layout_memo))
+    calculate_heights(blocks, width, layout_memo)
+    return blocks, width
+
+def _render(laid_out):
+    blocks, width = laid_out
+    return render_blocks(blocks, 0, 0, width, layout_memo)
+
+def _arduino_build(parsed):
+    return ArduinoToMermaidConverter().build_program(parsed, parsed)
+
+# Stages per converter: (name, function of the previous stage's result)
+STAGES = {
+    'mermaid': [('parse', parse_mermaid), ('structure', _structure), ('layout', _layout), ('render', _render)],
+    'python': [('build', python_to_graph), ('mermaid_text', to_mermaid)],
+    'arduino': [('parse', parse_source), ('build', _arduino_build), ('mermaid_text', to_mermaid)],
+}
+
+def run_stages(stages, source, trace_memory=False):
+    # {stage: seconds} or, with trace_memory, {stage: peak bytes above the
+    # memory in use when the stage started}
+    layout_memo.clear()  # Every run lays out from scratch
+    results = {}
+    value = source
+    for name, fn in stages:
+        if trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            value = fn(value)
+            results[name] = tracemalloc.get_traced_memory()[1] - base
+        else:
+            gc.collect()  # Garbage of the previous stage is not this stage's cost
+            start = time.perf_counter()
+            value = fn(value)
+            results[name] = time.perf_counter() - start
+    return results
+
+def run_workload(name, quick=False, repeat=5):
+    converter, generate, full_size, quick_size = WORKLOADS[name]
+    size = quick_size if quick else full_size
+    source = generate(size)
+    stages = STAGES[converter]
+
+    runs = [run_stages(stages, source) for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        memory = run_stages(stages, source, trace_memory=True)
+    finally:
+        tracemalloc.stop()
+
+    result = {'converter': converter, 'size': size, 'input_bytes': len(source), 'stages': {}}
+    for stage, _ in stages:
+        result['stages'][stage] = {
+            'seconds': round(min(run[stage] for run in runs), 6),
+            'peak_bytes': memory[stage],
+        }
+    result['seconds'] = round(sum(s['seconds'] for s in result['stages'].values()), 6)
+    return result
+
+def compare(results, baseline, threshold):
+    # Regressions as human-readable lines
+    regressions = []
+    for name, workload in results['workloads'].items():
+        old = baseline.get('workloads', {}).get(name)
+        if old is None or old.get('size') != workload['size']:
+            continue
+        for stage, now in workload['stages'].items():
+            before = old['stages'].get(stage)
+            if before is None:
+                continue
+            for key, floor in (('seconds', MIN_SECONDS), ('peak_bytes', MIN_BYTES)):
+                if now[key] - before[key] > floor and now[key] > before[key] * (1 + threshold):
+                    regressions.append(f"{name}/{stage}: {key} {before[key]} -> {now[key]} "
+                                       f"(+{now[key] / max(before[key], 1e-9) - 1:.0%})")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Time and memory per converter stage on synthetic inputs.')
+    parser.add_argument('-o', '--output', default='bench_results.json', help='where to write the results (JSON)')
+    parser.add_argument('--baseline', help='earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown/memory growth per stage (default: 0.25 = 25%%)')
+    parser.add_argument('--quick', action='store_true', help='small inputs, for a fast check')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per workload (default: 5)')
+    parser.add_argument('--only', nargs='+', choices=sorted(WORKLOADS), help='run only these workloads')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'quick': args.quick,
+        'workloads': {},
+    }
+    for name in args.only or WORKLOADS:
+        workload = run_workload(name, args.quick, args.repeat)
+        results['workloads'][name] = workload
+        stages = ', '.join(f"{stage} {s['seconds'] * 1000:.1f} ms / {s['peak_bytes'] / 1024 / 1024:.1f} MiB"
+                           for stage, s in workload['stages'].items())
+        print(f"{name:22} size {workload['size']:>6}: {stages}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Synthetic inputs of scalable size for the benchmark suite.
+#
+# Mermaid shapes that stress different parts of the converter: long chains
+# (parsing, rendering), deeply nested ifs (post-dominators, layout depth),
+# wide else-if fans (many branches meeting in one node) and nested loops
+# (loop forest). Python and Arduino sources mix statements, branches and loops.
+
+from benchmarks.bench_arduino_parser import generate_sketch
+
+def mermaid_chain(nodes):
+    lines = ["graph TD", "n0([Start])"]
+    for i in range(1, nodes):
+        lines.append(f'n{i}["x{i} = x{i - 1} + {i}"]')
+        lines.append(f"n{i - 1} --> n{i}")
+    lines.append(f"n{nodes - 1} --> stop([End])")
+    return "\n".join(lines)
+
+def mermaid_deep_if(depth):
+    # if c0: if c1: ... else: p1 ... else: p0, each level with its own merge
+    lines = ["graph TD", "s([Start]) --> d0"]
+    for i in range(depth):
+        lines.append(f'd{i}{{"c{i} > {i}?"}}')
+        inner = f"d{i + 1}" if i + 1 < depth else "leaf"
+        lines.append(f"d{i} -->|Yes| {inner}")
+        lines.append(f'd{i} -->|No| p{i}["y{i} = {i}"]')
+        lines.append(f'p{i} --> m{i}["z{i} = y{i}"]')
+        lines.append(f"m{i} --> " + (f"m{i - 1}" if i else "stop([End])"))
+    lines.append(f'leaf["innermost"] --> m{depth - 1}')
+    return "\n".join(lines)
+
+def mermaid_wide_fan(width):
+    # else-if cascade: width cases that all continue at one node
+    lines = ["graph TD", "s([Start]) --> c0"]
+    for i in range(width):
+        lines.append(f'c{i}{{"case == {i}?"}}')
+        lines.append(f'c{i} -->|Yes| a{i}["handle({i})"]')
+        lines.append(f"a{i} --> join")
+        lines.append(f"c{i} -->|No| " + (f"c{i + 1}" if i + 1 < width else "other"))
+    lines.append('other["handle_default()"] --> join')
+    lines.append('join["done()"] --> stop([End])')
+    return "\n".join(lines)
+
+def mermaid_nested_loops(nests, depth=6):
+    # nests loop nests one after another, each depth loops deep
+    lines = ["graph TD", "s([Start])"]
+    prev = "s"
+    for n in range(nests):
+        heads = [f"l{n}_{k}" for k in range(depth)]
+        for k, head in enumerate(heads):
+            lines.append(f'{head}{{"i{k} < {n + k}?"}}')
+        lines.append(f"{prev} --> {heads[0]}")
+        for k, head in enumerate(heads):
+            inner = heads[k + 1] if k + 1 < depth else f"b{n}"
+            lines.append(f"{head} -->|Yes| {inner}")
+            if k:
+                # Leaving an inner loop steps the outer one
+                lines.append(f'{head} -->|No| st{n}_{k}["i{k - 1} += 1"]')
+                lines.append(f"st{n}_{k} --> {heads[k - 1]}")
+        lines.append(f'b{n}["work({n})"] --> {heads[-1]}')
+        lines.append(f'{heads[0]} -->|No| after{n}["nest {n} done"]')
+        prev = f"after{n}"
+    lines.append(f"{prev} --> stop([End])")
+    return "\n".join(lines)
+
+def python_source(statements):
+    # Functions of ifs, for and while loops, called from a main block
+    block = [
+        "    total = 0",
+        "    for i in range(n):",
+        "        if i % 3 == 0:",
+        "            total += i",
+        "        elif i % 3 == 1:",
+        "            total -= 1",
+        "        else:",
+        "            while total > 100:",
+        "                total //= 2",
+        "    print(total)",
+    ]
+    lines = []
+    f = 0
+    while len(lines) < statements:
+        lines.append(f"def step{f}(n):")
+        lines.extend(block)
+        lines.append(f"    return total + {f}")
+        lines.append("")
+        f += 1
+    lines.extend(f"print(step{i}({i}))" for i in range(f))
+    return "\n".join(lines) + "\n"
+
+def arduino_source(lines):
+    return generate_sketch(lines)
+
+# Workloads of the suite: name -> (converter, generator, full size, quick size)
+WORKLOADS = {
+    'mermaid_chain': ('mermaid', mermaid_chain, 20000, 2000),
+    'mermaid_deep_if': ('mermaid', mermaid_deep_if, 300, 50),
+    'mermaid_wide_fan': ('mermaid', mermaid_wide_fan, 1000, 100),
+    'mermaid_nested_loops': ('mermaid', mermaid_nested_loops, 1000, 100),
+    'python': ('python', python_source, 20000, 2000),
+    'arduino': ('arduino', arduino_source, 20000, 2000),
+}
@@ -0,0 +1,74 @@
+# Block tree of a structogram (Nassi-Shneiderman diagram).
+# build_structure creates the blocks, calculate_min_widths and calculate_heights
+# fill in the layout fields and render_blocks reads them. Every block class uses
+# __slots__, so a block costs a fixed handful of pointers instead of a dict.
+
+class Block:
+    __slots__ = ('label', 'min_width', 'height')
+    type = None
+
+    def __init__(self, label):
+        self.label = label
+        self.min_width = 0
+        self.height = 0
+
+    def children(self):
+        # Child sequences in rendering order
+        return ()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.label!r})'
+
+class Process(Block):
+    __slots__ = ()
+    type = 'process'
+
+class Compound(Block):
+    # Block with child sequences. key/size describe the subtree (see
+    # converter.compute_subtree_keys); unit marks a subtree whose layout and
+    # SVG are memoized as a whole, fragment holds its reused SVG.
+    __slots__ = ('key', 'size', 'unit', 'fragment')
+
+    def __init__(self, label):
+        super().__init__(label)
+        self.key = None
+        self.size = 0
+        self.unit = False
+        self.fragment = None
+
+class Decision(Compound):
+    __slots__ = ('yes', 'no',
+                 'yes_min_width', 'no_min_width',
+                 'header_height', 'content_height', 'yes_width', 'no_width')
+    type = 'decision'
+
+    def __init__(self, label, yes=None, no=None):
+        super().__init__(label)
+        self.yes = yes if yes is not None else []
+        self.no = no if no is not None else []
+        self.yes_min_width = 0
+        self.no_min_width = 0
+        self.header_height = 0
+        self.content_height = 0
+        self.yes_width = 0
+        self.no_width = 0
+
+    def children(self):
+        return (self.yes, self.no)
+
+class Loop(Compound):
+    __slots__ = ('body',
+                 'body_min_width',
+                 'header_height', 'body_height', 'body_width')
+    type = 'loop'
+
+    def __init__(self, label, body=None):
+        super().__init__(label)
+        self.body = body if body is not None else []
+        self.body_min_width = 0
+        self.header_height = 0
+        self.body_height = 0
+        self.body_width = 0
+
+    def children(self):
+        return (self.body,)
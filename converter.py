@@ -1,73 +1,158 @@
-import networkx as nx
-import re
+import hashlib
 import html
 import math
+from blocks import Process, Decision, Loop
+from cache import LRUCache
+from flowgraph import create_graph
+from limits import check_graph
+import metrics
+from mermaid_parser import iter_statements, parse_node
+from textmetrics import text_width as measure_text, wrap_text
 
 # Constants for layout
 FONT_SIZE = 14
-CHAR_WIDTH_AVG = 8  # Approximate width of a character in pixels
 LINE_HEIGHT = 20
 PADDING_X = 10
 PADDING_Y = 10
 MIN_BLOCK_WIDTH = 100
 LOOP_INDENT = 30  # Width of the side bar for loops
+MIN_DIAGRAM_WIDTH = 800
 
-def convert_mermaid_to_nsd(mermaid_content):
-    graph, start_node = parse_mermaid(mermaid_content)
-    if not start_node:
-        return '<svg><text>Error: No start node found</text></svg>'
-        
-    structured_tree = build_structure(graph, start_node, None, set())
-    
-    # 1. Calculate Minimum Widths
-    total_min_width = calculate_min_widths(structured_tree)
-    
-    # Ensure a reasonable total width
-    width = max(800, total_min_width)
-    
-    # 2. Calculate Heights
-    total_height = calculate_heights(structured_tree, width)
+# Bump whenever the output for the same input changes (cache keys and ETags use it)
+CONVERTER_VERSION = '4'
+
+STREAM_CHUNK_SIZE = 64 * 1024  # Characters per chunk handed to a streaming sink
+
+# Subtree memoization: the largest decision/loop subtrees with between
+# MEMO_MIN_BLOCKS and MEMO_MAX_BLOCKS blocks are memoized as units, keyed by a
+# structural hash. The memo is shared by all conversions in this process.
+MEMO_MIN_BLOCKS = 4
+MEMO_MAX_BLOCKS = 256
+LAYOUT_MEMO_BYTES = 32 * 1024 * 1024
+
+def _memo_sizeof(value):
+    # Min-width entries hold a few numbers per block, SVG entries a fragment and a height
+    return 64 + sum(len(part) if isinstance(part, str) else 32 for part in value)
+
+layout_memo = LRUCache(LAYOUT_MEMO_BYTES, sizeof=_memo_sizeof)
+metrics.register_cache('layout_memo', layout_memo)
+
+# Compact output: shared styles in a <style> block instead of attributes on
+# every element, coordinates rounded to one decimal, the lines of a label in
+# one <text> and memoized subtrees drawn once in <defs> and placed with <use>
+COMPACT_STYLE = ('<style>.nsd{font:14px Arial,sans-serif}.nsd rect{fill:#fff;stroke:#000}'
+                 '.nsd path{fill:none;stroke:#000}.nsd .h{fill:#f0f0f0}.nsd .l{fill:#e0e0e0}'
+                 '.nsd .m{text-anchor:middle}.nsd .s{font-size:12px;text-anchor:middle}</style>')
+
+def convert_mermaid_to_nsd(mermaid_content, compact=False):
+    return "".join(iter_nsd_svg(mermaid_content, compact=compact))
+
+def write_nsd_svg(mermaid_content, sink):
+    # Write the structogram into any file-like object with a write() method
+    for chunk in iter_nsd_svg(mermaid_content):
+        sink.write(chunk)
+
+def iter_nsd_svg(mermaid_content, chunk_size=STREAM_CHUNK_SIZE, compact=False):
+    # Parsing and layout run right away so errors surface before anything is
+    # sent; the returned generator then only renders.
+    with metrics.stage('parse'):
+        graph, start_node = parse_mermaid(mermaid_content)
+    return iter_graph_svg(graph, chunk_size, start_node, compact)
+
+def convert_graph_to_nsd(graph, compact=False):
+    # Structogram of a flowchart graph built in memory (see flowgraph.py),
+    # e.g. by the Python or Arduino converter, without going through Mermaid text
+    return "".join(iter_graph_svg(graph, compact=compact))
+
+def iter_graph_svg(graph, chunk_size=STREAM_CHUNK_SIZE, start_node=None, compact=False):
+    structured_tree = structure_graph(graph, start_node)
+    if structured_tree is None:
+        return iter(['<svg><text>Error: No start node found</text></svg>'])
     
-    svg_content = render_blocks(structured_tree, 0, 0, width)
+    with metrics.stage('layout'):
+        # 1. Calculate Minimum Widths
+        total_min_width = calculate_min_widths(structured_tree, layout_memo)
+        
+        # Ensure a reasonable total width
+        width = max(MIN_DIAGRAM_WIDTH, total_min_width)
+        
+        # 2. Calculate Heights
+        total_height = calculate_heights(structured_tree, width, layout_memo, compact)
     
-    return f'<svg width="{width}" height="{total_height}" xmlns="http://www.w3.org/2000/svg" style="font-family: Arial, sans-serif;">{svg_content}</svg>'
+    chunks = _chunked(_iter_svg_document(structured_tree, width, total_height, compact), chunk_size)
+    return metrics.timed_iter('render', chunks, 'svg')
 
-def parse_mermaid(content):
-    G = nx.DiGraph()
-    lines = content.split('\n')
+def structure_graph(graph, start_node=None):
+    # Block tree of a flowchart graph, None if it has no start node
+    check_graph(graph)  # Before the structuring, which is what large graphs make slow
+    metrics.observe('pap_graph_nodes', graph.number_of_nodes())
+    metrics.observe('pap_graph_edges', graph.number_of_edges())
+    if start_node is None:
+        start_node = find_start_node(graph)
+    if not start_node:
+        return None
+        
+    with metrics.stage('structure'):
+        loops = find_loops(graph, start_node)
+        post_doms = find_post_dominators(graph, start_node, loops)
+        return build_structure(graph, start_node, None, set(), loops, post_doms)
+
+def _iter_svg_document(blocks, width, height, compact=False):
+    if compact:
+        yield (f'<svg class="nsd" width="{_n(width)}" height="{_n(height)}" xmlns="http://www.w3.org/2000/svg" '
+               f'xmlns:xlink="http://www.w3.org/1999/xlink">{COMPACT_STYLE}')
+    else:
+        yield f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg" style="font-family: Arial, sans-serif;">'
+    yield from iter_render_blocks(blocks, 0, 0, width, layout_memo, compact)
+    yield '</svg>'
+
+def _n(value):
+    # Coordinate for compact output: at most one decimal, no trailing ".0"
+    text = f'{value:.1f}'
+    return text[:-2] if text.endswith('.0') else text
+
+def _fragment_key(block, width, compact):
+    return ('svgc' if compact else 'svg', block.key, width)
+
+def _chunked(parts, chunk_size):
+    # Coalesce the many small per-block pieces into chunks of about chunk_size
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+def parse_mermaid(content, backend=None):
+    G = create_graph(backend)
     
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('graph') or line.startswith('%%') or line.startswith('subgraph'):
-            continue
-            
-        if '-->' in line:
-            parts = line.split('-->')
-            left_part = parts[0].strip()
-            right_part = parts[1].strip()
-            
-            left_id, left_label, left_type = parse_node_str(left_part)
-            if left_id:
-                if left_id not in G: G.add_node(left_id, label=left_label, type=left_type)
-                
-            edge_label = ""
-            if right_part.startswith('|'):
-                end_pipe = right_part.find('|', 1)
-                if end_pipe != -1:
-                    edge_label = right_part[1:end_pipe]
-                    right_part = right_part[end_pipe+1:].strip()
-            
-            right_id, right_label, right_type = parse_node_str(right_part)
-            if right_id:
-                if right_id not in G: G.add_node(right_id, label=right_label, type=right_type)
+    for item in iter_statements(content):
+        kind = item[0]
+        if kind == 'node':
+            _, node_id, label, node_type = item
+            if label is not None:
+                # An explicit shape defines (or redefines) the node
+                G.add_node(node_id, label=label, type=node_type)
+            elif node_id not in G:
+                G.add_node(node_id, label=node_id, type='process')
+        elif kind == 'edge':
+            G.add_edge(item[1], item[2], label=item[3])
+        elif kind == 'classDef':
+            G.graph.setdefault('class_defs', {})[item[1]] = item[2]
+        elif kind == 'class':
+            G.graph.setdefault('node_classes', {}).setdefault(item[1], []).append(item[2])
+        elif kind == 'style':
+            G.graph.setdefault('styles', {})[item[1]] = item[2]
 
-            if left_id and right_id:
-                G.add_edge(left_id, right_id, label=edge_label)
-        else:
-            node_id, node_label, node_type = parse_node_str(line)
-            if node_id:
-                if node_id not in G: G.add_node(node_id, label=node_label, type=node_type)
+    return G, find_start_node(G)
 
+def find_start_node(G):
+    # First node without predecessors, else the first node
     start_node = None
     for node in G.nodes:
         if G.in_degree(node) == 0:
@@ -76,86 +161,291 @@ def parse_mermaid(content):
     if not start_node and len(G.nodes) > 0:
         start_node = list(G.nodes)[0]
         
-    return G, start_node
+    return start_node
 
 def parse_node_str(node_str):
-    # Match id followed by optional brackets containing label
-    # We use non-greedy match .*? inside brackets
-    m = re.match(r'(\w+)\s*(\[.*?\]|\{.*?\}|\(\[.*?\]\)|\(\(.*?\)|\))?', node_str)
-    if not m: return None, None, None
-    node_id = m.group(1)
-    rest = m.group(2)
-    label = node_id
-    node_type = 'process'
-    
-    if rest:
-        content = ""
-        if rest.startswith('["'): 
-            content = rest[2:-2]
-            node_type = 'process'
-        elif rest.startswith('['): 
-            content = rest[1:-1]
-            node_type = 'process'
-        elif rest.startswith('{"'): 
-            content = rest[2:-2]
-            node_type = 'decision'
-        elif rest.startswith('{'): 
-            content = rest[1:-1]
-            node_type = 'decision'
-        elif rest.startswith('(["'): 
-            content = rest[3:-3]
-            node_type = 'terminal'
-        elif rest.startswith('(['): 
-            content = rest[2:-2]
-            node_type = 'terminal'
-        elif rest.startswith('(("'): 
-            content = rest[3:-3]
-            node_type = 'terminal'
-        elif rest.startswith('(('): 
-            content = rest[2:-2]
-            node_type = 'terminal'
-            
-        # Strip quotes if they were not stripped by specific checks above (e.g. mixed case)
-        # Actually the above covers ["..."] and [...].
-        # But if we have [ "Label" ], the space might be an issue?
-        # Let's just strip surrounding quotes if present.
-        if content.startswith('"') and content.endswith('"'):
-            content = content[1:-1]
-        
-        label = content
-            
-    return node_id, label, node_type
+    return parse_node(node_str.strip())
 
-def build_structure(G, current_node, stop_node, visited):
-    blocks = []
-    # visited set in this context is for the current recursion path to detect immediate loops if needed,
-    # but we rely on graph topology for loop detection now.
-    # Actually, we still need visited to avoid infinite recursion if we don't detect the loop correctly.
-    
-    while current_node and current_node != stop_node:
-        if current_node in visited:
+class NaturalLoop:
+    """Node set of one natural loop, backed by the shared loop-nesting forest.
+
+    A node belongs to the loop if its innermost loop header lies in the
+    forest subtree of this loop's header, which is a constant-time check.
+    """
+
+    def __init__(self, header, forest):
+        self.header = header
+        self.forest = forest
+
+    def __contains__(self, node):
+        innermost, pre, last = self.forest
+        inner = innermost.get(node)
+        if inner is None:
+            return False
+        return pre[self.header] <= pre[inner] <= last[self.header]
+
+    def __iter__(self):
+        return (n for n in self.forest[0] if n in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        return set(self) == set(other)
+
+def find_loops(G, start_node):
+    """Classify back-edges with one DFS from start_node and return the
+    natural loop of every loop header as {header: NaturalLoop}."""
+    if start_node is None:
+        return {}
+
+    # Iterative DFS: pre-order numbers plus the last number inside each subtree,
+    # so "a is a DFS ancestor of b" is an interval check.
+    number = {start_node: 0}
+    nodes = [start_node]
+    last = [0]
+    stack = [(start_node, iter(G.successors(start_node)))]
+    while stack:
+        node, succs = stack[-1]
+        for succ in succs:
+            if succ not in number:
+                number[succ] = len(nodes)
+                nodes.append(succ)
+                last.append(0)
+                stack.append((succ, iter(G.successors(succ))))
+                break
+        else:
+            last[number[node]] = len(nodes) - 1
+            stack.pop()
+
+    # An edge v -> w is a back-edge if w is a DFS ancestor of v.
+    count = len(nodes)
+    back_preds = [[] for _ in range(count)]
+    other_preds = [[] for _ in range(count)]
+    for w in range(count):
+        for pred in G.predecessors(nodes[w]):
+            v = number.get(pred)
+            if v is None:
+                continue
+            if w <= v <= last[w]:
+                back_preds[w].append(v)
+            else:
+                other_preds[w].append(v)
+
+    # Havlak: visit candidate headers innermost first (reverse pre-order) and
+    # collapse each finished loop into its header with union-find.
+    union = list(range(count))
+
+    def find(v):
+        root = v
+        while union[root] != root:
+            root = union[root]
+        while union[v] != root:
+            union[v], v = root, union[v]
+        return root
+
+    parent = [None] * count
+    is_header = [False] * count
+    for w in range(count - 1, -1, -1):
+        if not back_preds[w]:
+            continue
+        is_header[w] = True
+        body = set()
+        work = []
+        for v in back_preds[w]:
+            if v != w:
+                v = find(v)
+                if v not in body:
+                    body.add(v)
+                    work.append(v)
+        while work:
+            x = work.pop()
+            for y in other_preds[x]:
+                y = find(y)
+                # Entries from outside w's DFS subtree make the region
+                # irreducible; they are left out of the loop.
+                if w <= y <= last[w] and y != w and y not in body:
+                    body.add(y)
+                    work.append(y)
+        for x in body:
+            parent[x] = w
+            union[x] = w
+
+    # Innermost header of every node and pre-order intervals on the loop forest.
+    innermost = {}
+    children = {}
+    for v in range(count):
+        inner = nodes[v] if is_header[v] else (nodes[parent[v]] if parent[v] is not None else None)
+        innermost[nodes[v]] = inner
+        if is_header[v]:
+            outer = nodes[parent[v]] if parent[v] is not None else None
+            children.setdefault(outer, []).append(nodes[v])
+
+    pre = {}
+    last_pre = {}
+    stack = [(None, iter(children.get(None, ())))]
+    while stack:
+        header, kids = stack[-1]
+        for kid in kids:
+            pre[kid] = len(pre)
+            stack.append((kid, iter(children.get(kid, ()))))
             break
+        else:
+            if header is not None:
+                last_pre[header] = len(pre) - 1
+            stack.pop()
+
+    forest = (innermost, pre, last_pre)
+    return {nodes[v]: NaturalLoop(nodes[v], forest) for v in range(count) if is_header[v]}
+
+def find_post_dominators(G, start_node, loops):
+    """Return the immediate post-dominator of every node reachable from
+    start_node. Nodes whose only post-dominator is the virtual exit map to None."""
+    if start_node is None:
+        return {}
+
+    order = {start_node: 0}
+    stack = [start_node]
+    while stack:
+        n = stack.pop()
+        for succ in G.successors(n):
+            if succ not in order:
+                order[succ] = len(order)
+                stack.append(succ)
+
+    # Exit roots: nodes without successors. Regions that never reach one
+    # (e.g. Arduino's loop()) are closed off at their outermost loop header.
+    exits = [n for n in order if not any(True for _ in G.successors(n))]
+    reaches_exit = set()
+
+    def mark(roots):
+        work = [n for n in roots if n not in reaches_exit]
+        reaches_exit.update(work)
+        while work:
+            n = work.pop()
+            for pred in G.predecessors(n):
+                if pred in order and pred not in reaches_exit:
+                    reaches_exit.add(pred)
+                    work.append(pred)
+
+    mark(exits)
+    if len(reaches_exit) < len(order):
+        for header in sorted(loops, key=order.get):
+            if header not in reaches_exit:
+                exits.append(header)
+                mark([header])
+        for n in order:
+            if n not in reaches_exit:
+                exits.append(n)
+                mark([n])
+
+    # Postorder of the reversed graph, rooted at the virtual exit (None).
+    exit_set = set(exits)
+    post = {}
+    rpo = []
+    seen = set(exits)
+    for root in exits:
+        stack = [(root, iter(G.predecessors(root)))]
+        while stack:
+            n, preds = stack[-1]
+            for pred in preds:
+                if pred in order and pred not in seen:
+                    seen.add(pred)
+                    stack.append((pred, iter(G.predecessors(pred))))
+                    break
+            else:
+                post[n] = len(post)
+                rpo.append(n)
+                stack.pop()
+    post[None] = len(post)
+    rpo.reverse()
+
+    # Cooper-Harvey-Kennedy: iterate to a fixed point over reverse postorder,
+    # walking up the partially built tree by postorder number.
+    ipdom = {None: None}
+    for n in exits:
+        ipdom[n] = None
+
+    def intersect(a, b):
+        while a != b:
+            while post[a] < post[b]:
+                a = ipdom[a]
+            while post[b] < post[a]:
+                b = ipdom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for n in rpo:
+            if n in exit_set:
+                continue
+            new_idom = None
+            first = True
+            for succ in G.successors(n):
+                if succ not in ipdom:
+                    continue
+                if first:
+                    new_idom = succ
+                    first = False
+                else:
+                    new_idom = intersect(succ, new_idom)
+            if not first and ipdom.get(n, 0) != new_idom:
+                ipdom[n] = new_idom
+                changed = True
+
+    del ipdom[None]
+    return ipdom
+
+def build_structure(G, current_node, stop_node, visited, loops=None, post_doms=None):
+    # visited guards against endless walks on graphs that are not properly structured.
+    # Loop headers and bodies come from the back-edge analysis in find_loops,
+    # merge points of decisions from the post-dominator tree.
+    if loops is None:
+        loops = find_loops(G, current_node)
+    if post_doms is None:
+        post_doms = find_post_dominators(G, current_node, loops)
+
+    root = []
+    loop_lookups = merge_lookups = 0
+    # Explicit stack of open block sequences: [current_node, stop_node, blocks, added].
+    # A nested sequence records what it adds to visited and takes it out again when
+    # it is done, so its siblings see exactly what a copy of visited would have shown
+    # them, without copying. The outermost sequence keeps its additions (added is None).
+    stack = [[current_node, stop_node, root, None]]
+
+    while stack:
+        frame = stack[-1]
+        current_node, stop_node, blocks, added = frame
+
+        if not current_node or current_node == stop_node or current_node in visited:
+            if added:
+                visited.difference_update(added)
+            stack.pop()
+            continue
         visited.add(current_node)
+        if added is not None:
+            added.append(current_node)
         
         # Get node info
         node_data = G.nodes[current_node]
         label = node_data.get('label', '').replace('"', '')
         successors = list(G.successors(current_node))
+        loop_body = loops.get(current_node)
         
         if len(successors) == 2:
             # Check for Loop (Head-Controlled)
-            # A loop header has one branch that leads back to itself, and one that doesn't (exit).
-            # BUT: If both lead back (nested if in loop), it's not a loop header for *this* loop, but an inner structure.
-            # We assume structured programming: Loop Header dominates the body.
+            # A loop header has one branch inside its natural loop (body) and one outside (exit).
+            # If both branches are inside, it's not a loop header for *this* loop, but an inner structure.
             
             s0 = successors[0]
             s1 = successors[1]
             
-            # Check reachability back to current_node
-            # We must be careful: s0 -> ... -> current_node
             # If s0 is stop_node, it cannot lead back within the current scope.
-            leads_back_0 = False if (stop_node and s0 == stop_node) else has_path_excluding(G, s0, current_node, stop_node)
-            leads_back_1 = False if (stop_node and s1 == stop_node) else has_path_excluding(G, s1, current_node, stop_node)
+            if loop_body is not None:
+                loop_lookups += 2
+            leads_back_0 = loop_body is not None and s0 != stop_node and s0 in loop_body
+            leads_back_1 = loop_body is not None and s1 != stop_node and s1 in loop_body
             
             if leads_back_0 and not leads_back_1:
                 # s0 is body, s1 is exit
@@ -174,20 +464,16 @@ def build_structure(G, current_node, stop_node, visited):
                 
             if is_loop:
                 # It is a loop!
-                # Build body. Stop node is current_node (the header).
-                # We need to pass a copy of visited? Yes.
-                body_blocks = build_structure(G, loop_body_start, current_node, visited.copy())
-                
-                blocks.append({
-                    'type': 'loop',
-                    'label': label,
-                    'body': body_blocks
-                })
-                current_node = exit_node
+                # Build body next. Stop node is current_node (the header).
+                block = Loop(label)
+                blocks.append(block)
+                frame[0] = exit_node
+                stack.append([loop_body_start, current_node, block.body, []])
                 continue
 
-            # Standard Decision
-            merge_node = find_merge_node(G, successors[0], successors[1], stop_node)
+            # Standard Decision: both branches meet again at the immediate post-dominator
+            merge_node = post_doms.get(current_node)
+            merge_lookups += 1
             edge1 = G.get_edge_data(current_node, successors[0])
             label1 = edge1.get('label', '').lower()
             
@@ -196,274 +482,384 @@ def build_structure(G, current_node, stop_node, visited):
             else:
                 yes_node = successors[1]; no_node = successors[0]
             
-            yes_block = build_structure(G, yes_node, merge_node, visited.copy())
-            no_block = build_structure(G, no_node, merge_node, visited.copy())
-            
-            blocks.append({
-                'type': 'decision',
-                'label': label,
-                'yes': yes_block,
-                'no': no_block
-            })
-            current_node = merge_node
+            block = Decision(label)
+            blocks.append(block)
+            frame[0] = merge_node
+            # Pushed in reverse so the yes branch is built first
+            stack.append([no_node, merge_node, block.no, []])
+            stack.append([yes_node, merge_node, block.yes, []])
             
         elif len(successors) == 1:
             # Check for Loop (Infinite or Foot-Controlled)
-            # If the single successor leads back to current_node, it's a loop.
+            # If the single successor is inside the natural loop of current_node, it's a loop.
             s0 = successors[0]
+            if loop_body is not None:
+                loop_lookups += 1
             
             # CRITICAL: If s0 is the stop_node, this is just the back-edge of the parent loop.
             if stop_node and s0 == stop_node:
-                blocks.append({'type': 'process', 'label': label})
-                current_node = s0
-            elif has_path_excluding(G, s0, current_node, stop_node):
+                blocks.append(Process(label))
+                frame[0] = s0
+            elif loop_body is not None and s0 in loop_body:
                 # It is a loop!
-                body_blocks = build_structure(G, s0, current_node, visited.copy())
-                
-                blocks.append({
-                    'type': 'loop',
-                    'label': label,
-                    'body': body_blocks
-                })
-                current_node = None 
+                block = Loop(label)
+                blocks.append(block)
+                frame[0] = None
+                stack.append([s0, current_node, block.body, []])
             else:
-                blocks.append({'type': 'process', 'label': label})
-                current_node = successors[0]
+                blocks.append(Process(label))
+                frame[0] = s0
         else:
-            blocks.append({'type': 'process', 'label': label})
-            current_node = None
+            blocks.append(Process(label))
+            frame[0] = None
             
-    return blocks
+    metrics.work('loop_lookups', loop_lookups)
+    metrics.work('merge_lookups', merge_lookups)
+    return root
 
-def has_path_excluding(G, source, target, exclude_node):
-    if source == target: return True
-    if exclude_node is None:
-        return nx.has_path(G, source, target)
-        
-    # BFS to find path without visiting exclude_node
-    visited = {source, exclude_node}
-    queue = [source]
-    
-    while queue:
-        n = queue.pop(0)
-        if n == target: return True
-        
-        for succ in G.successors(n):
-            if succ not in visited:
-                visited.add(succ)
-                queue.append(succ)
-    return False
-
-def find_merge_node(G, node1, node2, stop_node=None):
-    visited1 = set()
-    queue1 = [node1]
-    while queue1:
-        n = queue1.pop(0)
-        if n == stop_node: continue 
-        if n not in visited1:
-            visited1.add(n)
-            queue1.extend(G.successors(n))
-            if len(visited1) > 100: break
-            
-    queue2 = [node2]
-    visited2 = set()
-    while queue2:
-        n = queue2.pop(0)
-        if n == stop_node: continue
-        if n in visited1: 
-            return n
-        if n not in visited2:
-            visited2.add(n)
-            queue2.extend(G.successors(n))
-            if len(visited2) > 100: break
-    return None
-
-def calculate_min_widths(blocks):
+def iter_blocks(blocks):
+    # All blocks of a tree in pre-order (parents before their children), without recursion
+    stack = [blocks]
+    while stack:
+        seq = stack.pop()
+        for block in seq:
+            yield block
+            stack.extend(reversed(block.children()))
+
+def compute_subtree_keys(blocks):
+    # Structural hash of every decision/loop subtree (type, label and children),
+    # bottom-up in one pass. Also counts the blocks of each subtree.
+    keys = {}
+    for block in reversed(list(iter_blocks(blocks))):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(CONVERTER_VERSION.encode())
+        h.update(block.type.encode())
+        h.update(b'\0')
+        h.update(block.label.encode('utf-8'))
+        size = 1
+        for seq in block.children():
+            h.update(b'[')
+            for child in seq:
+                h.update(keys[id(child)])
+                size += child.size if child.children() else 1
+            h.update(b']')
+        key = h.digest()
+        keys[id(block)] = key
+        if block.children():
+            block.key = key
+            block.size = size
+
+def _is_unit(block, memo, in_unit):
+    return memo is not None and not in_unit and MEMO_MIN_BLOCKS <= block.size <= MEMO_MAX_BLOCKS
+
+def sequence_min_width(blocks):
     max_width = MIN_BLOCK_WIDTH
-    
     for block in blocks:
-        text_width = len(block['label']) * CHAR_WIDTH_AVG + PADDING_X * 2
+        max_width = max(max_width, block.min_width)
+    return max_width
+
+def calculate_min_widths(blocks, memo=None):
+    # With a memo, subtrees whose min widths are known are not descended into.
+    if memo is not None:
+        compute_subtree_keys(blocks)
+
+    order = []
+    known = set()
+    stack = [(blocks, False)]
+    while stack:
+        seq, in_unit = stack.pop()
+        for block in seq:
+            order.append(block)
+            children = block.children()
+            if not children:
+                continue
+            block.unit = _is_unit(block, memo, in_unit)
+            if block.unit:
+                widths = memo.get(('min', block.key))
+                if widths is not None:
+                    for b, entry in zip(iter_blocks([block]), widths):
+                        _set_min_widths(b, entry)
+                    known.add(id(block))
+                    continue
+            for child_seq in reversed(children):
+                stack.append((child_seq, in_unit or block.unit))
+
+    # Children before parents: walk the pre-order list backwards
+    for block in reversed(order):
+        if id(block) in known:
+            continue
+        text_width = math.ceil(measure_text(block.label, FONT_SIZE)) + PADDING_X * 2
         
-        if block['type'] == 'process':
-            block['min_width'] = max(text_width, MIN_BLOCK_WIDTH)
+        if block.type == 'process':
+            block.min_width = max(text_width, MIN_BLOCK_WIDTH)
             
-        elif block['type'] == 'decision':
-            yes_width = calculate_min_widths(block['yes'])
-            no_width = calculate_min_widths(block['no'])
+        elif block.type == 'decision':
+            yes_width = sequence_min_width(block.yes)
+            no_width = sequence_min_width(block.no)
             decision_label_width = text_width
-            block['min_width'] = max(yes_width + no_width, decision_label_width)
-            block['yes_min_width'] = yes_width
-            block['no_min_width'] = no_width
+            block.min_width = max(yes_width + no_width, decision_label_width)
+            block.yes_min_width = yes_width
+            block.no_min_width = no_width
             
-        elif block['type'] == 'loop':
-            body_width = calculate_min_widths(block['body'])
+        elif block.type == 'loop':
+            body_width = sequence_min_width(block.body)
             # Loop needs width for body + indent
             # And width for label
-            block['min_width'] = max(body_width + LOOP_INDENT, text_width)
-            block['body_min_width'] = body_width
+            block.min_width = max(body_width + LOOP_INDENT, text_width)
+            block.body_min_width = body_width
 
-        max_width = max(max_width, block['min_width'])
+        if memo is not None and block.children() and block.unit:
+            # The whole subtree: a fragment missing at another width (or in
+            # the other output mode) lays out the children again
+            memo.put(('min', block.key), [_get_min_widths(b) for b in iter_blocks([block])])
         
-    return max_width
+    return sequence_min_width(blocks)
 
-def calculate_heights(blocks, width):
-    total_h = 0
-    for block in blocks:
-        text_area_width = width - PADDING_X * 2
-        text_len = len(block['label']) * CHAR_WIDTH_AVG
-        lines = math.ceil(text_len / max(1, text_area_width))
+def _get_min_widths(block):
+    if block.type == 'decision':
+        return (block.min_width, block.yes_min_width, block.no_min_width)
+    if block.type == 'loop':
+        return (block.min_width, block.body_min_width)
+    return (block.min_width,)
+
+def _set_min_widths(block, widths):
+    if block.type == 'decision':
+        block.min_width, block.yes_min_width, block.no_min_width = widths
+    elif block.type == 'loop':
+        block.min_width, block.body_min_width = widths
+    else:
+        block.min_width, = widths
+
+def calculate_heights(blocks, width, memo=None, compact=False):
+    # Widths flow down the tree, heights flow back up.
+    # Pass 1 (pre-order): hand every block the width of its sequence. Memoized
+    # units rendered at this width (and in this output mode) before take their
+    # height and SVG from the memo and are not descended into.
+    order = []
+    stack = [(blocks, width)]
+    while stack:
+        seq, seq_width = stack.pop()
+        for block in seq:
+            if memo is not None and block.children() and block.unit:
+                entry = memo.get(_fragment_key(block, seq_width, compact))
+                if entry is not None:
+                    block.fragment, block.height = entry
+                    continue
+                block.fragment = None
+            order.append((block, seq_width))
+            if block.type == 'decision':
+                yes_min = block.yes_min_width
+                no_min = block.no_min_width
+                total_min = yes_min + no_min
+                
+                yes_w = seq_width * (yes_min / total_min)
+                no_w = seq_width - yes_w
+                block.yes_width = yes_w
+                block.no_width = no_w
+                stack.append((block.no, no_w))
+                stack.append((block.yes, yes_w))
+            elif block.type == 'loop':
+                # Body width is width - LOOP_INDENT
+                body_w = seq_width - LOOP_INDENT
+                block.body_width = body_w
+                stack.append((block.body, body_w))
+
+    # Pass 2 (reverse pre-order): children are done before their parent.
+    for block, block_width in reversed(order):
+        text_area_width = block_width - PADDING_X * 2
+        lines = len(wrap_text(block.label, text_area_width, FONT_SIZE))
         text_height = lines * LINE_HEIGHT + PADDING_Y * 2
         
-        if block['type'] == 'process':
-            block['height'] = max(40, text_height)
-            total_h += block['height']
-            
-        elif block['type'] == 'decision':
-            yes_min = block['yes_min_width']
-            no_min = block['no_min_width']
-            total_min = yes_min + no_min
-            
-            yes_w = width * (yes_min / total_min)
-            no_w = width - yes_w
+        if block.type == 'process':
+            block.height = max(40, text_height)
             
-            yes_h = calculate_heights(block['yes'], yes_w)
-            no_h = calculate_heights(block['no'], no_w)
+        elif block.type == 'decision':
+            yes_h = sequence_height(block.yes)
+            no_h = sequence_height(block.no)
             
             content_height = max(yes_h, no_h)
             header_height = max(40, text_height + 20)
             
-            block['height'] = header_height + content_height
-            block['header_height'] = header_height
-            block['content_height'] = content_height
-            block['yes_width'] = yes_w
-            block['no_width'] = no_w
+            block.height = header_height + content_height
+            block.header_height = header_height
+            block.content_height = content_height
             
-            total_h += block['height']
-            
-        elif block['type'] == 'loop':
+        elif block.type == 'loop':
             # Loop layout:
             # Header bar (text_height)
             # Body (indented)
             
             header_height = max(30, text_height)
+            body_h = sequence_height(block.body)
             
-            # Body width is width - LOOP_INDENT
-            body_w = width - LOOP_INDENT
-            body_h = calculate_heights(block['body'], body_w)
-            
-            block['height'] = header_height + body_h
-            block['header_height'] = header_height
-            block['body_height'] = body_h
-            block['body_width'] = body_w
-            
-            total_h += block['height']
+            block.height = header_height + body_h
+            block.header_height = header_height
+            block.body_height = body_h
             
+    return sequence_height(blocks)
+
+def sequence_height(blocks):
+    total_h = 0
+    for block in blocks:
+        total_h += block.height
     return total_h
 
-def render_blocks(blocks, x, y, width):
-    svg = ""
-    current_y = y
+def render_blocks(blocks, x, y, width, memo=None, compact=False):
+    return "".join(iter_render_blocks(blocks, x, y, width, memo, compact))
+
+def iter_render_blocks(blocks, x, y, width, memo=None, compact=False):
+    # Work items are either finished markup (str) or a block sequence still to
+    # be drawn at (x, y, width). Items are popped in document order.
+    stack = [(blocks, x, y, width)]
+    rendered = 0
+    defined = set()  # Compact output: ids of the units already in <defs>
     
-    for block in blocks:
-        if block['type'] == 'process':
-            h = block['height']
-            svg += f'<rect x="{x}" y="{current_y}" width="{width}" height="{h}" fill="white" stroke="black" stroke-width="1"/>'
-            
-            lines = wrap_text(block['label'], width - PADDING_X * 2)
-            text_y = current_y + PADDING_Y + FONT_SIZE/2
-            for line in lines:
-                svg += f'<text x="{x + 10}" y="{text_y}" font-size="{FONT_SIZE}">{html.escape(line)}</text>'
-                text_y += LINE_HEIGHT
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            yield item
+            continue
+        
+        seq, x, current_y, width = item
+        items = []
+        for block in seq:
+            if memo is not None and block.children() and block.unit:
+                # Memoized units are drawn at the origin and moved into place,
+                # so the same fragment fits wherever the subtree appears
+                if block.fragment is None:
+                    block.fragment = render_blocks([block], 0, 0, width, compact=compact)
+                    memo.put(_fragment_key(block, width, compact), (block.fragment, block.height))
+                if compact:
+                    # The id depends only on the subtree and width, so equal
+                    # units share one definition
+                    unit_id = f'u{block.key.hex()[:16]}-{_n(width).replace(".", "_")}'
+                    part = f'<use xlink:href="#{unit_id}" x="{_n(x)}" y="{_n(current_y)}"/>'
+                    if unit_id not in defined:
+                        defined.add(unit_id)
+                        part = f'<defs><g id="{unit_id}">{block.fragment}</g></defs>' + part
+                    items.append(part)
+                else:
+                    items.append(f'<g transform="translate({x},{current_y})">{block.fragment}</g>')
+                current_y += block.height
+                continue
+
+            rendered += 1  # Memo hits are not rendered again
+            if block.type == 'process':
+                h = block.height
+                lines = wrap_text(block.label, width - PADDING_X * 2, FONT_SIZE)
+                text_y = current_y + PADDING_Y + FONT_SIZE/2
+                if compact:
+                    part = f'<rect x="{_n(x)}" y="{_n(current_y)}" width="{_n(width)}" height="{_n(h)}"/>'
+                    if lines:
+                        part += f'<text x="{_n(x + 10)}" y="{_n(text_y)}">{html.escape(lines[0])}'
+                        for line in lines[1:]:
+                            part += f'<tspan x="{_n(x + 10)}" dy="{LINE_HEIGHT}">{html.escape(line)}</tspan>'
+                        part += '</text>'
+                    items.append(part)
+                    current_y += h
+                    continue
+
+                part = f'<rect x="{x}" y="{current_y}" width="{width}" height="{h}" fill="white" stroke="black" stroke-width="1"/>'
+                for line in lines:
+                    part += f'<text x="{x + 10}" y="{text_y}" font-size="{FONT_SIZE}">{html.escape(line)}</text>'
+                    text_y += LINE_HEIGHT
+                items.append(part)
                 
-            current_y += h
-            
-        elif block['type'] == 'decision':
-            header_h = block['header_height']
-            content_h = block['content_height']
-            yes_w = block['yes_width']
-            no_w = block['no_width']
-            
-            svg += f'<rect x="{x}" y="{current_y}" width="{width}" height="{header_h}" fill="#f0f0f0" stroke="black" stroke-width="1"/>'
-            svg += f'<line x1="{x}" y1="{current_y}" x2="{x+yes_w}" y2="{current_y+header_h}" stroke="black" stroke-width="1"/>'
-            svg += f'<line x1="{x+width}" y1="{current_y}" x2="{x+yes_w}" y2="{current_y+header_h}" stroke="black" stroke-width="1"/>'
-            
-            block_center_x = x + width / 2
-            intersection_x = x + yes_w
-            label_x = (block_center_x + intersection_x) / 2
-            
-            svg += f'<text x="{label_x}" y="{current_y + header_h/2}" text-anchor="middle" font-size="{FONT_SIZE}">{html.escape(block["label"])}</text>'
-            
-            svg += f'<text x="{x + yes_w/2}" y="{current_y + header_h - 5}" text-anchor="middle" font-size="12">True</text>'
-            svg += f'<text x="{x + yes_w + no_w/2}" y="{current_y + header_h - 5}" text-anchor="middle" font-size="12">False</text>'
-            
-            svg += render_blocks(block['yes'], x, current_y + header_h, yes_w)
-            svg += render_blocks(block['no'], x + yes_w, current_y + header_h, no_w)
-            
-            yes_content_h = sum(b['height'] for b in block['yes'])
-            no_content_h = sum(b['height'] for b in block['no'])
-            
-            if yes_content_h < content_h:
-                svg += f'<rect x="{x}" y="{current_y + header_h + yes_content_h}" width="{yes_w}" height="{content_h - yes_content_h}" fill="white" stroke="black" stroke-width="1"/>'
-            if no_content_h < content_h:
-                svg += f'<rect x="{x + yes_w}" y="{current_y + header_h + no_content_h}" width="{no_w}" height="{content_h - no_content_h}" fill="white" stroke="black" stroke-width="1"/>'
+                current_y += h
+                
+            elif block.type == 'decision':
+                header_h = block.header_height
+                content_h = block.content_height
+                yes_w = block.yes_width
+                no_w = block.no_width
+                
+                block_center_x = x + width / 2
+                intersection_x = x + yes_w
+                label_x = (block_center_x + intersection_x) / 2
+                
+                if compact:
+                    bottom = _n(current_y + header_h)
+                    part = (f'<rect class="h" x="{_n(x)}" y="{_n(current_y)}" width="{_n(width)}" height="{_n(header_h)}"/>'
+                            f'<path d="M{_n(x)},{_n(current_y)}L{_n(intersection_x)},{bottom}L{_n(x + width)},{_n(current_y)}"/>'
+                            f'<text class="m" x="{_n(label_x)}" y="{_n(current_y + header_h/2)}">{html.escape(block.label)}</text>'
+                            f'<text class="s" y="{_n(current_y + header_h - 5)}"><tspan x="{_n(x + yes_w/2)}">True</tspan>'
+                            f'<tspan x="{_n(x + yes_w + no_w/2)}">False</tspan></text>')
+                else:
+                    part = f'<rect x="{x}" y="{current_y}" width="{width}" height="{header_h}" fill="#f0f0f0" stroke="black" stroke-width="1"/>'
+                    part += f'<line x1="{x}" y1="{current_y}" x2="{x+yes_w}" y2="{current_y+header_h}" stroke="black" stroke-width="1"/>'
+                    part += f'<line x1="{x+width}" y1="{current_y}" x2="{x+yes_w}" y2="{current_y+header_h}" stroke="black" stroke-width="1"/>'
+                    part += f'<text x="{label_x}" y="{current_y + header_h/2}" text-anchor="middle" font-size="{FONT_SIZE}">{html.escape(block.label)}</text>'
+                    part += f'<text x="{x + yes_w/2}" y="{current_y + header_h - 5}" text-anchor="middle" font-size="12">True</text>'
+                    part += f'<text x="{x + yes_w + no_w/2}" y="{current_y + header_h - 5}" text-anchor="middle" font-size="12">False</text>'
+                items.append(part)
+                
+                items.append((block.yes, x, current_y + header_h, yes_w))
+                items.append((block.no, x + yes_w, current_y + header_h, no_w))
+                
+                yes_content_h = sequence_height(block.yes)
+                no_content_h = sequence_height(block.no)
                 
-            current_y += header_h + content_h
+                part = ''
+                if compact:
+                    if yes_content_h < content_h:
+                        part += (f'<rect x="{_n(x)}" y="{_n(current_y + header_h + yes_content_h)}" width="{_n(yes_w)}" '
+                                 f'height="{_n(content_h - yes_content_h)}"/>')
+                    if no_content_h < content_h:
+                        part += (f'<rect x="{_n(x + yes_w)}" y="{_n(current_y + header_h + no_content_h)}" width="{_n(no_w)}" '
+                                 f'height="{_n(content_h - no_content_h)}"/>')
+                else:
+                    if yes_content_h < content_h:
+                        part += f'<rect x="{x}" y="{current_y + header_h + yes_content_h}" width="{yes_w}" height="{content_h - yes_content_h}" fill="white" stroke="black" stroke-width="1"/>'
+                    if no_content_h < content_h:
+                        part += f'<rect x="{x + yes_w}" y="{current_y + header_h + no_content_h}" width="{no_w}" height="{content_h - no_content_h}" fill="white" stroke="black" stroke-width="1"/>'
+                if part:
+                    items.append(part)
+                    
+                current_y += header_h + content_h
 
-        elif block['type'] == 'loop':
-            h = block['height']
-            header_h = block['header_height']
-            body_h = block['body_height']
-            body_w = block['body_width']
-            
-            # Draw L-shape container using a path to avoid line between header and side bar
-            # Points:
-            # 1. Top-Left (x, y)
-            # 2. Top-Right (x + width, y)
-            # 3. Header-Bottom-Right (x + width, y + header_h)
-            # 4. Inner-Corner (x + LOOP_INDENT, y + header_h)
-            # 5. Bottom-Right of Side Bar (x + LOOP_INDENT, y + h)
-            # 6. Bottom-Left (x, y + h)
-            # Close path
-            
-            p1 = f"{x},{current_y}"
-            p2 = f"{x+width},{current_y}"
-            p3 = f"{x+width},{current_y+header_h}"
-            p4 = f"{x+LOOP_INDENT},{current_y+header_h}"
-            p5 = f"{x+LOOP_INDENT},{current_y+h}"
-            p6 = f"{x},{current_y+h}"
-            
-            path_d = f"M {p1} L {p2} L {p3} L {p4} L {p5} L {p6} Z"
-            
-            svg += f'<path d="{path_d}" fill="#e0e0e0" stroke="black" stroke-width="1"/>'
-            svg += f'<text x="{x + 10}" y="{current_y + header_h/2 + 5}" font-size="{FONT_SIZE}">{html.escape(block["label"])}</text>'
-            
-            # Body area (white background for body blocks)
-            # The blocks will draw themselves.
-            
-            svg += render_blocks(block['body'], x + LOOP_INDENT, current_y + header_h, body_w)
-            
-            current_y += h
+            elif block.type == 'loop':
+                h = block.height
+                header_h = block.header_height
+                body_w = block.body_width
+                
+                # Draw L-shape container using a path to avoid line between header and side bar
+                # Points:
+                # 1. Top-Left (x, y)
+                # 2. Top-Right (x + width, y)
+                # 3. Header-Bottom-Right (x + width, y + header_h)
+                # 4. Inner-Corner (x + LOOP_INDENT, y + header_h)
+                # 5. Bottom-Right of Side Bar (x + LOOP_INDENT, y + h)
+                # 6. Bottom-Left (x, y + h)
+                # Close path
+                
+                if compact:
+                    part = (f'<path class="l" d="M{_n(x)},{_n(current_y)}H{_n(x + width)}V{_n(current_y + header_h)}'
+                            f'H{_n(x + LOOP_INDENT)}V{_n(current_y + h)}H{_n(x)}Z"/>'
+                            f'<text x="{_n(x + 10)}" y="{_n(current_y + header_h/2 + 5)}">{html.escape(block.label)}</text>')
+                    items.append(part)
+                    items.append((block.body, x + LOOP_INDENT, current_y + header_h, body_w))
+                    current_y += h
+                    continue
 
-    return svg
+                p1 = f"{x},{current_y}"
+                p2 = f"{x+width},{current_y}"
+                p3 = f"{x+width},{current_y+header_h}"
+                p4 = f"{x+LOOP_INDENT},{current_y+header_h}"
+                p5 = f"{x+LOOP_INDENT},{current_y+h}"
+                p6 = f"{x},{current_y+h}"
+                
+                path_d = f"M {p1} L {p2} L {p3} L {p4} L {p5} L {p6} Z"
+                
+                part = f'<path d="{path_d}" fill="#e0e0e0" stroke="black" stroke-width="1"/>'
+                part += f'<text x="{x + 10}" y="{current_y + header_h/2 + 5}" font-size="{FONT_SIZE}">{html.escape(block.label)}</text>'
+                items.append(part)
+                
+                # Body area (white background for body blocks)
+                # The blocks will draw themselves.
+                items.append((block.body, x + LOOP_INDENT, current_y + header_h, body_w))
+                
+                current_y += h
 
-def wrap_text(text, max_width):
-    words = text.split()
-    lines = []
-    current_line = []
-    current_len = 0
-    
-    for word in words:
-        word_len = len(word) * CHAR_WIDTH_AVG
-        if current_len + word_len <= max_width:
-            current_line.append(word)
-            current_len += word_len + CHAR_WIDTH_AVG 
-        else:
-            if current_line:
-                lines.append(" ".join(current_line))
-            current_line = [word]
-            current_len = word_len
-            
-    if current_line:
-        lines.append(" ".join(current_line))
-        
-    return lines if lines else [text]
+        stack.extend(reversed(items))
+
+    metrics.work('blocks_rendered', rendered)
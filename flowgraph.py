@@ -0,0 +1,245 @@
+# Lightweight directed graph for flowcharts.
+#
+# Node names are interned to consecutive integers and edges are kept in flat
+# arrays (a forward-star layout: every node points at its first and last
+# outgoing/incoming edge, every edge at the next one), so a graph costs a few
+# machine words per node and edge. The public methods mirror the subset of
+# networkx.DiGraph the converter uses, which keeps networkx usable as an
+# optional backend.
+
+from array import array
+
+import metrics
+
+GRAPH_BACKEND = 'flowgraph'  # or 'networkx'
+
+def create_graph(backend=None):
+    backend = backend or GRAPH_BACKEND
+    if backend == 'networkx':
+        import networkx as nx
+        return nx.DiGraph()
+    if backend != 'flowgraph':
+        raise ValueError(f"Unknown graph backend: {backend}")
+    return FlowGraph()
+
+class FlowGraph:
+    def __init__(self):
+        self._index = {}
+        self._names = []
+        self._labels = []
+        self._types = []
+        # Per node: first/last outgoing and incoming edge (-1 if none)
+        self._out_head = array('i')
+        self._out_tail = array('i')
+        self._in_head = array('i')
+        self._in_tail = array('i')
+        self._in_degree = array('i')
+        # Per edge
+        self._src = array('i')
+        self._dst = array('i')
+        self._out_next = array('i')
+        self._in_next = array('i')
+        self._edge_labels = []
+        self.nodes = _NodeView(self)
+        self.graph = {}  # Graph-level attributes, as in networkx
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def number_of_nodes(self):
+        return len(self._names)
+
+    def number_of_edges(self):
+        return len(self._dst)
+
+    def index(self, name):
+        # Integer ID of a node
+        return self._index[name]
+
+    def add_node(self, name, label=None, type=None):
+        i = self._index.get(name)
+        if i is None:
+            i = len(self._names)
+            self._index[name] = i
+            self._names.append(name)
+            self._labels.append(label)
+            self._types.append(type)
+            for arr in (self._out_head, self._out_tail, self._in_head, self._in_tail):
+                arr.append(-1)
+            self._in_degree.append(0)
+        else:
+            if label is not None:
+                self._labels[i] = label
+            if type is not None:
+                self._types[i] = type
+        return i
+
+    def add_edge(self, u, v, label=''):
+        ui = self._index.get(u)
+        if ui is None:
+            ui = self.add_node(u)
+        vi = self._index.get(v)
+        if vi is None:
+            vi = self.add_node(v)
+
+        e = self._find_edge(ui, vi)
+        if e != -1:
+            self._edge_labels[e] = label
+            return
+
+        e = len(self._dst)
+        self._src.append(ui)
+        self._dst.append(vi)
+        self._out_next.append(-1)
+        self._in_next.append(-1)
+        self._edge_labels.append(label)
+
+        if self._out_tail[ui] == -1:
+            self._out_head[ui] = e
+        else:
+            self._out_next[self._out_tail[ui]] = e
+        self._out_tail[ui] = e
+
+        if self._in_tail[vi] == -1:
+            self._in_head[vi] = e
+        else:
+            self._in_next[self._in_tail[vi]] = e
+        self._in_tail[vi] = e
+        self._in_degree[vi] += 1
+
+    def _find_edge(self, ui, vi):
+        e = self._out_head[ui]
+        dst = self._dst
+        out_next = self._out_next
+        while e != -1:
+            if dst[e] == vi:
+                return e
+            e = out_next[e]
+        return -1
+
+    def successor_ids(self, i):
+        ids = []
+        e = self._out_head[i]
+        dst = self._dst
+        out_next = self._out_next
+        while e != -1:
+            ids.append(dst[e])
+            e = out_next[e]
+        return ids
+
+    def predecessor_ids(self, i):
+        ids = []
+        e = self._in_head[i]
+        src = self._src
+        in_next = self._in_next
+        while e != -1:
+            ids.append(src[e])
+            e = in_next[e]
+        return ids
+
+    def successors(self, name):
+        names = self._names
+        return [names[i] for i in self.successor_ids(self._index[name])]
+
+    def predecessors(self, name):
+        names = self._names
+        return [names[i] for i in self.predecessor_ids(self._index[name])]
+
+    def in_degree(self, name):
+        return self._in_degree[self._index[name]]
+
+    def has_edge(self, u, v):
+        ui = self._index.get(u)
+        vi = self._index.get(v)
+        return ui is not None and vi is not None and self._find_edge(ui, vi) != -1
+
+    def get_edge_data(self, u, v, default=None):
+        ui = self._index.get(u)
+        vi = self._index.get(v)
+        if ui is None or vi is None:
+            return default
+        e = self._find_edge(ui, vi)
+        if e == -1:
+            return default
+        return {'label': self._edge_labels[e]}
+
+    def edges(self):
+        names = self._names
+        return [(names[self._src[e]], names[self._dst[e]]) for e in range(len(self._dst))]
+
+    def has_path(self, source, target):
+        si = self._index[source]
+        ti = self._index[target]
+        seen = {si}
+        stack = [si]
+        while stack:
+            i = stack.pop()
+            if i == ti:
+                return True
+            for j in self.successor_ids(i):
+                if j not in seen:
+                    seen.add(j)
+                    stack.append(j)
+        return False
+
+class _NodeView:
+    # G.nodes: iterates over node names, G.nodes[name] gives the attribute dict
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __iter__(self):
+        return iter(self._graph._names)
+
+    def __len__(self):
+        return len(self._graph._names)
+
+    def __contains__(self, name):
+        return name in self._graph._index
+
+    def __getitem__(self, name):
+        g = self._graph
+        i = g._index[name]
+        attrs = {}
+        if g._labels[i] is not None:
+            attrs['label'] = g._labels[i]
+        if g._types[i] is not None:
+            attrs['type'] = g._types[i]
+        return attrs
+
+# Mermaid shape per node type when a graph is written back as flowchart text
+MERMAID_SHAPES = {
+    'process': '{}["{}"]',
+    'decision': '{}{{"{}"}}',
+    'terminal': '{}(["{}"])',
+}
+
+def to_mermaid(graph):
+    # Serialize a flowchart graph as Mermaid text: node definitions first,
+    # then the edges in insertion order. parse_mermaid reads it back into
+    # the same graph.
+    with metrics.stage('mermaid_text'):
+        text = _mermaid_text(graph)
+    metrics.observe('pap_output_bytes', len(text), format='mmd')
+    return text
+
+def _mermaid_text(graph):
+    lines = ["graph TD"]
+    for name in graph.nodes:
+        attrs = graph.nodes[name]
+        # Mermaid node text must stay on one line
+        label = " ".join(attrs.get('label', name).replace('"', "'").splitlines())
+        shape = MERMAID_SHAPES.get(attrs.get('type'), MERMAID_SHAPES['process'])
+        lines.append(shape.format(name, label))
+    for u, v in graph.edges():
+        label = (graph.get_edge_data(u, v) or {}).get('label')
+        if label:
+            lines.append(f"{u} -->|{label}| {v}")
+        else:
+            lines.append(f"{u} --> {v}")
+    return "\n".join(lines)
@@ -0,0 +1,151 @@
+# Per-function flowcharts for large Python modules and Arduino sketches.
+#
+# A source is parsed once into a module (an ast tree or a Sketch) that lists
+# its functions with cheap statistics. Diagrams of single functions are only
+# generated when asked for and then kept in a cache, so a big file never has
+# to be drawn as one huge graph.
+
+import ast
+
+from arduino_sketch import Sketch
+from cache import LRUCache, content_key
+from converter import convert_graph_to_nsd, CONVERTER_VERSION
+from flowgraph import to_mermaid
+from limits import check_ast
+from python_to_mermaid import SimplePythonToMermaid
+
+MODULE_CACHE_BYTES = 64 * 1024 * 1024
+DIAGRAM_CACHE_BYTES = 32 * 1024 * 1024
+FORMATS = ('mmd', 'nsd')
+
+# Parsed modules by id, sized by the length of their source
+modules = LRUCache(MODULE_CACHE_BYTES, sizeof=lambda module: module.size)
+# Rendered function diagrams by (module id, function, format)
+diagrams = LRUCache(DIAGRAM_CACHE_BYTES)
+
+class PythonModule:
+    kind = 'python'
+
+    def __init__(self, source):
+        self.source = source
+        self.size = len(source) * 8  # The ast is several times the size of the text
+        self.tree = ast.parse(source)
+        check_ast(self.tree)
+        self.functions = {}
+        self._collect(self.tree.body, '')
+
+    def _collect(self, body, prefix):
+        # Functions and methods by qualified name, e.g. 'Robot.drive'
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = prefix + node.name
+                self.functions.setdefault(name, node)
+                self._collect(node.body, name + '.')
+            elif isinstance(node, ast.ClassDef):
+                self._collect(node.body, prefix + node.name + '.')
+
+    def index(self):
+        result = []
+        for name, node in self.functions.items():
+            stats = {'statements': 0, 'branches': 0, 'loops': 0}
+            stack = list(node.body)
+            while stack:
+                child = stack.pop()
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    continue  # Counted on their own
+                if isinstance(child, ast.stmt):
+                    stats['statements'] += 1
+                if isinstance(child, ast.If):
+                    stats['branches'] += 1
+                elif isinstance(child, (ast.For, ast.AsyncFor, ast.While)):
+                    stats['loops'] += 1
+                stack.extend(ast.iter_child_nodes(child))
+            end = getattr(node, 'end_lineno', None) or node.lineno
+            result.append(dict(name=name, line=node.lineno, lines=end - node.lineno + 1, **stats))
+        return result
+
+    def graph(self, name):
+        return SimplePythonToMermaid().build_function(self.source, self.functions[name])
+
+class ArduinoModule:
+    kind = 'arduino'
+
+    def __init__(self, sketch):
+        self.sketch = sketch
+        self.size = sum(len(text) for text in sketch.files.values()) * 8
+        self.parsed = dict(sketch.parsed_files())
+        self.functions = sketch.functions()
+
+    def index(self):
+        result = []
+        for name, filename in self.functions.items():
+            parsed = self.parsed[filename]
+            brace = parsed.functions[name]
+            end = min(parsed.match[brace], len(parsed.tokens) - 1)
+            body = parsed.tokens[brace:end]
+            line = parsed.source.count('\n', 0, parsed.starts[brace]) + 1
+            result.append({
+                'name': name,
+                'file': filename,
+                'line': line,
+                'lines': parsed.source.count('\n', parsed.starts[brace], parsed.starts[end]) + 1,
+                'statements': body.count(';'),
+                'branches': body.count('if'),
+                'loops': body.count('while') + body.count('for'),
+            })
+        return result
+
+    def graph(self, name):
+        return self.sketch.graph(name)
+
+def load_module(kind, data):
+    """Parse an uploaded source once. Returns (module id, module).
+
+    kind is 'python' (a .py file), 'arduino' (a single .ino file) or
+    'sketch' (a zipped sketch folder). Raises SyntaxError for invalid Python.
+    """
+    module_id = content_key('functions', kind, data)
+    module = modules.get(module_id)
+    if module is None:
+        if kind == 'python':
+            module = PythonModule(data.decode('utf-8'))
+        elif kind == 'arduino':
+            module = ArduinoModule(Sketch({'sketch.ino': data.decode('utf-8')}, main='sketch.ino'))
+        elif kind == 'sketch':
+            module = ArduinoModule(Sketch.from_zip(data))
+        else:
+            raise ValueError(f"Unknown source kind: {kind}")
+        modules.put(module_id, module)
+    return module_id, module
+
+def function_diagram(module_id, name, output_format='mmd'):
+    """Diagram of one function of a loaded module, generated on first request.
+
+    Raises KeyError if the module is no longer cached or has no such function.
+    """
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown format: {output_format}")
+    key = content_key(module_id, name, output_format, CONVERTER_VERSION)
+    cached = diagrams.get(key)
+    if cached is not None:
+        return cached.decode('utf-8')
+
+    module = modules.get(module_id)
+    if module is None:
+        raise KeyError(module_id)
+    graph = module.graph(name)
+    text = to_mermaid(graph) if output_format == 'mmd' else convert_graph_to_nsd(graph)
+    diagrams.put(key, text.encode('utf-8'))
+    return text
+
+def module_index(kind, data):
+    # (module id, function index) of an upload, for a worker process: the
+    # parsed module stays in that process, only the index goes back
+    module_id, module = load_module(kind, data)
+    return module_id, module.index()
+
+def source_function_diagram(kind, data, name, output_format='mmd'):
+    # function_diagram for a worker process that is handed the upload: the
+    # module is parsed again unless this process still has it cached
+    module_id, _ = load_module(kind, data)
+    return function_diagram(module_id, name, output_format)
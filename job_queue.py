@@ -0,0 +1,352 @@
+# Bounded job queue for CPU-bound conversions.
+#
+# Jobs wait in a queue of limited depth and run in a fixed number of worker
+# processes. Every worker process is owned by one dispatcher thread, which
+# hands it one job at a time over a pipe; a job that runs past its timeout (or
+# is cancelled) is stopped by killing the process, and a fresh one is started.
+# A pool with an executor would not allow that, as a running task cannot be
+# interrupted there.
+#
+# Inputs of at least LARGE_JOB_BYTES go into a separate lane: they never
+# occupy every worker at once, and queued small jobs are started first, so
+# normal-sized conversions keep a short wait while large ones are running.
+
+import collections
+import itertools
+import math
+import multiprocessing
+# Registers multiprocessing's exit handler now, before any atexit shutdown of a
+# JobQueue; handlers run in reverse, so the workers are killed before that
+# handler joins them (they are not daemons and would never be joined)
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+
+DEFAULT_TIMEOUT = 30.0       # Seconds a job may run
+DEFAULT_MAX_DEPTH = 32       # Jobs waiting for a worker
+LARGE_JOB_BYTES = 256 * 1024
+POLL_INTERVAL = 0.05         # How often a dispatcher checks for timeout/cancel
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class JobTimeout(Exception):
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+class JobFailed(Exception):
+    # An exception raised by the job inside the worker process; details is
+    # the exception's details attribute (e.g. of limits.LimitExceeded), if any
+    def __init__(self, type_name, message, details=None):
+        super().__init__(f"{type_name}: {message}")
+        self.type_name = type_name
+        self.message = message
+        self.details = details
+
+_END = object()
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, fn, args, size, timeout):
+        self.id = next(self._ids)
+        self.fn = fn
+        self.args = args
+        self.size = size
+        self.timeout = timeout
+        self.state = 'queued'  # queued, running, done, failed, cancelled
+        self.error = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.streamed = False  # Result arrives as chunks (an iterator in the worker)
+        self._result = None
+        self._chunks = queue.Queue()
+        self._streamed = []
+        self._done = threading.Event()
+        self._cancel = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        # The return value of the job (a streamed result joined into one
+        # string); raises the job's error
+        if not self._done.wait(timeout):
+            raise JobTimeout(f"Job {self.id} not finished after {timeout}s")
+        if self.error is not None:
+            raise self.error
+        if self._result is None and self._streamed:
+            return self._streamed[0][:0].join(self._streamed)  # str or bytes chunks
+        return self._result
+
+    def iter_chunks(self):
+        # Chunks of a streamed result as the worker produces them; a job that
+        # returns a plain value yields it as a single chunk
+        while True:
+            item = self._chunks.get()
+            if item is _END:
+                break
+            yield item
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _chunk(self, chunk):
+        self.streamed = True
+        self._streamed.append(chunk)
+        self._chunks.put(chunk)
+
+    def _finish(self, state, result=None, error=None):
+        self.state = state
+        self._result = result
+        self.error = error
+        self.finished = time.monotonic()
+        if result is not None:
+            self._chunks.put(result)
+        self._chunks.put(_END)
+        self._done.set()
+
+def completed_job(result):
+    # A job that is already done, e.g. for a result found in a cache
+    job = Job(None, (), 0, None)
+    job._finish('done', result=result)
+    return job
+
+def _worker_main(conn, initializers, report):
+    # Runs in the worker process: one (fn, args) at a time. Results that are
+    # iterators (e.g. iter_nsd_svg) are sent on chunk by chunk. After every
+    # job, what report() returns (if not None) goes to the parent first.
+    for initializer, initargs in initializers:
+        initializer(*initargs)
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            result = fn(*args)
+            if hasattr(result, '__next__'):
+                for chunk in result:
+                    conn.send(('chunk', chunk))
+                message = ('end', None)
+            else:
+                message = ('ok', result)
+        except Exception as e:
+            message = ('error', (type(e).__name__, str(e), getattr(e, 'details', None)))
+        data = report() if report is not None else None
+        if data is not None:
+            conn.send(('report', data))
+        conn.send(message)
+
+class _Worker:
+    def __init__(self, context, initializers, report):
+        self.context = context
+        self.initializers = initializers
+        self.report = report
+        self.process = None
+        self.conn = None
+
+    def ensure_started(self):
+        if self.process is None or not self.process.is_alive():
+            self.stop()
+            parent, child = self.context.Pipe()
+            # Not a daemon, so a job can start processes of its own (a batch
+            # conversion); JobQueue.shutdown kills it instead
+            self.process = self.context.Process(target=_worker_main,
+                                                args=(child, self.initializers, self.report))
+            self.process.start()
+            child.close()
+            self.conn = parent
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join()
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+class JobQueue:
+    def __init__(self, workers=None, max_depth=DEFAULT_MAX_DEPTH, timeout=DEFAULT_TIMEOUT,
+                 large_job_bytes=LARGE_JOB_BYTES, initializers=(), report=None, on_report=None):
+        # initializers: (function, args) pairs run once in every worker
+        # process. report() runs in the worker after every job; its result is
+        # passed to on_report() in this process (e.g. metrics.drain/merge).
+        self.workers = workers or os.cpu_count() or 1
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.large_job_bytes = large_job_bytes
+        # Large jobs leave at least one worker free for small ones
+        self.max_large_running = max(1, self.workers - 1)
+
+        self._lock = threading.Condition()
+        self._small = collections.deque()
+        self._large = collections.deque()
+        self._running = 0
+        self._large_running = 0
+        self._closed = False
+        self._avg_seconds = 1.0  # Moving average of job run time
+        self.counts = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0,
+                       'timed_out': 0, 'cancelled': 0}
+
+        context = multiprocessing.get_context('spawn')
+        self.on_report = on_report
+        self._workers = [_Worker(context, tuple(initializers), report) for _ in range(self.workers)]
+        self._threads = []
+        for i, worker in enumerate(self._workers):
+            thread = threading.Thread(target=self._dispatch, args=(worker,),
+                                      name=f'job-dispatcher-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args, size=0, timeout=None):
+        # Queue fn(*args) for a worker process. size (input bytes) picks the
+        # lane. Raises QueueFull when max_depth jobs are already waiting.
+        job = Job(fn, args, size, self.timeout if timeout is None else timeout)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Job queue is shut down")
+            if len(self._small) + len(self._large) >= self.max_depth:
+                self.counts['rejected'] += 1
+                raise QueueFull(self._retry_after())
+            (self._large if size >= self.large_job_bytes else self._small).append(job)
+            self.counts['submitted'] += 1
+            self._lock.notify()
+        return job
+
+    def cancel(self, job):
+        # A queued job is dropped at once, a running one stopped by its dispatcher
+        with self._lock:
+            for lane in (self._small, self._large):
+                if job in lane:
+                    lane.remove(job)
+                    self.counts['cancelled'] += 1
+                    job._finish('cancelled', error=JobCancelled(f"Job {job.id} was cancelled"))
+                    return
+        job.cancel()
+
+    def _retry_after(self):
+        # Seconds until the queue has probably drained by one slot
+        waiting = len(self._small) + len(self._large)
+        return max(1, math.ceil(self._avg_seconds * (waiting + 1) / self.workers))
+
+    def _next_job(self):
+        with self._lock:
+            while True:
+                if self._closed:
+                    return None
+                if self._small:
+                    job = self._small.popleft()
+                elif self._large and self._large_running < self.max_large_running:
+                    job = self._large.popleft()
+                    self._large_running += 1
+                else:
+                    self._lock.wait()
+                    continue
+                if job._cancel.is_set():
+                    if job.size >= self.large_job_bytes:
+                        self._large_running -= 1
+                    self.counts['cancelled'] += 1
+                    job._finish('cancelled', error=JobCancelled(f"Job {job.id} was cancelled"))
+                    continue
+                self._running += 1
+                job.state = 'running'
+                job.started = time.monotonic()
+                return job
+
+    def _dispatch(self, worker):
+        while True:
+            job = self._next_job()
+            if job is None:
+                worker.stop()
+                return
+            state = 'failed'
+            try:
+                state = self._run(worker, job)
+            except Exception as e:
+                # A bug here must not stop the dispatcher or leave the job unfinished
+                worker.stop()
+                if not job.done():
+                    job._finish('failed', error=JobFailed(type(e).__name__, str(e)))
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    if job.size >= self.large_job_bytes:
+                        self._large_running -= 1
+                    self.counts[state] += 1
+                    if job.finished is not None and state == 'done':
+                        self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (job.finished - job.started)
+                    self._lock.notify_all()
+
+    def _run(self, worker, job):
+        # Run one job in the worker process; returns the counter to bump
+        deadline = job.started + job.timeout if job.timeout else None
+        try:
+            worker.ensure_started()
+            worker.conn.send((job.fn, job.args))
+            while True:
+                # Checked on every message too, so a job that keeps streaming
+                # chunks is still stopped
+                if job._cancel.is_set():
+                    worker.stop()
+                    job._finish('cancelled', error=JobCancelled(f"Job {job.id} was cancelled"))
+                    return 'cancelled'
+                if deadline is not None and time.monotonic() > deadline:
+                    worker.stop()
+                    job._finish('failed', error=JobTimeout(f"Job {job.id} took longer than {job.timeout}s"))
+                    return 'timed_out'
+                if not worker.conn.poll(POLL_INTERVAL):
+                    continue
+                kind, value = worker.conn.recv()
+                if kind == 'chunk':
+                    job._chunk(value)
+                elif kind == 'report':
+                    if self.on_report is not None:
+                        self.on_report(value)
+                elif kind == 'error':
+                    job._finish('failed', error=JobFailed(*value))
+                    return 'failed'
+                else:
+                    job._finish('done', result=value)
+                    return 'done'
+        except (EOFError, OSError) as e:
+            # The worker process died (e.g. out of memory); start a new one
+            worker.stop()
+            job._finish('failed', error=JobFailed(type(e).__name__, 'worker process exited'))
+            return 'failed'
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counts)
+            stats.update(workers=self.workers, max_depth=self.max_depth, timeout=self.timeout,
+                         queued=len(self._small) + len(self._large), queued_large=len(self._large),
+                         running=self._running, avg_seconds=round(self._avg_seconds, 4))
+            return stats
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            for job in itertools.chain(self._small, self._large):
+                job._finish('cancelled', error=JobCancelled(f"Job {job.id} was cancelled"))
+            self._small.clear()
+            self._large.clear()
+            self._lock.notify_all()
+        for worker in self._workers:
+            process = worker.process
+            if process is not None and process.is_alive():
+                process.kill()  # Its dispatcher sees the pipe close and cleans up
+        for thread in self._threads:
+            thread.join(timeout=1)
@@ -0,0 +1,40 @@
+# Resource limits for a single conversion.
+#
+# The checks run inside the conversion (in the worker process), right after
+# the input has been parsed and before the expensive structuring and layout.
+# The web app sets the limits from its config with configure(); None turns a
+# limit off. Until then (command line, library use) no limit applies.
+
+import ast
+
+# Defaults of the web app
+MAX_NODES = 20000       # Nodes of a flowchart graph
+MAX_EDGES = 40000       # Edges of a flowchart graph
+MAX_AST_NODES = 500000  # Nodes of a parsed Python module
+
+limits = {'max_nodes': None, 'max_edges': None, 'max_ast_nodes': None}
+
+class LimitExceeded(ValueError):
+    def __init__(self, limit, value, maximum):
+        super().__init__(f"Input too large: {limit} is {maximum}, got {value}")
+        self.details = {'limit': limit, 'value': value, 'maximum': maximum}
+
+def configure(values):
+    # values: {limit name: maximum or None}
+    unknown = set(values) - set(limits)
+    if unknown:
+        raise ValueError(f"Unknown limits: {', '.join(sorted(unknown))}")
+    limits.update(values)
+
+def check(limit, value):
+    maximum = limits[limit]
+    if maximum is not None and value > maximum:
+        raise LimitExceeded(limit, value, maximum)
+
+def check_graph(graph):
+    check('max_nodes', graph.number_of_nodes())
+    check('max_edges', graph.number_of_edges())
+
+def check_ast(tree):
+    if limits['max_ast_nodes'] is not None:
+        check('max_ast_nodes', sum(1 for _ in ast.walk(tree)))
@@ -0,0 +1,175 @@
+# Single-pass tokenizer for Mermaid flowcharts.
+#
+# Every line is scanned once, left to right, with precompiled patterns:
+#
+#   statement  := group (link group)* [';']
+#   group      := node ('&' node)*
+#   node       := ID [shape] [':::' class]
+#   link       := arrow ['|' text '|']  |  '--' text '-->'  |  '-.' text '.->'  |  '==' text '==>'
+#
+# so chained edges (A --> B --> C) and fan-out (A & B --> C & D) produce every
+# edge. graph/flowchart headers, subgraph/end, direction, comments and the
+# styling statements (classDef, class, style, linkStyle, click) are recognised
+# and never turn into nodes.
+
+import re
+
+# Shape of a node definition -> node type used by the converter.
+# Longer openers come first so that "([" is not read as "(".
+_LABEL = r'("[^"]*"|.*?)'
+_SHAPES = [
+    (r'\(\(\(' + _LABEL + r'\)\)\)', 'terminal'),  # (((double circle)))
+    (r'\(\(' + _LABEL + r'\)\)', 'terminal'),      # ((circle))
+    (r'\(\[' + _LABEL + r'\]\)', 'terminal'),      # ([stadium])
+    (r'\[\[' + _LABEL + r'\]\]', 'process'),       # [[subroutine]]
+    (r'\[\(' + _LABEL + r'\)\]', 'process'),       # [(database)]
+    (r'\{\{' + _LABEL + r'\}\}', 'process'),       # {{hexagon}}
+    (r'\[[/\\]' + _LABEL + r'[/\\]\]', 'process'), # [/parallelogram/], [\trapezoid/] ...
+    (r'\(' + _LABEL + r'\)', 'process'),           # (round)
+    (r'\[' + _LABEL + r'\]', 'process'),           # [rect]
+    (r'\{' + _LABEL + r'\}', 'decision'),          # {rhombus}
+    (r'>' + _LABEL + r'\]', 'process'),            # >asymmetric]
+]
+_SHAPE_RE = re.compile(r'[ \t]*(?:' + '|'.join(pattern for pattern, _ in _SHAPES) + ')')
+_SHAPE_TYPES = [node_type for _, node_type in _SHAPES]
+
+_NODE_RE = re.compile(r'[ \t]*(\w+)')
+_CLASS_SUFFIX_RE = re.compile(r':::([\w-]+)')
+_AMP_RE = re.compile(r'[ \t]*&')
+_END_RE = re.compile(r'[ \t]*(?:;|$)')
+
+# Arrows: solid (-->, ---, --x, --o), dotted (-.->, -.-), thick (==>, ===),
+# optionally bidirectional (<-->, x--x, o--o), and invisible (~~~).
+_ARROW = r'[<xo]?(?:-{2,}[->xo]|-\.+-[>xo]?|={2,}[=>xo]|~{3,})'
+_LINK_RE = re.compile(r'[ \t]*(' + _ARROW + r')(?:[ \t]*\|([^|]*)\|)?')
+_TEXT_LINK_RE = re.compile(
+    r'[ \t]*[<xo]?(?:--|-\.|==)[ \t]*([^-=.|>][^|]*?)[ \t]*(-{2,}[->xo]|\.-+[>xo]?|={2,}[=>xo])')
+
+_KEYWORD_RE = re.compile(
+    r'[ \t]*(?:(graph|flowchart)\b[ \t]*(?:\w+)?'
+    r'|(subgraph|classDef|class|style|linkStyle|click|direction)\b[ \t]*(.*)'
+    r'|(end)(?=[ \t]*(?:;|$)))')
+
+def parse_node(text):
+    # (id, label, type) of the node at the start of text, e.g. 'B{"x > 5?"}'
+    m = _NODE_RE.match(text)
+    if not m:
+        return None, None, None
+    node_id = m.group(1)
+    shape = _SHAPE_RE.match(text, m.end())
+    if not shape:
+        return node_id, node_id, 'process'
+    label, node_type = _shape_of(shape)
+    return node_id, label, node_type
+
+def _shape_of(m):
+    index = m.lastindex - 1
+    label = m.group(m.lastindex)
+    if label.startswith('"') and label.endswith('"') and len(label) >= 2:
+        label = label[1:-1]
+    return label, _SHAPE_TYPES[index]
+
+def _strip_quotes(text):
+    text = text.strip()
+    if len(text) >= 2 and text.startswith('"') and text.endswith('"'):
+        return text[1:-1]
+    return text
+
+def iter_statements(content):
+    """Yield parsed items in source order:
+
+    ('node', id, label, type)     label/type are None for a bare reference
+    ('edge', source, target, label)
+    ('classDef', name, style) / ('class', id, name) / ('style', id, style)
+    """
+    for line in content.split('\n'):
+        stripped = line.strip()
+        if not stripped or stripped.startswith('%%'):
+            continue
+        yield from _iter_line(stripped)
+
+def _iter_line(line):
+    pos = 0
+    length = len(line)
+    while pos < length:
+        m = _KEYWORD_RE.match(line, pos)
+        if m:
+            if m.group(2):
+                yield from _keyword_items(m.group(2), m.group(3))
+                return
+            end = _END_RE.match(line, m.end())
+            pos = end.end() if end else m.end()
+            continue
+
+        group, pos = _read_group(line, pos)
+        if group is None:
+            return  # not a statement we understand; skip the rest of the line
+        for item in group:
+            yield item
+
+        while True:
+            link = _LINK_RE.match(line, pos)
+            if link:
+                arrow, label = link.group(1), link.group(2)
+            else:
+                link = _TEXT_LINK_RE.match(line, pos)
+                if not link:
+                    break
+                label, arrow = link.group(1), link.group(2)
+            right, end = _read_group(line, link.end())
+            if right is None:
+                return
+            for item in right:
+                yield item
+            if not arrow.startswith('~'):
+                label = _strip_quotes(label) if label else ""
+                for left_item in group:
+                    for right_item in right:
+                        if left_item[0] == 'node' and right_item[0] == 'node':
+                            yield ('edge', left_item[1], right_item[1], label)
+            group, pos = right, end
+
+        m = _END_RE.match(line, pos)
+        if not m:
+            return
+        pos = m.end()
+
+def _read_group(line, pos):
+    items = []
+    while True:
+        m = _NODE_RE.match(line, pos)
+        if not m:
+            return None, pos
+        node_id = m.group(1)
+        pos = m.end()
+        shape = _SHAPE_RE.match(line, pos)
+        if shape:
+            label, node_type = _shape_of(shape)
+            pos = shape.end()
+        else:
+            label = node_type = None
+        items.append(('node', node_id, label, node_type))
+        suffix = _CLASS_SUFFIX_RE.match(line, pos)
+        if suffix:
+            items.append(('class', node_id, suffix.group(1)))
+            pos = suffix.end()
+        amp = _AMP_RE.match(line, pos)
+        if not amp:
+            return items, pos
+        pos = amp.end()
+
+def _keyword_items(keyword, rest):
+    if keyword == 'classDef':
+        parts = rest.rstrip(';').split(None, 1)
+        if len(parts) == 2:
+            for name in parts[0].split(','):
+                yield ('classDef', name, parts[1].strip())
+    elif keyword == 'class':
+        parts = rest.rstrip(';').split()
+        if len(parts) == 2:
+            for node_id in parts[0].split(','):
+                yield ('class', node_id, parts[1])
+    elif keyword == 'style':
+        parts = rest.rstrip(';').split(None, 1)
+        if len(parts) == 2:
+            yield ('style', parts[0], parts[1].strip())
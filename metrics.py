@@ -0,0 +1,240 @@
+# Conversion metrics in the Prometheus text format.
+#
+# Converters time their stages with stage() and record sizes with observe().
+# Both do nothing but check a flag unless enabled is set, so library and
+# command line use costs next to nothing. Worker processes drain() their
+# observations after every job and the parent merge()s them, so /metrics
+# covers all processes.
+#
+# While a trace is running (see profiling.py), stages are also recorded as a
+# tree of spans, and work() counts algorithmic work of the converter.
+
+import bisect
+import threading
+import time
+
+enabled = False
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+COUNT_BUCKETS = (10, 100, 1000, 10000, 100000)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+# Histograms by name: (help text, bucket upper bounds)
+HISTOGRAMS = {
+    'pap_stage_seconds': ('Time spent per conversion stage', TIME_BUCKETS),
+    'pap_graph_nodes': ('Nodes per flowchart graph', COUNT_BUCKETS),
+    'pap_graph_edges': ('Edges per flowchart graph', COUNT_BUCKETS),
+    'pap_output_bytes': ('Size of conversion results', BYTES_BUCKETS),
+}
+# Counters by name: help text
+COUNTERS = {
+    'pap_cache_hits_total': 'Cache hits',
+    'pap_cache_misses_total': 'Cache misses',
+    'pap_cache_evictions_total': 'Cache evictions',
+    'pap_work_total': 'Work done by the converter (loop/merge lookups, blocks rendered)',
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+_counters = {}    # (name, labels) -> value
+_caches = {}      # name -> [cache, hits, misses, evictions] as last counted
+_trace = None     # Stack of open spans while tracing, the root span first
+_work = {}        # Work counters of the current trace
+
+def configure(on):
+    global enabled
+    enabled = bool(on)
+
+def observe(name, value, **labels):
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    buckets = HISTOGRAMS[name][1]
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(buckets) + 1), 0, 0]
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+def count(name, amount=1, **labels):
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def work(name, amount):
+    # Count converter work; only while enabled or tracing
+    if enabled:
+        count('pap_work_total', amount, kind=name)
+    if _trace is not None:
+        _work[name] = _work.get(name, 0) + amount
+
+def _span(name):
+    span = {'name': name, 'seconds': 0.0, 'children': []}
+    _trace[-1]['children'].append(span)
+    return span
+
+class _Stage:
+    __slots__ = ('name', 'start', 'span')
+
+    def __init__(self, name):
+        self.name = name
+        self.span = None
+
+    def __enter__(self):
+        if _trace is not None:
+            self.span = _span(self.name)
+            _trace.append(self.span)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        observe('pap_stage_seconds', elapsed, stage=self.name)
+        if self.span is not None and _trace is not None:
+            self.span['seconds'] = elapsed
+            # Stages nest, so this one's span is the innermost open one
+            span = _trace.pop()
+            assert span is self.span
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NO_STAGE = _NoStage()
+
+def stage(name):
+    # with stage('layout'): ... records the time of the block
+    return _Stage(name) if enabled or _trace is not None else _NO_STAGE
+
+def timed_iter(name, chunks, output_format=None):
+    # Pass chunks through, recording the time spent producing them (not the
+    # time the consumer takes) and, given output_format, their total size
+    if not enabled and _trace is None:
+        return chunks
+    return _timed_iter(name, iter(chunks), output_format)
+
+def _timed_iter(name, chunks, output_format):
+    elapsed = 0.0
+    size = 0
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        elapsed += time.perf_counter() - start
+        if chunk is None:
+            break
+        size += len(chunk)
+        yield chunk
+    observe('pap_stage_seconds', elapsed, stage=name)
+    if _trace is not None:
+        _span(name)['seconds'] = elapsed
+    if output_format is not None:
+        observe('pap_output_bytes', size, format=output_format)
+
+def start_trace(name='conversion'):
+    global _trace
+    _work.clear()
+    _trace = [{'name': name, 'seconds': 0.0, 'children': [], 'start': time.perf_counter()}]
+
+def stop_trace():
+    # (span tree, work counters) of the trace
+    global _trace
+    root = _trace[0]
+    root['seconds'] = time.perf_counter() - root.pop('start')
+    _trace = None
+    return root, dict(_work)
+
+def register_cache(name, cache):
+    # Report the hit/miss/eviction counters of an LRUCache
+    with _lock:
+        _caches[name] = [cache, 0, 0, 0]
+
+def _count_caches():
+    # Add what registered caches counted since the last call; _lock held
+    for name, entry in _caches.items():
+        cache = entry[0]
+        current = (cache.hits, cache.misses, cache.evictions)
+        for i, counter in enumerate(('pap_cache_hits_total', 'pap_cache_misses_total', 'pap_cache_evictions_total')):
+            delta = current[i] - entry[i + 1]
+            if delta > 0:
+                key = (counter, (('cache', name),))
+                _counters[key] = _counters.get(key, 0) + delta
+        entry[1:] = current
+
+def drain():
+    # Observations since the last drain (None if there are none), for the
+    # parent process to merge()
+    global _histograms, _counters
+    if not enabled:
+        return None
+    with _lock:
+        _count_caches()
+        if not _histograms and not _counters:
+            return None
+        data = (_histograms, _counters)
+        _histograms, _counters = {}, {}
+    return data
+
+def merge(data):
+    histograms, counters = data
+    with _lock:
+        for key, (buckets, total, n) in histograms.items():
+            histogram = _histograms.get(key)
+            if histogram is None:
+                _histograms[key] = [list(buckets), total, n]
+            else:
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += total
+                histogram[2] += n
+        for key, value in counters.items():
+            _counters[key] = _counters.get(key, 0) + value
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        for entry in _caches.values():
+            cache = entry[0]
+            entry[1:] = [cache.hits, cache.misses, cache.evictions]
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    # All metrics in the Prometheus text exposition format
+    with _lock:
+        _count_caches()
+        lines = []
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), (counts, total, n) in sorted(_histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(labels)} {n}')
+        for name, help_text in COUNTERS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for (metric, labels), value in sorted(_counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,118 @@
+# Structogram layout as data, for clients that draw it themselves (canvas,
+# virtualized views, their own styles) instead of using the finished SVG.
+#
+# The positions are the ones render_blocks draws at: every block has its
+# type, label, x, y, width and height; decisions and loops also the height of
+# their header and their child sequences (yes/no, body). Two encodings:
+#
+# JSON: {"version", "width", "height", "blocks": [block, ...]} with
+#   block = {"type", "label", "x", "y", "width", "height",
+#            "header_height", "children": [[block, ...], ...]}
+#   (header_height and children only on decisions and loops)
+#
+# Binary (little endian), for large diagrams:
+#   header  magic b'NSDL', u16 version, 2 pad bytes, f32 width, f32 height,
+#           u32 block count
+#   blocks  parents before their children, RECORD each: u8 type (index in
+#           BLOCK_TYPES), u8 child sequence in the parent (0 yes/body, 1 no), 2 pad bytes,
+#           i32 parent index (-1 at the top level), f32 x, y, width, height,
+#           header_height, u32 label offset, u32 label length
+#   labels  UTF-8, the offsets above are relative to the start of this part
+
+import json
+import struct
+
+from converter import (structure_graph, calculate_min_widths, calculate_heights, LOOP_INDENT,
+                       MIN_DIAGRAM_WIDTH)
+import metrics
+from pap_renderer import SOURCE_GRAPHS
+
+LAYOUT_VERSION = 1
+FORMATS = ('json', 'bin')
+BLOCK_TYPES = ('process', 'decision', 'loop')
+HEADER = struct.Struct('<4sHxxffI')
+RECORD = struct.Struct('<BBxxi5fII')
+
+def layout_graph(graph, start_node=None):
+    # (blocks, width, height) of the structogram; (None, 0, 0) without a start node
+    blocks = structure_graph(graph, start_node)
+    if blocks is None:
+        return None, 0, 0
+    with metrics.stage('layout'):
+        # No memo: memoized subtrees would not get the layout of their children
+        width = max(MIN_DIAGRAM_WIDTH, calculate_min_widths(blocks))
+        height = calculate_heights(blocks, width)
+    return blocks, width, height
+
+def iter_placed(blocks, width):
+    # (block, parent index, child sequence, x, y, width) at the positions
+    # render_blocks uses. A sequence is yielded as a whole, in order, and
+    # always after its parent; the parent index counts the yielded blocks.
+    index = 0
+    stack = [(blocks, -1, 0, 0, 0, width)]
+    while stack:
+        seq, parent, branch, x, y, seq_width = stack.pop()
+        children = []
+        for block in seq:
+            yield block, parent, branch, x, y, seq_width
+            if block.type == 'decision':
+                top = y + block.header_height
+                children.append((block.yes, index, 0, x, top, block.yes_width))
+                children.append((block.no, index, 1, x + block.yes_width, top, block.no_width))
+            elif block.type == 'loop':
+                children.append((block.body, index, 0, x + LOOP_INDENT, y + block.header_height, block.body_width))
+            index += 1
+            y += block.height
+        stack.extend(reversed(children))
+
+def _r(value):
+    return round(value, 1)
+
+def layout_to_json(blocks, width, height):
+    top = []
+    placed = []  # All dicts in the order of iter_placed, which parent indexes refer to
+    for block, parent, branch, x, y, block_width in iter_placed(blocks or [], width):
+        item = {'type': block.type, 'label': block.label, 'x': _r(x), 'y': _r(y),
+                'width': _r(block_width), 'height': _r(block.height)}
+        if block.children():
+            item['header_height'] = _r(block.header_height)
+            item['children'] = [[] for _ in block.children()]
+        placed.append(item)
+        (top if parent < 0 else placed[parent]['children'][branch]).append(item)
+    return json.dumps({'version': LAYOUT_VERSION, 'width': _r(width), 'height': _r(height), 'blocks': top},
+                      separators=(',', ':'), ensure_ascii=False)
+
+def layout_to_binary(blocks, width, height):
+    records = []
+    labels = bytearray()
+    for block, parent, branch, x, y, block_width in iter_placed(blocks or [], width):
+        label = block.label.encode('utf-8')
+        records.append(RECORD.pack(BLOCK_TYPES.index(block.type), branch, parent, x, y, block_width,
+                                   block.height, getattr(block, 'header_height', 0), len(labels), len(label)))
+        labels += label
+    return HEADER.pack(b'NSDL', LAYOUT_VERSION, width, height, len(records)) + b''.join(records) + bytes(labels)
+
+def read_binary_layout(data):
+    # The blocks of a binary layout as flat dicts (with 'parent' and 'branch'),
+    # e.g. for tests and tools; clients read the same format in their language
+    magic, version, width, height, count = HEADER.unpack_from(data)
+    if magic != b'NSDL':
+        raise ValueError('Not a binary structogram layout')
+    labels = HEADER.size + count * RECORD.size
+    blocks = []
+    for i in range(count):
+        record = RECORD.unpack_from(data, HEADER.size + i * RECORD.size)
+        kind, branch, parent, x, y, w, h, header_h, offset, length = record
+        blocks.append({'type': BLOCK_TYPES[kind], 'branch': branch, 'parent': parent, 'x': x, 'y': y,
+                       'width': w, 'height': h, 'header_height': header_h,
+                       'label': data[labels + offset:labels + offset + length].decode('utf-8')})
+    return {'version': version, 'width': width, 'height': height, 'blocks': blocks}
+
+def convert_source_to_layout(source, kind='mermaid', output_format='json'):
+    # Mermaid text, a Python script or an Arduino sketch to its structogram
+    # layout; JSON text or bytes
+    graph, start_node = SOURCE_GRAPHS[kind](source)
+    blocks, width, height = layout_graph(graph, start_node)
+    if output_format == 'bin':
+        return layout_to_binary(blocks, width, height)
+    return layout_to_json(blocks, width, height)
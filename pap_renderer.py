@@ -0,0 +1,465 @@
+# Server-side flowchart (PAP) rendering.
+#
+# Draws a flowchart graph (see flowgraph.py) as SVG without mermaid.js, in
+# the layered style of Sugiyama et al.:
+#   1. back edges (found by depth-first search from the start node) are
+#      turned around, so the graph becomes acyclic
+#   2. every node gets a rank (its layer) by longest path from the sources;
+#      edges spanning several layers get a dummy vertex per layer in between
+#   3. crossings are reduced by barycenter sweeps over the layers
+#   4. x coordinates follow the neighbours in the previous layer, y the layers
+#   5. edges are routed orthogonally; back edges run up on the right
+# Every step is iterative and roughly linear (a back edge costs one step per
+# layer it spans), so graphs with thousands of nodes lay out in well under a
+# second.
+
+import html
+
+from cache import LRUCache, content_key
+from converter import parse_mermaid, find_start_node
+from arduino_to_mermaid import arduino_to_graph
+from limits import check_graph
+import metrics
+from python_to_mermaid import python_to_graph
+from textmetrics import text_width, wrap_text
+
+PAP_VERSION = '1'  # Part of the cache key; bump when the drawing changes
+PAP_CACHE_BYTES = 32 * 1024 * 1024
+
+FONT_SIZE = 14
+LABEL_FONT_SIZE = 12
+LINE_HEIGHT = 18
+MAX_LABEL_WIDTH = 220  # Longer labels are wrapped
+PAD_X = 12
+PAD_Y = 8
+MIN_NODE_WIDTH = 60
+NODE_GAP = 30    # Horizontal space between nodes of a layer
+DUMMY_WIDTH = 8  # Width an edge passing through a layer takes up
+LAYER_GAP = 50   # Vertical space between layers
+LANE_GAP = 14    # Distance between the lanes of back edges
+MARGIN = 20
+SWEEPS = 4       # Barycenter sweeps (down and up) for crossing reduction
+PLACEMENT_PASSES = 3
+
+# Fill and stroke per node type
+NODE_STYLES = {
+    'process': ('#ececff', '#9370db'),
+    'decision': ('#fff5d6', '#c9a227'),
+    'terminal': ('#e6f4ea', '#3c8d50'),
+}
+
+# SVGs by input, per process: in the web app each worker has its own
+pap_cache = LRUCache(PAP_CACHE_BYTES)
+metrics.register_cache('pap', pap_cache)
+
+def _back_edges(n, edges, out, roots):
+    # Depth-first search; an edge to a node still on the stack closes a cycle.
+    # Returns the back edge flags and the nodes in discovery order.
+    state = [0] * n  # 0 new, 1 on the stack, 2 done
+    back = [False] * len(edges)
+    discovery = []
+    for root in roots:
+        if state[root]:
+            continue
+        state[root] = 1
+        discovery.append(root)
+        stack = [[root, 0]]
+        while stack:
+            frame = stack[-1]
+            v, pos = frame
+            if pos < len(out[v]):
+                frame[1] += 1
+                k = out[v][pos]
+                w = edges[k][1]
+                if state[w] == 1:
+                    back[k] = True
+                elif state[w] == 0:
+                    state[w] = 1
+                    discovery.append(w)
+                    stack.append([w, 0])
+            else:
+                state[v] = 2
+                stack.pop()
+    return back, discovery
+
+def _ranks(n, edges, back, discovery):
+    # Longest path from the sources over the forward edges (Kahn's order)
+    succ = [[] for _ in range(n)]
+    indegree = [0] * n
+    for k, (u, v, _) in enumerate(edges):
+        if not back[k] and u != v:
+            succ[u].append(v)
+            indegree[v] += 1
+    rank = [0] * n
+    queue = [v for v in discovery if indegree[v] == 0]
+    head = 0
+    while head < len(queue):
+        u = queue[head]
+        head += 1
+        for v in succ[u]:
+            if rank[u] + 1 > rank[v]:
+                rank[v] = rank[u] + 1
+            indegree[v] -= 1
+            if indegree[v] == 0:
+                queue.append(v)
+    return rank
+
+def _crossings(layers, down, pos):
+    # Edge crossings between consecutive layers (inversions, with a Fenwick tree)
+    total = 0
+    for layer in layers[:-1]:
+        targets = []
+        for v in layer:
+            targets.extend(sorted(pos[w] for w in down[v]))
+        size = max(targets, default=-1) + 2
+        tree = [0] * (size + 1)
+        seen = 0
+        for t in targets:
+            # Earlier edges that end to the right of t cross this one
+            i = t + 1
+            smaller_or_equal = 0
+            while i > 0:
+                smaller_or_equal += tree[i]
+                i -= i & -i
+            total += seen - smaller_or_equal
+            seen += 1
+            i = t + 1
+            while i <= size:
+                tree[i] += 1
+                i += i & -i
+    return total
+
+def _order_layers(layers, up, down):
+    pos = [0] * sum(len(layer) for layer in layers)
+    for layer in layers:
+        for i, v in enumerate(layer):
+            pos[v] = i
+    best = [list(layer) for layer in layers]
+    best_crossings = _crossings(layers, down, pos)
+
+    for sweep in range(SWEEPS):
+        for r in (range(1, len(layers)) if sweep % 2 == 0 else range(len(layers) - 2, -1, -1)):
+            neighbours = up if sweep % 2 == 0 else down
+            layer = layers[r]
+
+            def barycenter(v):
+                ns = neighbours[v]
+                return (sum(pos[w] for w in ns) / len(ns) if ns else pos[v], pos[v])
+
+            layer.sort(key=barycenter)
+            for i, v in enumerate(layer):
+                pos[v] = i
+        crossings = _crossings(layers, down, pos)
+        if crossings < best_crossings:
+            best_crossings = crossings
+            best = [list(layer) for layer in layers]
+        if best_crossings == 0:
+            break
+    return best
+
+def _place(layer, desired, width):
+    # Centers as close to desired as the widths and gaps allow: the mean of
+    # a left-to-right and a right-to-left placement, both of which keep the
+    # spacing, so their mean does too
+    count = len(layer)
+    left = [0.0] * count
+    right = [0.0] * count
+    for i, v in enumerate(layer):
+        left[i] = desired[v]
+        if i:
+            u = layer[i - 1]
+            left[i] = max(left[i], left[i - 1] + (width[u] + width[v]) / 2 + NODE_GAP)
+    for i in range(count - 1, -1, -1):
+        v = layer[i]
+        right[i] = desired[v]
+        if i < count - 1:
+            w = layer[i + 1]
+            right[i] = min(right[i], right[i + 1] - (width[v] + width[w]) / 2 - NODE_GAP)
+    return [(a + b) / 2 for a, b in zip(left, right)]
+
+def _node_size(label, node_type):
+    lines = wrap_text(label, MAX_LABEL_WIDTH, FONT_SIZE) or ('',)
+    text_w = max(text_width(line, FONT_SIZE) for line in lines)
+    text_h = len(lines) * LINE_HEIGHT
+    if node_type == 'decision':
+        # The text box fits into the diamond at half its width and height
+        return lines, max(MIN_NODE_WIDTH * 1.5, text_w * 2), max(50, text_h * 2)
+    w = max(MIN_NODE_WIDTH, text_w + 2 * PAD_X)
+    h = text_h + 2 * PAD_Y
+    if node_type == 'terminal':
+        w += h / 2  # Room for the rounded ends
+    return lines, w, h
+
+def layout_flowchart(graph, start_node=None):
+    # Positions of all nodes and edge routes of a flowchart graph: a dict with
+    # 'width', 'height', 'nodes' (name, label, type, lines, x, y, w, h with x/y
+    # the top left corner) and 'edges' (source, target, label, points of the
+    # polyline, label_at as (x, y, text-anchor), back for edges drawn upwards)
+    names = list(graph.nodes)
+    n = len(names)
+    if n == 0:
+        return {'width': 2 * MARGIN, 'height': 2 * MARGIN, 'nodes': [], 'edges': []}
+    index = {name: i for i, name in enumerate(names)}
+    edges = [(index[u], index[v], (graph.get_edge_data(u, v) or {}).get('label') or '')
+             for u, v in graph.edges()]
+    out = [[] for _ in range(n)]
+    for k, (u, _, _) in enumerate(edges):
+        out[u].append(k)
+
+    if start_node is None:
+        start_node = find_start_node(graph)
+    roots = [index[start_node]] + list(range(n))
+    back, discovery = _back_edges(n, edges, out, roots)
+    rank = _ranks(n, edges, back, discovery)
+
+    # Vertices: the n nodes, then dummies; chains[k] runs top to bottom
+    width = []
+    height = []
+    lines = []
+    types = []
+    for name in names:
+        attrs = graph.nodes[name]
+        types.append(attrs.get('type') or 'process')
+        node_lines, w, h = _node_size(attrs.get('label', name), types[-1])
+        lines.append(node_lines)
+        width.append(w)
+        height.append(h)
+    chains = []
+    for k, (u, v, _) in enumerate(edges):
+        if u == v:
+            chains.append(None)
+            continue
+        top, bottom = (v, u) if back[k] else (u, v)
+        chain = [top]
+        for r in range(rank[top] + 1, rank[bottom]):
+            chain.append(len(rank))
+            rank.append(r)
+            width.append(DUMMY_WIDTH)
+            height.append(0)
+        chain.append(bottom)
+        chains.append(chain)
+    total = len(rank)
+
+    up = [[] for _ in range(total)]
+    down = [[] for _ in range(total)]
+    for chain in chains:
+        if chain:
+            for a, b in zip(chain, chain[1:]):
+                down[a].append(b)
+                up[b].append(a)
+
+    layers = [[] for _ in range(max(rank) + 1)]
+    for v in discovery:
+        layers[rank[v]].append(v)
+    for v in range(n, total):
+        layers[rank[v]].append(v)
+
+    with metrics.stage('pap_order'):
+        layers = _order_layers(layers, up, down)
+
+    # x: start packed, then follow the neighbours of the previous layer
+    x = [0.0] * total
+    for layer in layers:
+        cursor = 0.0
+        for v in layer:
+            x[v] = cursor + width[v] / 2
+            cursor += width[v] + NODE_GAP
+    for _ in range(PLACEMENT_PASSES):
+        for neighbours, order in ((up, layers[1:]), (down, layers[-2::-1])):
+            for layer in order:
+                desired = {v: (sum(x[w] for w in neighbours[v]) / len(neighbours[v]) if neighbours[v] else x[v])
+                           for v in layer}
+                for v, center in zip(layer, _place(layer, desired, width)):
+                    x[v] = center
+    shift = MARGIN - min(x[v] - width[v] / 2 for v in range(total))
+    x = [value + shift for value in x]
+
+    # y: layers as high as their highest node, nodes centered in them
+    layer_top = []
+    layer_bottom = []
+    y = MARGIN
+    for layer in layers:
+        h = max((height[v] for v in layer), default=0)
+        layer_top.append(y)
+        layer_bottom.append(y + h)
+        y += h + LAYER_GAP
+    cy = [(layer_top[rank[v]] + layer_bottom[rank[v]]) / 2 for v in range(total)]
+    right_edge = max(x[v] + width[v] / 2 for v in range(total))
+
+    # Ports: outgoing forward edges leave at the bottom, spread by where they
+    # go; incoming ones arrive at the top, spread by where they come from
+    out_ports = {}
+    in_ports = {}
+    for v in range(n):
+        leaving = sorted((k for k in out[v] if chains[k] and not back[k]), key=lambda k: x[chains[k][1]])
+        for i, k in enumerate(leaving):
+            out_ports[k] = (i, len(leaving))
+    arriving = [[] for _ in range(n)]
+    for k, chain in enumerate(chains):
+        if chain and not back[k]:
+            arriving[chain[-1]].append(k)
+    for v in range(n):
+        arriving[v].sort(key=lambda k: x[chains[k][-2]])
+        for i, k in enumerate(arriving[v]):
+            in_ports[k] = (i, len(arriving[v]))
+
+    routed = []
+    lanes = [0] * len(layers)  # Back edge lanes in use per layer
+    layer_right = [max((x[w] + width[w] / 2 for w in layer), default=0) for layer in layers]
+    for k, (u, v, label) in enumerate(edges):
+        chain = chains[k]
+        if chain is None:
+            # Self loop on the left side, the right one is for back edges
+            left = x[u] - width[u] / 2
+            points = [(left, cy[u] - 8), (left - 16, cy[u] - 8), (left - 16, cy[u] + 8), (left, cy[u] + 8)]
+            label_at = (left - 20, cy[u] + 4, 'end')
+        elif back[k]:
+            # Up on the right, in a lane of its own over the layers it spans
+            span = range(rank[v], rank[u] + 1)
+            lane = max(lanes[r] for r in span) + 1
+            for r in span:
+                lanes[r] = lane
+            reach = max(layer_right[r] for r in span)
+            lane_x = reach + LANE_GAP * lane
+            right_edge = max(right_edge, lane_x)
+            ux, uy = _right_port(u, x, cy, width, height, types, 1)
+            vx, vy = _right_port(v, x, cy, width, height, types, -1)
+            points = [(ux, uy), (lane_x, uy), (lane_x, vy), (vx, vy)]
+            label_at = ((ux + lane_x) / 2, uy - 5, 'middle')
+        else:
+            points, label_at = _route(k, chain, x, cy, width, height, rank, layer_bottom, out_ports, in_ports,
+                            types[u] == 'decision')
+        routed.append({'source': names[u], 'target': names[v], 'label': label,
+                       'points': _simplify(points), 'label_at': label_at, 'back': back[k]})
+
+    nodes = []
+    for v, name in enumerate(names):
+        nodes.append({'name': name, 'label': graph.nodes[name].get('label', name), 'type': types[v],
+                      'lines': lines[v], 'x': x[v] - width[v] / 2, 'y': cy[v] - height[v] / 2,
+                      'w': width[v], 'h': height[v]})
+    return {'width': right_edge + MARGIN, 'height': layer_bottom[-1] + MARGIN, 'nodes': nodes, 'edges': routed}
+
+def _right_port(v, x, cy, width, height, types, side):
+    # Right side of a node; on a diamond the lower (side 1) or upper (side -1)
+    # right edge, as the right corner belongs to a branch
+    if types[v] == 'decision':
+        return x[v] + width[v] / 4, cy[v] + side * height[v] / 4
+    return x[v] + width[v] / 2, cy[v]
+
+def _route(k, chain, x, cy, width, height, rank, layer_bottom, out_ports, in_ports, from_decision):
+    u = chain[0]
+    i, count = out_ports[k]
+    bottom = cy[u] + height[u] / 2
+    label_at = None
+    if from_decision:
+        # Branches to the side leave a diamond at its left or right corner,
+        # the others at the bottom corner
+        next_x = x[chain[1]]
+        half = width[u] / 2
+        if next_x < x[u] - half or next_x > x[u] + half:
+            corner = x[u] - half if next_x < x[u] else x[u] + half
+            points = [(corner, cy[u]), (next_x, cy[u])]
+            label_at = ((corner + next_x) / 2, cy[u] - 5, 'middle')  # Above the corner
+        else:
+            points = [(x[u], bottom)]
+    else:
+        points = [(x[u] - width[u] / 2 + width[u] * (i + 1) / (count + 1), bottom)]
+    cur_x = points[-1][0]
+    for a, b in zip(chain, chain[1:]):
+        y_mid = layer_bottom[rank[a]] + LAYER_GAP / 2
+        if b == chain[-1]:
+            j, arriving = in_ports[k]
+            tx = x[b] - width[b] / 2 + width[b] * (j + 1) / (arriving + 1)
+            end_y = cy[b] - height[b] / 2
+        else:
+            tx = x[b]
+            end_y = layer_bottom[rank[b]]
+        points += [(cur_x, y_mid), (tx, y_mid), (tx, end_y)]
+        if label_at is None:
+            # Beside the line where it turns down towards its target
+            label_at = (tx + 4, y_mid + LABEL_FONT_SIZE + 2, 'start')
+        cur_x = tx
+    return points, label_at
+
+def _simplify(points):
+    # Drop repeated points and the middle one of three collinear points
+    result = []
+    for p in points:
+        if result and abs(p[0] - result[-1][0]) < 0.01 and abs(p[1] - result[-1][1]) < 0.01:
+            continue
+        if len(result) >= 2:
+            (ax, ay), (bx, by) = result[-2], result[-1]
+            if (abs(ax - bx) < 0.01 and abs(bx - p[0]) < 0.01) or (abs(ay - by) < 0.01 and abs(by - p[1]) < 0.01):
+                result[-1] = p
+                continue
+        result.append(p)
+    return result
+
+def _n(value):
+    # Coordinates with at most one decimal
+    text = f'{value:.1f}'
+    return text[:-2] if text.endswith('.0') else text
+
+def iter_pap_svg(layout):
+    yield (f'<svg width="{_n(layout["width"])}" height="{_n(layout["height"])}" '
+           f'xmlns="http://www.w3.org/2000/svg" style="font-family: Arial, sans-serif;">')
+    yield ('<defs><marker id="pap-arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="7" '
+           'markerHeight="7" orient="auto"><path d="M0,0 L10,5 L0,10 z" fill="#333"/></marker></defs>')
+    for edge in layout['edges']:
+        points = edge['points']
+        d = 'M' + ' L'.join(f'{_n(px)},{_n(py)}' for px, py in points)
+        part = f'<path d="{d}" fill="none" stroke="#333" stroke-width="1.5" marker-end="url(#pap-arrow)"/>'
+        if edge['label']:
+            lx, ly, anchor = edge['label_at']
+            part += (f'<text x="{_n(lx)}" y="{_n(ly)}" text-anchor="{anchor}" font-size="{LABEL_FONT_SIZE}" '
+                     f'fill="#333">{html.escape(edge["label"])}</text>')
+        yield part
+    for node in layout['nodes']:
+        x, y, w, h = node['x'], node['y'], node['w'], node['h']
+        fill, stroke = NODE_STYLES.get(node['type'], NODE_STYLES['process'])
+        if node['type'] == 'decision':
+            part = (f'<polygon points="{_n(x + w / 2)},{_n(y)} {_n(x + w)},{_n(y + h / 2)} '
+                    f'{_n(x + w / 2)},{_n(y + h)} {_n(x)},{_n(y + h / 2)}" fill="{fill}" stroke="{stroke}"/>')
+        else:
+            rx = h / 2 if node['type'] == 'terminal' else 4
+            part = (f'<rect x="{_n(x)}" y="{_n(y)}" width="{_n(w)}" height="{_n(h)}" rx="{_n(rx)}" '
+                    f'fill="{fill}" stroke="{stroke}"/>')
+        text_y = y + h / 2 - (len(node['lines']) - 1) * LINE_HEIGHT / 2 + FONT_SIZE * 0.35
+        for line in node['lines']:
+            part += (f'<text x="{_n(x + w / 2)}" y="{_n(text_y)}" text-anchor="middle" '
+                     f'font-size="{FONT_SIZE}">{html.escape(line)}</text>')
+            text_y += LINE_HEIGHT
+        yield part
+    yield '</svg>'
+
+def convert_graph_to_pap(graph, start_node=None):
+    check_graph(graph)
+    with metrics.stage('pap_layout'):
+        layout = layout_flowchart(graph, start_node)
+    return "".join(metrics.timed_iter('pap_render', iter_pap_svg(layout), 'pap'))
+
+def _mermaid_graph(content):
+    with metrics.stage('parse'):
+        return parse_mermaid(content)
+
+# Inputs the renderer takes by kind: function returning (graph, start node)
+SOURCE_GRAPHS = {
+    'mermaid': _mermaid_graph,
+    'python': lambda source: (python_to_graph(source), None),
+    'arduino': lambda source: (arduino_to_graph(source), None),
+}
+
+def convert_source_to_pap(source, kind='mermaid'):
+    # Mermaid text, a Python script or an Arduino sketch as flowchart SVG,
+    # cached by the hash of the input
+    key = content_key('pap', PAP_VERSION, kind, source)
+    cached = pap_cache.get(key)
+    if cached is not None:
+        return cached.decode('utf-8')
+    graph, start_node = SOURCE_GRAPHS[kind](source)
+    svg = convert_graph_to_pap(graph, start_node)
+    pap_cache.put(key, svg.encode('utf-8'))
+    return svg
+
+def convert_mermaid_to_pap(mermaid_content):
+    return convert_source_to_pap(mermaid_content, 'mermaid')
@@ -0,0 +1,62 @@
+# Opt-in profiling of single conversions.
+#
+# profile_conversion runs a conversion under cProfile (in a worker process,
+# like every conversion) and returns a report instead of its output: the
+# top functions from pstats, the tree of converter stages with their times
+# and the converter's work counters (loop and merge lookups, blocks rendered).
+
+import cProfile
+import io
+import os
+import pstats
+import time
+
+import metrics
+
+DEFAULT_TOP = 25
+SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+def profile_conversion(convert, args, top=DEFAULT_TOP, sort='cumulative'):
+    profiler = cProfile.Profile()
+    metrics.start_trace()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            output = convert(*args)
+            if isinstance(output, (str, bytes)):
+                size = len(output)
+            else:
+                size = sum(len(chunk) for chunk in output)  # Streamed: render all of it
+        finally:
+            profiler.disable()
+    finally:
+        spans, work = metrics.stop_trace()
+    seconds = time.perf_counter() - start
+
+    stats = pstats.Stats(profiler)
+    stats.sort_stats(sort)
+    functions = []
+    for func in stats.fcn_list[:top]:
+        primitive_calls, calls, tottime, cumtime, _ = stats.stats[func]
+        filename, line, name = func
+        functions.append({
+            'function': name,
+            'file': os.path.basename(filename),
+            'line': line,
+            'calls': calls,
+            'primitive_calls': primitive_calls,
+            'tottime': round(tottime, 6),
+            'cumtime': round(cumtime, 6),
+        })
+
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats(sort).print_stats(top)
+    return {
+        'seconds': round(seconds, 6),
+        'output_bytes': size,
+        'spans': spans,
+        'work': work,
+        'functions': functions,
+        'pstats': text.getvalue(),
+    }
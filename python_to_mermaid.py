@@ -1,4 +1,11 @@
 import ast
+from converter import convert_graph_to_nsd
+from flowgraph import create_graph, to_mermaid
+from limits import check_ast
+import metrics
+
+# Node type in the flowchart graph per shape name used by the converter
+NODE_TYPES = {'box': 'process', 'diamond': 'decision', 'rounded': 'terminal'}
 
 class PythonToMermaidConverter(ast.NodeVisitor):
     def __init__(self):
@@ -98,10 +105,17 @@ def convert_python_to_mermaid(source_code):
     converter = SimplePythonToMermaid()
     return converter.convert(source_code)
 
+def python_to_graph(source_code):
+    # Flowchart of a Python script as an in-memory graph (see flowgraph.py)
+    return SimplePythonToMermaid().build(source_code)
+
+def convert_python_to_nsd(source_code, compact=False):
+    return convert_graph_to_nsd(python_to_graph(source_code), compact)
+
 
 class SimplePythonToMermaid(ast.NodeVisitor):
     def __init__(self):
-        self.lines = ["graph TD"]
+        self.graph = create_graph()
         self.count = 0
         self.last_id = None
         self.merge_stack = []
@@ -112,41 +126,50 @@ class SimplePythonToMermaid(ast.NodeVisitor):
 
     def add_edge(self, from_id, to_id, label=None):
         if not from_id or not to_id: return
-        arrow = "-->"
-        if label:
-            arrow = f"-->|{label}|"
-        self.lines.append(f"{from_id} {arrow} {to_id}")
+        self.graph.add_edge(from_id, to_id, label=label or '')
 
     def add_node(self, label, shape="box"):
         nid = self.new_id()
         label = label.replace('"', "'").strip()
-        if shape == "box":
-            self.lines.append(f'{nid}["{label}"]')
-        elif shape == "diamond":
-            self.lines.append(f'{nid}{{"{label}"}}')
-        elif shape == "rounded":
-            self.lines.append(f'{nid}(["{label}"])')
+        self.graph.add_node(nid, label=label, type=NODE_TYPES[shape])
         return nid
 
     def convert(self, source):
+        return to_mermaid(self.build(source))
+
+    def build(self, source):
         self.source = source
         try:
-            tree = ast.parse(source)
+            with metrics.stage('python_parse'):
+                tree = ast.parse(source)
         except SyntaxError as e:
-            return f"graph TD\nError[\"Syntax Error: {e.msg}\"]"
+            self.graph.add_node("Error", label=f"Syntax Error: {e.msg}".replace('"', "'"), type='process')
+            return self.graph
+        check_ast(tree)
             
-        # Create a start node
-        start_id = self.add_node("Start", "rounded")
-        self.last_id = start_id
-        
-        for node in tree.body:
-            self.visit(node)
+        with metrics.stage('python_build'):
+            # Create a start node
+            start_id = self.add_node("Start", "rounded")
+            self.last_id = start_id
             
-        # Create end node
-        end_id = self.add_node("End", "rounded")
-        self.add_edge(self.last_id, end_id)
+            for node in tree.body:
+                self.visit(node)
+                
+            # Create end node
+            end_id = self.add_node("End", "rounded")
+            self.add_edge(self.last_id, end_id)
         
-        return "\n".join(self.lines)
+        return self.graph
+
+    def build_function(self, source, node):
+        # Flowchart of one function, node being its FunctionDef from ast.parse(source)
+        self.source = source
+        self.last_id = self.add_node(f"Start {node.name}", "rounded")
+        for stmt in node.body:
+            self.visit(stmt)
+        end_id = self.add_node(f"End {node.name}", "rounded")
+        self.add_edge(self.last_id, end_id)
+        return self.graph
 
     def get_source(self, node):
         if hasattr(ast, 'unparse'):
@@ -304,9 +327,5 @@ class SimplePythonToMermaid(ast.NodeVisitor):
                 self.add_edge(fid, to_id, label)
             return
 
-        arrow = "-->"
-        if label:
-            arrow = f"-->|{label}|"
-            
-        self.lines.append(f"{from_id} {arrow} {to_id}")
+        self.graph.add_edge(from_id, to_id, label=label or '')
 
@@ -15,8 +15,29 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const resetBtn = document.getElementById('reset-btn');
 
+    const functionControls = document.getElementById('function-controls');
+    const functionSelect = document.getElementById('function-select');
+
     let currentMermaidCode = '';
     let currentMermaidSvg = '';
+    // Python/Arduino source of the current diagram; its structogram is
+    // converted straight from the source instead of the Mermaid text
+    let currentSource = null;
+    // Function index of the current source ({ id, functions }) and the
+    // Mermaid code of the whole program, shown when no function is selected
+    let currentFunctions = null;
+    let programMermaidCode = '';
+
+    // Earlier responses by URL and file content. Converting the same content
+    // again sends their ETag, and a 304 Not Modified reuses the stored body.
+    const responseCache = new Map();
+
+    // Uploads of at least this size are converted as background jobs: the
+    // browser polls for the result instead of holding the request open
+    const JOB_UPLOAD_BYTES = 256 * 1024;
+    const JOB_POLL_MS = 500;
+    // Flowcharts with more lines are laid out on the server (mermaid.js is slow on them)
+    const SERVER_PAP_LINES = 500;
 
     // Drag & Drop events
     dropZone.addEventListener('dragover', (e) => {
@@ -55,6 +76,8 @@ document.addEventListener('DOMContentLoaded', () => {
         svgPreview.innerHTML = '';
         currentMermaidCode = '';
         currentMermaidSvg = '';
+        currentSource = null;
+        clearFunctions();
     });
 
     downloadMermaidBtn.addEventListener('click', () => {
@@ -79,17 +102,18 @@ document.addEventListener('DOMContentLoaded', () => {
     convertNsdBtn.addEventListener('click', () => {
         if (!currentMermaidCode) return;
 
-        const blob = new Blob([currentMermaidCode], { type: 'text/plain' });
-        const file = new File([blob], "diagram.mmd", { type: "text/plain" });
-
-        const formData = new FormData();
-        formData.append('file', file);
+        let request;
+        if (functionSelect.value) {
+            request = getText(functionUrl(functionSelect.value, 'nsd'));
+        } else if (currentSource) {
+            request = postFile(currentSource.url + '?compact=1', currentSource.file);
+        } else {
+            const blob = new Blob([currentMermaidCode], { type: 'text/plain' });
+            const file = new File([blob], "diagram.mmd", { type: "text/plain" });
+            request = postFile('/convert?compact=1', file);
+        }
 
-        fetch('/convert', {
-            method: 'POST',
-            body: formData
-        })
-            .then(response => response.text())
+        request
             .then(svg => {
                 nsdSection.classList.remove('hidden');
                 svgPreview.innerHTML = svg;
@@ -107,16 +131,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
         if (fileName.endsWith('.py')) {
             // Convert Python to Mermaid
-            const formData = new FormData();
-            formData.append('file', file);
-
-            fetch('/convert_python', {
-                method: 'POST',
-                body: formData
-            })
-                .then(response => response.text())
+            postFile('/convert_python', file)
                 .then(mermaidCode => {
                     renderMermaid(mermaidCode);
+                    currentSource = { url: '/convert_python_nsd', file: file };
+                    loadFunctions(file, mermaidCode);
                 })
                 .catch(error => {
                     console.error('Error:', error);
@@ -124,31 +143,157 @@ document.addEventListener('DOMContentLoaded', () => {
                 });
         } else if (fileName.endsWith('.ino')) {
             // Convert Arduino to Mermaid
-            const formData = new FormData();
-            formData.append('file', file);
-
-            fetch('/convert_arduino', {
-                method: 'POST',
-                body: formData
-            })
-                .then(response => response.text())
+            postFile('/convert_arduino', file)
                 .then(mermaidCode => {
                     renderMermaid(mermaidCode);
+                    currentSource = { url: '/convert_arduino_nsd', file: file };
+                    loadFunctions(file, mermaidCode);
                 })
                 .catch(error => {
                     console.error('Error:', error);
                     alert('An error occurred during Arduino conversion.');
                 });
+        } else if (fileName.endsWith('.zip')) {
+            // Convert a whole folder in a background job; the result is a zip of all files
+            runJob('convert_batch', file)
+                .then(response => response.blob())
+                .then(blob => {
+                    downloadBlob(blob, 'converted.zip');
+                    fileInput.value = '';
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    alert('An error occurred during batch conversion.');
+                });
         } else {
             // Assume Mermaid/Text file
             const reader = new FileReader();
             reader.onload = (e) => {
+                currentSource = null;
+                clearFunctions();
                 renderMermaid(e.target.result);
             };
             reader.readAsText(file);
         }
     }
 
+    functionSelect.addEventListener('change', () => {
+        nsdSection.classList.add('hidden');
+        if (!functionSelect.value) {
+            renderMermaid(programMermaidCode);
+            return;
+        }
+        getText(functionUrl(functionSelect.value, 'mmd'))
+            .then(mermaidCode => renderMermaid(mermaidCode))
+            .catch(error => {
+                console.error('Error:', error);
+                alert('Could not load the flowchart of this function.');
+            });
+    });
+
+    // Lists the functions of a source file; their flowcharts are only
+    // generated on the server when one is selected
+    function loadFunctions(file, mermaidCode) {
+        clearFunctions();
+        programMermaidCode = mermaidCode;
+        const formData = new FormData();
+        formData.append('file', file);
+
+        fetch('/functions', { method: 'POST', body: formData })
+            .then(response => response.ok ? response.json() : null)
+            .then(index => {
+                if (!index || index.functions.length === 0) return;
+                currentFunctions = index;
+                functionSelect.innerHTML = '';
+                functionSelect.appendChild(new Option('Whole program', ''));
+                for (const f of index.functions) {
+                    const stats = `${f.statements} statements, ${f.branches} ifs, ${f.loops} loops`;
+                    functionSelect.appendChild(new Option(`${f.name} (line ${f.line}, ${stats})`, f.name));
+                }
+                functionControls.classList.remove('hidden');
+            })
+            .catch(error => console.error('Error:', error));
+    }
+
+    function clearFunctions() {
+        currentFunctions = null;
+        programMermaidCode = '';
+        functionSelect.innerHTML = '';
+        functionControls.classList.add('hidden');
+    }
+
+    function functionUrl(name, format) {
+        return `/functions/${currentFunctions.id}/${encodeURIComponent(name)}?format=${format}`;
+    }
+
+    async function getText(url) {
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error(await response.text());
+        }
+        return response.text();
+    }
+
+    async function runJob(route, file) {
+        const formData = new FormData();
+        formData.append('file', file);
+
+        const response = await fetch(`/jobs/${route}`, { method: 'POST', body: formData });
+        if (!response.ok) {
+            throw new Error(await response.text());
+        }
+        let status = await response.json();
+        while (status.status === 'queued' || status.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+            const poll = await fetch(`/jobs/${status.id}`);
+            if (!poll.ok) {
+                throw new Error(await poll.text());
+            }
+            status = await poll.json();
+        }
+        if (status.status !== 'done') {
+            throw new Error(status.error || `Conversion ${status.status}`);
+        }
+
+        const result = await fetch(status.result);
+        if (!result.ok) {
+            throw new Error(await result.text());
+        }
+        return result;
+    }
+
+    async function postFile(url, file) {
+        if (file.size >= JOB_UPLOAD_BYTES) {
+            const response = await runJob(url.slice(1), file);
+            return response.text();
+        }
+
+        const key = url + '\n' + await file.text();
+        const cached = responseCache.get(key);
+
+        const formData = new FormData();
+        formData.append('file', file);
+
+        const response = await fetch(url, {
+            method: 'POST',
+            body: formData,
+            headers: cached ? { 'If-None-Match': cached.etag } : {}
+        });
+        if (response.status === 304 && cached) {
+            return cached.body;
+        }
+        if (!response.ok) {
+            throw new Error(await response.text());
+        }
+
+        const body = await response.text();
+        const etag = response.headers.get('ETag');
+        if (etag) {
+            responseCache.set(key, { etag: etag, body: body });
+        }
+        return body;
+    }
+
     async function renderMermaid(code) {
         currentMermaidCode = code;
         dropZone.classList.add('hidden');
@@ -169,7 +314,9 @@ document.addEventListener('DOMContentLoaded', () => {
             // Clean up code?
             // Sometimes code might have errors.
 
-            const { svg } = await mermaid.render(id, code);
+            const svg = code.split('\n').length > SERVER_PAP_LINES
+                ? await postFile('/render_pap', new File([code], 'flowchart.mmd'))
+                : (await mermaid.render(id, code)).svg;
             mermaidPreview.innerHTML = svg;
             currentMermaidSvg = svg;
         } catch (error) {
@@ -179,7 +326,10 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function downloadStringAsFile(content, filename, type) {
-        const blob = new Blob([content], { type: type });
+        downloadBlob(new Blob([content], { type: type }), filename);
+    }
+
+    function downloadBlob(blob, filename) {
         const url = URL.createObjectURL(blob);
         const a = document.createElement('a');
         a.href = url;
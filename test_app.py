@@ -0,0 +1,352 @@
+import io
+import json
+import time
+import zipfile
+import app as app_module
+from app import app, result_cache
+from converter import convert_mermaid_to_nsd
+from job_queue import JobQueue
+import limits
+from pap_renderer import convert_mermaid_to_pap
+from python_to_mermaid import convert_python_to_mermaid, convert_python_to_nsd
+
+MERMAID = """
+graph TD
+A[Start] --> B{x < 10?}
+B -->|Yes| C[x++]
+C --> B
+B -->|No| D[End]
+"""
+
+def post_file(url, content, filename='diagram.mmd', headers=None):
+    client = app.test_client()
+    data = {'file': (io.BytesIO(content.encode('utf-8')), filename)}
+    return client.post(url, data=data, content_type='multipart/form-data', headers=headers)
+
+def test_convert_streams_svg():
+    result_cache.clear()
+    response = post_file('/convert', MERMAID)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    assert response.is_streamed
+    assert response.get_data(as_text=True) == convert_mermaid_to_nsd(MERMAID)
+
+def test_repeat_conversion_is_cached_and_revalidated():
+    result_cache.clear()
+    code = "x = 1\nprint(x)\n"
+    first = post_file('/convert_python', code, 'script.py')
+    etag = first.headers['ETag']
+    hits = result_cache.hits
+
+    second = post_file('/convert_python', code, 'script.py')
+    assert second.get_data() == first.get_data()
+    assert second.headers['ETag'] == etag
+    assert result_cache.hits == hits + 1
+
+    revalidated = post_file('/convert_python', code, 'script.py', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+
+    # Same bytes on another route is a different result
+    other = post_file('/convert_arduino', code, 'script.ino')
+    assert other.headers['ETag'] != etag
+
+    stats = app.test_client().get('/cache/stats').get_json()
+    assert stats['entries'] == 2
+    assert stats['not_modified'] >= 1
+
+def test_batch_endpoint_streams_zip():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('flow.mmd', MERMAID)
+    client = app.test_client()
+    response = client.post('/convert_batch', data={'file': (io.BytesIO(buf.getvalue()), 'folder.zip')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    result = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    assert json.loads(result.read('manifest.json'))['summary']['ok'] == 1
+
+    response = post_file('/convert_batch', 'not a zip', 'folder.zip')
+    assert response.status_code == 400
+
+def test_source_converts_straight_to_nsd():
+    code = "x = 0\nwhile x < 10:\n    x += 1\nprint(x)\n"
+    response = post_file('/convert_python_nsd', code, 'script.py')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    svg = response.get_data(as_text=True)
+    assert svg == convert_python_to_nsd(code)
+    # Same structogram as going through the Mermaid text
+    assert svg == convert_mermaid_to_nsd(convert_python_to_mermaid(code))
+
+def test_sketch_endpoint():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('Demo/Demo.ino', 'void setup() {\n  init();\n}\n')
+        zf.writestr('Demo/run.ino', 'void loop() {\n  step();\n}\nvoid step() {\n  move();\n}\n')
+    client = app.test_client()
+
+    def post(query):
+        data = {'file': (io.BytesIO(archive.getvalue()), 'Demo.zip')}
+        return client.post('/convert_sketch' + query, data=data, content_type='multipart/form-data')
+
+    assert 'step()' in post('').get_data(as_text=True)
+    assert 'move()' in post('?function=step').get_data(as_text=True)
+    assert post('?format=nsd').mimetype == 'image/svg+xml'
+    assert post('?function=missing').status_code == 404
+
+def test_function_index_endpoints():
+    code = "def add(a, b):\n    return a + b\n\ndef main():\n    print(add(1, 2))\n"
+    response = post_file('/functions', code, 'module.py')
+    index = response.get_json()
+    assert [f['name'] for f in index['functions']] == ['add', 'main']
+
+    client = app.test_client()
+    response = client.get(f"/functions/{index['id']}/main")
+    assert 'print(add(1, 2))' in response.get_data(as_text=True)
+    etag = response.headers['ETag']
+    assert client.get(f"/functions/{index['id']}/main", headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f"/functions/{index['id']}/nope").status_code == 404
+
+    # A worker process that has not parsed the upload draws it all the same
+    result_cache.clear()
+    fresh = JobQueue(workers=1)
+    jobs, app_module.jobs = app_module.jobs, fresh
+    try:
+        assert 'return a + b' in client.get(f"/functions/{index['id']}/add").get_data(as_text=True)
+    finally:
+        app_module.jobs = jobs
+        fresh.shutdown()
+
+    assert post_file('/functions', 'def broken(:\n', 'bad.py').status_code == 422
+
+def test_render_pap_endpoint():
+    response = post_file('/render_pap', MERMAID)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    assert response.get_data(as_text=True) == convert_mermaid_to_pap(MERMAID)
+
+    python_svg = post_file('/render_pap', "x = 0\nwhile x < 3:\n    x += 1\n", 'loop.py')
+    assert 'x += 1' in python_svg.get_data(as_text=True)
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('flow.mmd', MERMAID)
+    client = app.test_client()
+    response = client.post('/convert_batch?format=pap', data={'file': (io.BytesIO(buf.getvalue()), 'batch.zip')},
+                           content_type='multipart/form-data')
+    assert set(zipfile.ZipFile(io.BytesIO(response.get_data())).namelist()) == {'flow.pap.svg', 'manifest.json'}
+    assert client.post('/convert_batch?format=png', data={'file': (io.BytesIO(buf.getvalue()), 'batch.zip')},
+                       content_type='multipart/form-data').status_code == 400
+
+def test_compact_svg_and_compression():
+    import gzip
+    result_cache.clear()
+    large = "graph TD\n" + "\n".join(f"n{i}[x = {i}] --> n{i + 1}[x = {i + 1}]" for i in range(300))
+    plain = post_file('/convert', large)
+    assert 'Content-Encoding' not in plain.headers  # Not asked for
+    compressed = post_file('/convert?compact=1', large, headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    svg = gzip.decompress(compressed.get_data()).decode('utf-8')
+    assert svg == convert_mermaid_to_nsd(large, compact=True)
+    assert len(compressed.get_data()) < len(plain.get_data()) * 0.4
+
+    # Served from the cache now; the weak ETag still revalidates
+    etag = compressed.headers['ETag']
+    assert etag.startswith('W/')
+    cached = post_file('/convert?compact=1', large, headers={'Accept-Encoding': 'gzip'})
+    assert gzip.decompress(cached.get_data()).decode('utf-8') == svg
+    revalidated = post_file('/convert?compact=1', large, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert revalidated.status_code == 304
+
+def test_layout_endpoint():
+    from nsd_layout import read_binary_layout
+    result_cache.clear()
+    response = post_file('/layout', MERMAID)
+    assert response.mimetype == 'application/json'
+    layout = response.get_json()
+    assert [b['type'] for b in layout['blocks']] == ['process', 'loop', 'process']
+
+    # The second request is answered from the result cache, without a conversion
+    hits = result_cache.hits
+    assert post_file('/layout', MERMAID).get_json() == layout
+    assert result_cache.hits == hits + 1
+
+    packed = post_file('/layout?format=bin', MERMAID)
+    assert packed.mimetype == 'application/octet-stream'
+    assert [b['label'] for b in read_binary_layout(packed.get_data())['blocks']][:2] == ['Start', 'x < 10?']
+    assert post_file('/layout?format=xml', MERMAID).status_code == 400
+
+def test_full_job_queue_answers_503():
+    result_cache.clear()
+    busy = JobQueue(workers=1, max_depth=0)
+    jobs, app_module.jobs = app_module.jobs, busy
+    try:
+        response = post_file('/convert', MERMAID)
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+    finally:
+        app_module.jobs = jobs
+        busy.shutdown()
+
+def wait_for_job(client, url):
+    deadline = time.monotonic() + 30
+    while True:
+        status = client.get(url).get_json()
+        if status['status'] not in ('queued', 'running'):
+            return status
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+def test_job_api_submit_poll_and_fetch():
+    result_cache.clear()
+    client = app.test_client()
+    code = "for i in range(3):\n    print(i)\n"
+    response = post_file('/jobs/convert_python', code, 'script.py')
+    assert response.status_code == 202
+    status = wait_for_job(client, response.headers['Location'])
+    assert status['status'] == 'done'
+    assert client.get(status['result']).get_data(as_text=True) == convert_python_to_mermaid(code)
+    # The fetched result also serves the synchronous route
+    hits = result_cache.hits
+    post_file('/convert_python', code, 'script.py')
+    assert result_cache.hits == hits + 1
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('flow.mmd', MERMAID)
+    response = post_file('/jobs/convert_batch', '', 'folder.zip')
+    assert response.status_code == 400
+    response = client.post('/jobs/convert_batch', data={'file': (io.BytesIO(buf.getvalue()), 'folder.zip')},
+                           content_type='multipart/form-data')
+    status = wait_for_job(client, response.headers['Location'])
+    result = client.get(status['result'])
+    assert result.mimetype == 'application/zip'
+    assert 'flow.nsd.svg' in zipfile.ZipFile(io.BytesIO(result.get_data())).namelist()
+
+    assert client.get('/jobs/unknown').status_code == 404
+    assert post_file('/jobs/nothing', code).status_code == 404
+
+def test_job_api_cancel_queued_job():
+    busy = JobQueue(workers=1)
+    jobs, app_module.jobs = app_module.jobs, busy
+    try:
+        blocker = busy.submit(time.sleep, 60)
+        response = post_file('/jobs/convert', MERMAID + '%% cancel\n')
+        url = response.headers['Location']
+        client = app.test_client()
+        assert client.get(url).get_json()['status'] == 'queued'
+        assert client.get(url + '/result').status_code == 202
+        assert client.delete(url).get_json()['status'] == 'cancelled'
+        assert client.get(url + '/result').status_code == 409
+        busy.cancel(blocker)
+    finally:
+        app_module.jobs = jobs
+        busy.shutdown()
+
+def test_limits_return_structured_errors():
+    result_cache.clear()
+    app.config['MAX_CONTENT_LENGTH'], saved = 1000, app.config['MAX_CONTENT_LENGTH']
+    try:
+        response = post_file('/convert', MERMAID + '%%' + 'x' * 2000 + '\n')
+        assert response.status_code == 413
+        assert response.get_json()['limit'] == 'max_upload_bytes'
+    finally:
+        app.config['MAX_CONTENT_LENGTH'] = saved
+
+    strict = JobQueue(workers=1, timeout=0.5, initializers=[(limits.configure, ({'max_nodes': 3},))])
+    jobs, app_module.jobs = app_module.jobs, strict
+    try:
+        response = post_file('/convert', MERMAID)
+        assert response.status_code == 422
+        error = response.get_json()
+        assert (error['error'], error['limit'], error['value'], error['maximum']) == ('limit_exceeded', 'max_nodes', 4, 3)
+
+    finally:
+        app_module.jobs = jobs
+        strict.shutdown()
+
+    # Wall-clock limit: the first job of a new queue waits for its worker
+    # process to start, far longer than this
+    slow = JobQueue(workers=1, timeout=0.001)
+    jobs, app_module.jobs = app_module.jobs, slow
+    try:
+        response = post_file('/convert_python', "x = 1\n", 'script.py')
+        assert response.status_code == 422
+        assert response.get_json()['limit'] == 'wall_clock_seconds'
+    finally:
+        app_module.jobs = jobs
+        slow.shutdown()
+
+    strict = JobQueue(workers=1, initializers=[(limits.configure, ({'max_ast_nodes': 10},))])
+    jobs, app_module.jobs = app_module.jobs, strict
+    try:
+        response = post_file('/functions', "def f():\n    return 1 + 2 + 3 + 4\n", 'module.py')
+        assert response.status_code == 422
+        assert response.get_json()['limit'] == 'max_ast_nodes'
+    finally:
+        app_module.jobs = jobs
+        strict.shutdown()
+
+    # The batch workers apply the same limits
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('big.mmd', MERMAID)
+        zf.writestr('small.mmd', 'graph TD\nA[Start] --> B[End]\n')
+    app.config['MAX_NODES'], saved = 3, app.config['MAX_NODES']
+    try:
+        response = app.test_client().post('/convert_batch', data={'file': (io.BytesIO(buf.getvalue()), 'batch.zip')},
+                                          content_type='multipart/form-data')
+        result = zipfile.ZipFile(io.BytesIO(response.get_data()))
+        status = {f['name']: f for f in json.loads(result.read('manifest.json'))['files']}
+        assert status['big.mmd']['status'] == 'error'
+        assert 'LimitExceeded' in status['big.mmd']['error']
+        assert status['small.mmd']['status'] == 'ok'
+    finally:
+        app.config['MAX_NODES'] = saved
+
+def test_metrics_endpoint_includes_worker_stages():
+    result_cache.clear()
+    post_file('/convert', MERMAID + '%% metrics\n').get_data()
+    text = app.test_client().get('/metrics').get_data(as_text=True)
+    assert '# TYPE pap_stage_seconds histogram' in text
+    assert 'pap_stage_seconds_count{stage="layout"}' in text
+    assert 'pap_cache_misses_total{cache="result"}' in text
+    # Caches of the worker processes are counted there, not on /cache/stats
+    post_file('/render_pap', MERMAID + '%% metrics\n').get_data()
+    text = app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'pap_cache_misses_total{cache="pap"}' in text
+    assert 'pap' not in app.test_client().get('/cache/stats').get_json()
+
+def test_profile_query_parameter():
+    assert post_file('/convert?profile=1', MERMAID).status_code == 403
+    app.config['PROFILING_ENABLED'] = True
+    try:
+        response = post_file('/convert?profile=1&top=3', MERMAID)
+        report = response.get_json()
+        assert response.status_code == 200
+        assert len(report['functions']) <= 3
+        assert report['work']['blocks_rendered'] > 0
+        assert report['output_bytes'] == len(convert_mermaid_to_nsd(MERMAID))
+    finally:
+        app.config['PROFILING_ENABLED'] = False
+
+if __name__ == "__main__":
+    test_convert_streams_svg()
+    test_repeat_conversion_is_cached_and_revalidated()
+    test_batch_endpoint_streams_zip()
+    test_source_converts_straight_to_nsd()
+    test_sketch_endpoint()
+    test_function_index_endpoints()
+    test_render_pap_endpoint()
+    test_compact_svg_and_compression()
+    test_layout_endpoint()
+    test_full_job_queue_answers_503()
+    test_job_api_submit_poll_and_fetch()
+    test_job_api_cancel_queued_job()
+    test_limits_return_structured_errors()
+    test_metrics_endpoint_includes_worker_stages()
+    test_profile_query_parameter()
+    print("\nAll tests passed!")
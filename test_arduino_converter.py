@@ -1,4 +1,4 @@
-from arduino_to_mermaid import convert_arduino_to_mermaid
+from arduino_to_mermaid import convert_arduino_to_mermaid, arduino_to_graph, tokenize, match_brackets
 
 def test_blink():
     code = """
@@ -46,7 +46,51 @@ void loop() {
     assert "y < 10?" in mermaid
     assert "For int i=0; i<10; i++" in mermaid
 
+def test_bracket_table():
+    texts, starts, ends = tokenize('if (a(b)) { x = "}"; } else { y(); }')
+    assert texts == ['if', '(', '(', ')', ')', '{', ';', '}', 'else', '{', '(', ')', ';', '}']
+    match = match_brackets(texts)
+    assert match[1] == 4 and match[2] == 3 and match[5] == 7 and match[9] == 13
+
+def test_else_if_and_single_statements():
+    code = """
+void loop() {
+  if (x > 5) {
+    Serial.println("{big}");
+  } else if (x > 2)
+    medium();
+  else
+    small();
+  for (int i = 0; i < 3; i++) blink(i);
+}
+"""
+    graph = arduino_to_graph(code)
+    labels = {graph.nodes[n]['label']: n for n in graph.nodes}
+    assert 'Serial.println(\'{big}\')' in labels
+    # The else-if is a second decision on the No branch of the first one
+    assert graph.get_edge_data(labels['x > 5?'], labels['x > 2?']) == {'label': 'No'}
+    assert graph.get_edge_data(labels['x > 2?'], labels['medium()']) == {'label': 'Yes'}
+    assert graph.get_edge_data(labels['x > 2?'], labels['small()']) == {'label': 'No'}
+    assert graph.get_edge_data(labels['For int i = 0; i < 3; i++'], labels['blink(i)']) == {'label': 'Next'}
+
+def test_branch_whose_only_exit_is_a_loop():
+    # The Yes branch never finishes, so the No branch is the block's only exit
+    code = 'void loop(){ if (x) { while(true){ a(); } } }'
+    assert 'x?' in convert_arduino_to_mermaid(code)
+    graph = arduino_to_graph(code)
+    labels = {graph.nodes[n]['label']: n for n in graph.nodes}
+    assert all(isinstance(n, str) for n in graph.nodes)
+    assert graph.get_edge_data(labels['x?'], labels['Loop Start']) == {'label': 'No'}
+
+    code = 'void setup(){ if (x) { while(true){ a(); } } }\nvoid loop(){ b(); }'
+    graph = arduino_to_graph(code)
+    labels = {graph.nodes[n]['label']: n for n in graph.nodes}
+    assert graph.get_edge_data(labels['x?'], labels['Loop Start']) == {'label': 'No'}
+
 if __name__ == "__main__":
     test_blink()
     test_control_structures()
+    test_bracket_table()
+    test_else_if_and_single_statements()
+    test_branch_whose_only_exit_is_a_loop()
     print("\nAll tests passed!")
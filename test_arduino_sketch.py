@@ -0,0 +1,54 @@
+import io
+import zipfile
+from arduino_sketch import Sketch, preprocess, evaluate, parse_cache, convert_sketch_to_mermaid
+
+FILES = {
+    'Blink.ino': '#include "config.h"\nvoid setup() {\n  pinMode(LED, OUTPUT);\n#ifdef DEBUG\n  Serial.begin(9600);\n#endif\n}\n',
+    'motion.ino': 'void loop() {\n  blink(2);\n#if SPEED > 1\n  fast();\n#else\n  slow();\n#endif\n}\n',
+    'config.h': '#define LED 13\n#define SPEED 2\n',
+    'helpers.cpp': 'int blink(int times) {\n  for (int i = 0; i < times; i++) {\n    toggle();\n  }\n  return times;\n}\n',
+}
+
+def labels(graph):
+    return [graph.nodes[n]['label'] for n in graph.nodes]
+
+def test_preprocessor():
+    text, defines = preprocess('#define A 2\n#if A > 1 && !defined(B)\nyes();\n#elif A\nno();\n#else\nno();\n#endif\n')
+    assert 'yes();' in text and 'no();' not in text
+    assert defines == {'A': '2'}
+    assert evaluate('defined X || Y == 3', {'Y': '3'})
+    assert not evaluate('(1 + 2) * 2 != 6', {})
+
+def test_setup_and_loop_from_different_tabs():
+    sketch = Sketch(FILES, main='Blink.ino')
+    assert sketch.functions() == {'setup': 'Blink.ino', 'loop': 'motion.ino', 'blink': 'helpers.cpp'}
+    program = labels(sketch.graph())
+    assert program == ['Start', 'pinMode(LED, OUTPUT)', 'Loop Start', 'blink(2)', 'fast()']
+    assert labels(sketch.graph('blink')) == ['Start blink', 'For int i = 0; i < times; i++', 'toggle()',
+                                             'return times', 'End blink']
+
+def test_editing_one_tab_parses_only_that_tab():
+    parse_cache.clear()
+    sketch = Sketch(FILES, main='Blink.ino')
+    convert_sketch_to_mermaid(sketch)
+    misses = parse_cache.stats()['misses']
+
+    sketch.update('motion.ino', FILES['motion.ino'].replace('blink(2)', 'blink(3)'))
+    assert 'blink(3)' in convert_sketch_to_mermaid(sketch)
+    assert parse_cache.stats()['misses'] == misses + 1
+
+def test_zipped_sketch_folder():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for name, text in FILES.items():
+            zf.writestr('Blink/' + name, text)
+    sketch = Sketch.from_zip(buffer.getvalue())
+    assert sketch.main == 'Blink.ino'
+    assert sketch.order()[0] == 'Blink.ino'
+    assert 'fast()' in convert_sketch_to_mermaid(sketch)
+
+if __name__ == "__main__":
+    test_preprocessor()
+    test_setup_and_loop_from_different_tabs()
+    test_editing_one_tab_parses_only_that_tab()
+    test_zipped_sketch_folder()
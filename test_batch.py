@@ -0,0 +1,52 @@
+import io
+import json
+import zipfile
+from batch import iter_batch_zip, iter_converted, convert_file
+
+def make_zip(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+def test_batch_converts_every_file_and_reports_failures():
+    archive = make_zip({
+        'week1/hello.py': 'x = 1\nif x > 0:\n    print(x)\n',
+        'week1/blink.ino': 'void setup() {\n  pinMode(13, OUTPUT);\n}\nvoid loop() {\n  delay(1000);\n}\n',
+        'week2/flow.mmd': 'graph TD\nA[Start] --> B[End]\n',
+        'week2/broken.py': b'\xff\xfe not utf-8',
+        'notes.txt': 'ignored',
+    })
+    result = zipfile.ZipFile(io.BytesIO(b''.join(iter_batch_zip(archive, max_workers=2))))
+
+    names = set(result.namelist())
+    assert {'week1/hello.mmd', 'week1/hello.nsd.svg', 'week1/blink.mmd', 'week1/blink.nsd.svg',
+            'week2/flow.nsd.svg', 'manifest.json'} == names
+    assert result.read('week1/hello.nsd.svg').startswith(b'<svg')
+
+    manifest = json.loads(result.read('manifest.json'))
+    status = {f['name']: f['status'] for f in manifest['files']}
+    assert status['week2/broken.py'] == 'error'
+    assert status['notes.txt'] == 'skipped'
+    assert manifest['summary'] == {'ok': 3, 'error': 1, 'skipped': 1}
+
+def test_convert_file_never_raises():
+    outputs, status = convert_file('x.mmd', b'\xff')
+    assert outputs == {}
+    assert status['status'] == 'error'
+    assert 'UnicodeDecodeError' in status['error']
+
+def test_files_over_their_timeout_are_stopped():
+    # The first file of a worker waits for its process to start, far longer than this
+    inputs = [('a.mmd', b'graph TD\nA[Start] --> B[End]\n'), ('b.txt', b'')]
+    statuses = [status for _, status in iter_converted(inputs, max_workers=1, timeout=0.001)]
+    assert {s['name']: s['status'] for s in statuses} == {'a.mmd': 'error', 'b.txt': 'skipped'}
+    assert statuses[-1]['error'].startswith('JobTimeout')
+    assert [s['status'] for _, s in iter_converted(inputs[:1], max_workers=1, timeout=30)] == ['ok']
+
+if __name__ == "__main__":
+    test_batch_converts_every_file_and_reports_failures()
+    test_convert_file_never_raises()
+    test_files_over_their_timeout_are_stopped()
+    print("\nAll tests passed!")
@@ -0,0 +1,31 @@
+from cache import LRUCache, content_key
+
+def test_evicts_least_recently_used_by_size():
+    cache = LRUCache(max_bytes=10)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    assert cache.get('a') == b'1234'  # 'b' is now least recently used
+    cache.put('c', b'1234')
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.total_bytes == 8
+    assert cache.stats()['evictions'] == 1
+
+def test_counts_hits_and_misses_and_rejects_oversized_values():
+    cache = LRUCache(max_bytes=4)
+    assert cache.get('x') is None
+    assert not cache.put('x', b'12345')
+    cache.put('y', b'12')
+    cache.get('y')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries'], stats['bytes']) == (1, 1, 1, 2)
+
+def test_content_key_separates_parts():
+    assert content_key('ab', 'c') != content_key('a', 'bc')
+    assert content_key('convert', b'x') == content_key(b'convert', 'x')
+
+if __name__ == "__main__":
+    test_evicts_least_recently_used_by_size()
+    test_counts_hits_and_misses_and_rejects_oversized_values()
+    test_content_key_separates_parts()
+    print("\nAll tests passed!")
@@ -0,0 +1,35 @@
+from ProgrammAblaufplanGenerator import main
+
+def test_cli_mirrors_input_tree(tmp_path):
+    source = tmp_path / 'src'
+    (source / 'week1').mkdir(parents=True)
+    (source / 'week1' / 'loop.py').write_text('x = 0\nwhile x < 3:\n    x += 1\n')
+    (source / 'flow.mmd').write_text('graph TD\nA[Start] --> B[End]\n')
+    (source / 'notes.txt').write_text('not converted')
+    output = tmp_path / 'out'
+
+    assert main([str(source), '-o', str(output), '--jobs', '2', '--quiet']) == 0
+    written = sorted(p.relative_to(output).as_posix() for p in output.rglob('*') if p.is_file())
+    assert written == ['flow.nsd.svg', 'week1/loop.mmd', 'week1/loop.nsd.svg']
+
+    assert main([str(source), '-o', str(tmp_path / 'mmd'), '--format', 'mmd', '-q']) == 0
+    assert [p.name for p in (tmp_path / 'mmd').rglob('*') if p.is_file()] == ['loop.mmd']
+
+    assert main([str(source), '-o', str(tmp_path / 'pap'), '--format', 'pap', '--format', 'nsd', '-q']) == 0
+    assert sorted(p.name for p in (tmp_path / 'pap').rglob('*.pap.svg')) == ['flow.pap.svg', 'loop.pap.svg']
+
+def test_cli_reports_failures(tmp_path):
+    (tmp_path / 'bad.ino').write_bytes(b'\xff')
+    assert main([str(tmp_path / 'bad.ino'), '-o', str(tmp_path / 'out'), '-q']) == 1
+
+def test_cli_rejects_colliding_outputs(tmp_path):
+    for folder in ('a', 'b'):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / 'x.py').write_text('x = 1\n')
+    output = tmp_path / 'out'
+    assert main([str(tmp_path / 'a'), str(tmp_path / 'b'), '-o', str(output), '-q']) == 2
+    assert main([str(tmp_path / 'a' / 'x.py'), str(tmp_path / 'b' / 'x.py'), '-o', str(output), '-q']) == 2
+    (tmp_path / 'a' / 'x.ino').write_text('void setup() {\n}\n')
+    assert main([str(tmp_path / 'a'), '-o', str(output), '-q']) == 2
+    assert not output.exists()
+    assert main([str(tmp_path / 'b'), '-o', str(output), '-q']) == 0
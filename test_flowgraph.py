@@ -0,0 +1,54 @@
+from flowgraph import FlowGraph, to_mermaid
+from converter import parse_mermaid
+
+def test_edges_keep_insertion_order():
+    G = FlowGraph()
+    G.add_node('A', label='Start', type='terminal')
+    G.add_edge('A', 'C', label='Yes')
+    G.add_edge('A', 'B', label='No')
+    G.add_edge('B', 'C')
+    assert list(G.nodes) == ['A', 'C', 'B']
+    assert G.successors('A') == ['C', 'B']
+    assert G.predecessors('C') == ['A', 'B']
+    assert G.in_degree('A') == 0
+    assert G.in_degree('C') == 2
+    assert G.nodes['A'] == {'label': 'Start', 'type': 'terminal'}
+    assert G.nodes['B'] == {}
+
+def test_duplicate_edge_updates_label():
+    G = FlowGraph()
+    G.add_edge('A', 'B', label='x')
+    G.add_edge('A', 'B', label='y')
+    assert G.number_of_edges() == 1
+    assert G.get_edge_data('A', 'B') == {'label': 'y'}
+    assert G.get_edge_data('B', 'A') is None
+    assert G.has_path('A', 'B')
+    assert not G.has_path('B', 'A')
+
+def test_mermaid_serializer_round_trips():
+    G = FlowGraph()
+    G.add_node('S', label='Start', type='terminal')
+    G.add_node('D', label='say "hi"?', type='decision')
+    G.add_node('P', label='print(a[0])', type='process')
+    G.add_node('E', label='End', type='terminal')
+    G.add_edge('S', 'D')
+    G.add_edge('D', 'P', label='Yes')
+    G.add_edge('D', 'E', label='No')
+    G.add_edge('P', 'E')
+
+    parsed, start = parse_mermaid(to_mermaid(G))
+    assert start == 'S'
+    assert [(n, parsed.nodes[n]) for n in parsed.nodes] == [
+        ('S', {'label': 'Start', 'type': 'terminal'}),
+        ('D', {'label': "say 'hi'?", 'type': 'decision'}),
+        ('P', {'label': 'print(a[0])', 'type': 'process'}),
+        ('E', {'label': 'End', 'type': 'terminal'}),
+    ]
+    assert parsed.edges() == G.edges()
+    assert parsed.get_edge_data('D', 'P') == {'label': 'Yes'}
+
+if __name__ == "__main__":
+    test_edges_keep_insertion_order()
+    test_duplicate_edge_updates_label()
+    test_mermaid_serializer_round_trips()
+    print("\nAll tests passed!")
@@ -0,0 +1,73 @@
+import function_index
+from function_index import load_module, function_diagram
+
+PYTHON = '''
+def greet(name):
+    if name:
+        print("Hello", name)
+    return name
+
+class Robot:
+    def drive(self, steps):
+        for i in range(steps):
+            self.step()
+        while self.busy():
+            pass
+'''
+
+SKETCH = '''
+void setup() {
+  pinMode(13, OUTPUT);
+}
+
+/* helper
+   functions */
+int blink(int times) {
+  for (int i = 0; i < times; i++) {
+    if (i % 2) {
+      toggle();
+    }
+  }
+  return times;
+}
+'''
+
+def test_python_index_lists_functions_and_methods():
+    module_id, module = load_module('python', PYTHON.encode('utf-8'))
+    index = {f['name']: f for f in module.index()}
+    assert list(index) == ['greet', 'Robot.drive']
+    assert index['greet'] == {'name': 'greet', 'line': 2, 'lines': 4, 'statements': 3, 'branches': 1, 'loops': 0}
+    assert index['Robot.drive']['loops'] == 2
+
+    # Loading the same source again reuses the parsed module
+    assert load_module('python', PYTHON.encode('utf-8'))[1] is module
+
+def test_function_diagrams_are_generated_on_demand_and_cached():
+    function_index.diagrams.clear()
+    module_id, _ = load_module('python', PYTHON.encode('utf-8'))
+    assert len(function_index.diagrams) == 0
+
+    mermaid = function_diagram(module_id, 'Robot.drive')
+    assert 'Start drive' in mermaid and 'self.step()' in mermaid and 'Hello' not in mermaid
+    assert len(function_index.diagrams) == 1
+    assert function_diagram(module_id, 'Robot.drive') == mermaid
+    assert function_diagram(module_id, 'greet', 'nsd').startswith('<svg')
+
+    try:
+        function_diagram(module_id, 'missing')
+        assert False, 'expected KeyError'
+    except KeyError:
+        pass
+
+def test_arduino_index():
+    module_id, module = load_module('arduino', SKETCH.encode('utf-8'))
+    index = {f['name']: f for f in module.index()}
+    assert index['setup']['line'] == 2
+    assert index['blink'] == {'name': 'blink', 'file': 'sketch.ino', 'line': 8, 'lines': 8,
+                              'statements': 4, 'branches': 1, 'loops': 1}
+    assert 'toggle()' in function_diagram(module_id, 'blink')
+
+if __name__ == "__main__":
+    test_python_index_lists_functions_and_methods()
+    test_function_diagrams_are_generated_on_demand_and_cached()
+    test_arduino_index()
@@ -0,0 +1,117 @@
+import itertools
+import time
+from converter import convert_mermaid_to_nsd, iter_nsd_svg
+from job_queue import JobQueue, JobFailed, JobTimeout, QueueFull
+
+MERMAID = """
+graph TD
+A[Start] --> B{x < 10?}
+B -->|Yes| C[x++]
+C --> B
+B -->|No| D[End]
+"""
+
+def wait_for(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_runs_jobs_and_streams_iterators():
+    jobs = JobQueue(workers=1)
+    try:
+        assert jobs.submit(pow, 2, 10).result(30) == 1024
+        job = jobs.submit(iter_nsd_svg, MERMAID, 64)
+        assert job.result(30) == convert_mermaid_to_nsd(MERMAID)
+        assert job.streamed and len(job._streamed) > 1
+
+        failed = jobs.submit(int, 'x')
+        try:
+            failed.result(30)
+            assert False, "expected JobFailed"
+        except JobFailed as e:
+            assert e.type_name == 'ValueError'
+    finally:
+        jobs.shutdown()
+
+def test_timeout_kills_worker_and_pool_recovers():
+    jobs = JobQueue(workers=1, timeout=0.5)
+    try:
+        slow = jobs.submit(time.sleep, 60)
+        try:
+            slow.result(30)
+            assert False, "expected JobTimeout"
+        except JobTimeout:
+            pass
+        assert jobs.submit(pow, 3, 2).result(30) == 9
+        wait_for(lambda: jobs.stats()['timed_out'] == 1)
+    finally:
+        jobs.shutdown()
+
+def test_streaming_job_is_still_timed_out():
+    jobs = JobQueue(workers=1)
+    try:
+        assert jobs.submit(pow, 2, 2).result(30) == 4  # Worker started
+        endless = jobs.submit(itertools.repeat, 'x', timeout=1)
+        try:
+            endless.result(30)
+            assert False, "expected JobTimeout"
+        except JobTimeout:
+            pass
+        assert jobs.submit(pow, 3, 2).result(30) == 9
+    finally:
+        jobs.shutdown()
+
+def test_unsendable_job_fails_and_dispatcher_survives():
+    jobs = JobQueue(workers=1)
+    try:
+        try:
+            jobs.submit(pow, lambda: 2, 2).result(30)  # A lambda cannot be pickled
+            assert False, "expected JobFailed"
+        except JobFailed:
+            pass
+        assert jobs.submit(pow, 3, 2).result(30) == 9
+        assert jobs.stats()['failed'] == 1
+    finally:
+        jobs.shutdown()
+
+def test_full_queue_rejects_and_cancel():
+    jobs = JobQueue(workers=1, max_depth=1)
+    try:
+        running = jobs.submit(time.sleep, 60)
+        wait_for(lambda: running.state == 'running')
+        queued = jobs.submit(pow, 2, 2)
+        try:
+            jobs.submit(pow, 2, 3)
+            assert False, "expected QueueFull"
+        except QueueFull as e:
+            assert e.retry_after >= 1
+        running.cancel()
+        assert running.wait(30) and running.state == 'cancelled'
+        assert queued.result(30) == 4
+        assert jobs.stats()['rejected'] == 1
+    finally:
+        jobs.shutdown()
+
+def test_small_jobs_skip_ahead_of_large_ones():
+    jobs = JobQueue(workers=2, large_job_bytes=100)
+    try:
+        # Only one of the two workers takes large jobs
+        first = jobs.submit(time.sleep, 60, size=1000)
+        second = jobs.submit(time.sleep, 60, size=1000)
+        wait_for(lambda: first.state == 'running')
+        assert jobs.submit(pow, 2, 5).result(30) == 32
+        assert second.state == 'queued'
+        first.cancel()
+        second.cancel()
+    finally:
+        jobs.shutdown()
+
+if __name__ == "__main__":
+    test_runs_jobs_and_streams_iterators()
+    test_timeout_kills_worker_and_pool_recovers()
+    test_streaming_job_is_still_timed_out()
+    test_unsendable_job_fails_and_dispatcher_survives()
+    test_full_queue_rejects_and_cancel()
+    test_small_jobs_skip_ahead_of_large_ones()
+    print("\nAll tests passed!")
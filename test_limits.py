@@ -0,0 +1,41 @@
+import limits
+from limits import LimitExceeded
+from converter import convert_mermaid_to_nsd
+from python_to_mermaid import convert_python_to_mermaid
+
+CHAIN = "graph TD\n" + "\n".join(f"n{i}[Step {i}] --> n{i + 1}[Step {i + 1}]" for i in range(10))
+
+def with_limits(values, fn, *args):
+    saved = dict(limits.limits)
+    limits.configure(values)
+    try:
+        return fn(*args)
+    finally:
+        limits.configure(saved)
+
+def test_graph_limits_stop_before_layout():
+    try:
+        with_limits({'max_nodes': 5}, convert_mermaid_to_nsd, CHAIN)
+        assert False, "expected LimitExceeded"
+    except LimitExceeded as e:
+        assert e.details == {'limit': 'max_nodes', 'value': 11, 'maximum': 5}
+    try:
+        with_limits({'max_edges': 5}, convert_mermaid_to_nsd, CHAIN)
+        assert False, "expected LimitExceeded"
+    except LimitExceeded as e:
+        assert e.details['limit'] == 'max_edges'
+    assert with_limits({'max_nodes': None, 'max_edges': None}, convert_mermaid_to_nsd, CHAIN).startswith('<svg')
+
+def test_ast_limit():
+    code = "x = 1\n" * 50
+    try:
+        with_limits({'max_ast_nodes': 100}, convert_python_to_mermaid, code)
+        assert False, "expected LimitExceeded"
+    except LimitExceeded as e:
+        assert e.details['limit'] == 'max_ast_nodes'
+    assert 'x = 1' in with_limits({'max_ast_nodes': 1000}, convert_python_to_mermaid, code)
+
+if __name__ == "__main__":
+    test_graph_limits_stop_before_layout()
+    test_ast_limit()
+    print("\nAll tests passed!")
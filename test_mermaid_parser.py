@@ -0,0 +1,44 @@
+from converter import parse_mermaid
+
+def test_chained_edges_and_fan_out():
+    graph, start = parse_mermaid("""
+flowchart TD; A([Start]) --> B["x = 1"] --> C{x > 0?}
+C -->|Yes| D & E --> F
+C -- No --> F
+""")
+    assert start == 'A'
+    assert graph.successors('A') == ['B']
+    assert graph.successors('B') == ['C']
+    assert graph.successors('C') == ['D', 'E', 'F']
+    assert graph.get_edge_data('C', 'D')['label'] == 'Yes'
+    assert graph.get_edge_data('C', 'F')['label'] == 'No'
+    assert graph.successors('D') == ['F']
+    assert graph.successors('E') == ['F']
+    assert graph.nodes['C'] == {'label': 'x > 0?', 'type': 'decision'}
+
+def test_styling_statements_do_not_create_nodes():
+    graph, _ = parse_mermaid("""
+graph TD
+subgraph one [Title]
+  A["for (int i=0; i<10; i++)"]:::hot --> B
+end
+classDef hot fill:#f96
+class B hot
+style A stroke:#333
+linkStyle 0 stroke:#f00
+""")
+    assert list(graph.nodes) == ['A', 'B']
+    assert graph.nodes['A']['label'] == 'for (int i=0; i<10; i++)'
+    assert graph.graph['class_defs'] == {'hot': 'fill:#f96'}
+    assert graph.graph['node_classes'] == {'A': ['hot'], 'B': ['hot']}
+    assert graph.graph['styles'] == {'A': 'stroke:#333'}
+
+def test_later_definition_sets_shape():
+    graph, _ = parse_mermaid("A --> B\nB{cond?}")
+    assert graph.nodes['B'] == {'label': 'cond?', 'type': 'decision'}
+
+if __name__ == "__main__":
+    test_chained_edges_and_fan_out()
+    test_styling_statements_do_not_create_nodes()
+    test_later_definition_sets_shape()
+    print("\nAll tests passed!")
@@ -0,0 +1,64 @@
+import metrics
+from cache import LRUCache
+from converter import convert_mermaid_to_nsd
+from python_to_mermaid import convert_python_to_mermaid
+
+MERMAID = """
+graph TD
+A[Start] --> B{x < 10?}
+B -->|Yes| C[x++]
+C --> B
+B -->|No| D[End]
+"""
+
+def test_disabled_metrics_record_nothing():
+    metrics.configure(False)
+    metrics.reset()
+    convert_mermaid_to_nsd(MERMAID)
+    assert metrics.drain() is None
+    assert 'pap_stage_seconds_count' not in metrics.render()
+
+def test_stages_sizes_and_caches():
+    metrics.configure(True)
+    metrics.reset()
+    cache = LRUCache(100)
+    metrics.register_cache('test', cache)
+    try:
+        svg = convert_mermaid_to_nsd(MERMAID)
+        convert_python_to_mermaid("x = 1\n")
+        cache.get('missing')
+        text = metrics.render()
+        for stage in ('parse', 'structure', 'layout', 'render', 'python_parse', 'python_build', 'mermaid_text'):
+            assert f'pap_stage_seconds_count{{stage="{stage}"}} 1' in text
+        assert 'pap_graph_nodes_bucket{le="10"} 1' in text
+        assert f'pap_output_bytes_sum{{format="svg"}} {len(svg)}' in text
+        assert 'pap_cache_misses_total{cache="test"} 1' in text
+
+        # Observations of worker processes: drained there, merged here
+        data = metrics.drain()
+        assert metrics.drain() is None
+        assert 'pap_graph_edges_count' not in metrics.render()
+        metrics.merge(data)
+        metrics.merge(data)
+        assert 'pap_graph_edges_count 2' in metrics.render()
+    finally:
+        metrics.configure(False)
+        metrics.reset()
+
+def test_nested_stages_of_the_same_name():
+    metrics.start_trace()
+    with metrics.stage('layout'):
+        with metrics.stage('layout'):
+            pass
+        with metrics.stage('render'):
+            pass
+    root, _ = metrics.stop_trace()
+    outer, = root['children']
+    assert [span['name'] for span in outer['children']] == ['layout', 'render']
+    assert outer['children'][0]['children'] == []
+
+if __name__ == "__main__":
+    test_disabled_metrics_record_nothing()
+    test_stages_sizes_and_caches()
+    test_nested_stages_of_the_same_name()
+    print("\nAll tests passed!")
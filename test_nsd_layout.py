@@ -0,0 +1,58 @@
+import json
+from converter import convert_mermaid_to_nsd
+from nsd_layout import convert_source_to_layout, read_binary_layout
+
+DIAGRAM = """
+graph TD
+A[Start] --> B{x < 10?}
+B -->|Yes| C[x++]
+C --> B
+B -->|No| D{y > 0?}
+D -->|Yes| E[y -= 1]
+D -->|No| F[y = 0]
+E --> G[End]
+F --> G
+"""
+
+def flatten(blocks):
+    for block in blocks:
+        yield block
+        for seq in block.get('children', []):
+            yield from flatten(seq)
+
+def test_json_layout_matches_svg():
+    layout = json.loads(convert_source_to_layout(DIAGRAM))
+    svg = convert_mermaid_to_nsd(DIAGRAM)
+    assert svg.startswith(f'<svg width="{layout["width"]}" height="{layout["height"]}"')
+
+    blocks = layout['blocks']
+    assert [b['type'] for b in blocks] == ['process', 'loop', 'decision', 'process']
+    loop, decision = blocks[1], blocks[2]
+    assert loop['children'][0][0]['label'] == 'x++'
+    assert [seq[0]['label'] for seq in decision['children']] == ['y -= 1', 'y = 0']
+    yes, no = decision['children'][0][0], decision['children'][1][0]
+    assert yes['y'] == decision['y'] + decision['header_height']
+    assert no['x'] == yes['x'] + yes['width']
+
+    for block in flatten(blocks):
+        if block['type'] == 'process':
+            assert f'<rect x="{block["x"]}" y="{block["y"]}" width="{block["width"]}" height="{block["height"]}"' in svg
+
+def test_binary_layout_round_trip():
+    layout = json.loads(convert_source_to_layout(DIAGRAM, 'mermaid', 'json'))
+    packed = read_binary_layout(convert_source_to_layout(DIAGRAM, 'mermaid', 'bin'))
+    assert (packed['width'], packed['height']) == (layout['width'], layout['height'])
+    nested = list(flatten(layout['blocks']))
+    assert sorted(b['label'] for b in packed['blocks']) == sorted(b['label'] for b in nested)
+    by_label = {b['label']: b for b in packed['blocks']}
+    for block in nested:
+        flat = by_label[block['label']]
+        assert (flat['x'], flat['y'], flat['width'], flat['height']) == \
+            (block['x'], block['y'], block['width'], block['height'])
+    assert packed['blocks'][by_label['y = 0']['parent']]['label'] == 'y > 0?'
+    assert by_label['y = 0']['branch'] == 1
+
+if __name__ == "__main__":
+    test_json_layout_matches_svg()
+    test_binary_layout_round_trip()
+    print("\nAll tests passed!")
@@ -1,4 +1,8 @@
-from converter import convert_mermaid_to_nsd
+import io
+import pytest
+from converter import (convert_mermaid_to_nsd, write_nsd_svg, iter_nsd_svg, parse_mermaid, find_loops,
+                       find_post_dominators, build_structure, calculate_min_widths, calculate_heights,
+                       render_blocks, layout_memo)
 
 def test_loop_rendering():
     mermaid_code = """
@@ -9,29 +13,223 @@ C --> B
 B -->|No| D[End]
 """
     svg = convert_mermaid_to_nsd(mermaid_code)
-    print("--- Loop SVG ---")
-    print(svg) 
-    
-    # Check for loop specific elements
-    # We expect a path for the L-shape
-    if '<path d="M' in svg and 'fill="#e0e0e0"' in svg:
-        print("SUCCESS: Found loop L-shape path")
-    else:
-        print("FAILURE: Loop L-shape path not found")
-        
-    # Check for loop label
-        
-    # Check for loop label
-    if 'x &lt; 10?' in svg:
-        print("SUCCESS: Found loop condition")
-    else:
-        print("FAILURE: Loop condition not found")
-
-    # Check that body is rendered
-    if 'x++' in svg:
-        print("SUCCESS: Found loop body")
-    else:
-        print("FAILURE: Loop body not found")
+
+    # The loop is drawn as an L-shaped path
+    assert '<path d="M' in svg and 'fill="#e0e0e0"' in svg
+    # with its condition
+    assert 'x &lt; 10?' in svg
+    # and its body
+    assert 'x++' in svg
+
+def test_loop_detection_uses_back_edges():
+    mermaid_code = """
+graph TD
+A[Start] --> B{x < 10?}
+B -->|Yes| C{y?}
+C -->|Yes| D[y++]
+C -->|No| E[z++]
+D --> F[x++]
+E --> F
+F --> B
+B -->|No| G[End]
+"""
+    graph, start = parse_mermaid(mermaid_code)
+    loops = find_loops(graph, start)
+    assert set(loops) == {'B'}
+    assert loops['B'] == {'B', 'C', 'D', 'E', 'F'}
+
+    blocks = build_structure(graph, start, None, set(), loops)
+    assert [b.type for b in blocks] == ['process', 'loop', 'process']
+    body = blocks[1].body
+    assert [b.type for b in body] == ['decision', 'process']
+    # The nested if inside the loop must not be mistaken for another loop
+    assert body[0].yes[0].type == 'process'
+
+def test_long_branches_merge_once():
+    # Both branches are longer than any fixed search budget; the tail must still
+    # be found as the merge point and rendered exactly once.
+    lines = ["graph TD", "S[Start] --> D{cond?}", "D -->|Yes| y0", "D -->|No| n0"]
+    for i in range(150):
+        lines.append(f"y{i}[yes {i}] --> y{i + 1}")
+        lines.append(f"n{i}[no {i}] --> n{i + 1}")
+    lines.append("y150 --> M[Tail]")
+    lines.append("n150 --> M")
+    lines.append("M --> E[End]")
+    graph, start = parse_mermaid("\n".join(lines))
+    loops = find_loops(graph, start)
+    assert find_post_dominators(graph, start, loops)['D'] == 'M'
+
+    blocks = build_structure(graph, start, None, set(), loops)
+    assert [b.label for b in blocks] == ['Start', 'cond?', 'Tail', 'End']
+    assert len(blocks[1].yes) == 151
+    assert len(blocks[1].no) == 151
+
+def test_deep_nesting_is_stack_safe():
+    # 5,000 nesting levels is far beyond the interpreter's recursion limit
+    depth = 5000
+
+    lines = ["graph TD", f"D{depth}[inner] --> M{depth - 1}", "S([Start]) --> D0"]
+    for i in range(depth):
+        lines.append(f"D{i}{{c{i}?}} -->|Yes| D{i + 1}")
+        lines.append(f"D{i} -->|No| M{i}")
+        lines.append(f"M{i}[m{i}] --> " + (f"M{i - 1}" if i else "E([End])"))
+    svg = convert_mermaid_to_nsd("\n".join(lines))
+    assert svg.count('>True</text>') == depth
+    assert '>inner</text>' in svg
+
+    lines = ["graph TD", f"H{depth}[inner] --> H{depth - 1}", "S([Start]) --> H0"]
+    for i in range(depth):
+        lines.append(f"H{i}{{c{i}?}} -->|Yes| H{i + 1}")
+        lines.append(f"H{i} -->|No| " + (f"H{i - 1}" if i else "E([End])"))
+    svg = convert_mermaid_to_nsd("\n".join(lines))
+    assert svg.count('<path d="M') == depth
+    assert '>inner</text>' in svg
+
+def test_streaming_writer_matches_string_api():
+    mermaid_code = open('test.mmd', encoding='utf-8').read()
+    sink = io.StringIO()
+    write_nsd_svg(mermaid_code, sink)
+    assert sink.getvalue() == convert_mermaid_to_nsd(mermaid_code)
+
+    chunks = list(iter_nsd_svg(mermaid_code, chunk_size=256))
+    assert len(chunks) > 1
+    assert "".join(chunks) == sink.getvalue()
+
+def test_networkx_backend_parity():
+    pytest.importorskip('networkx')
+    mermaid_code = open('test.mmd', encoding='utf-8').read()
+
+    results = []
+    for backend in ('flowgraph', 'networkx'):
+        graph, start = parse_mermaid(mermaid_code, backend=backend)
+        loops = find_loops(graph, start)
+        post_doms = find_post_dominators(graph, start, loops)
+        blocks = build_structure(graph, start, None, set(), loops, post_doms)
+        width = max(800, calculate_min_widths(blocks))
+        height = calculate_heights(blocks, width)
+        results.append((list(graph.nodes), sorted(graph.edges()), start,
+                        {h: set(body) for h, body in loops.items()}, post_doms,
+                        height, render_blocks(blocks, 0, 0, width)))
+    assert results[0] == results[1]
+
+def _branchy_diagram(labels):
+    # One if/else per label, each with enough blocks to be memoized as a unit
+    lines = ["graph TD", "S([Start]) --> D0"]
+    for i, label in enumerate(labels):
+        lines.append(f"D{i}{{{label}?}} -->|Yes| Y{i}a[{label} yes]")
+        lines.append(f"Y{i}a --> Y{i}b[{label} yes 2] --> M{i}")
+        lines.append(f"D{i} -->|No| N{i}a[{label} no] --> M{i}")
+        lines.append(f"M{i}[{label} done] --> " + (f"D{i + 1}" if i + 1 < len(labels) else "E([End])"))
+    return "\n".join(lines)
+
+def test_subtree_memo_reuses_unchanged_branches():
+    layout_memo.clear()
+    hits = layout_memo.stats()['hits']
+    code = _branchy_diagram(["a", "b", "c"])
+    first = convert_mermaid_to_nsd(code)
+    stats = layout_memo.stats()
+    assert stats['hits'] == hits and stats['entries'] == 6
+
+    assert convert_mermaid_to_nsd(code) == first
+    assert layout_memo.stats()['hits'] == hits + 6
+
+    # Editing one branch only re-lays out and re-renders that subtree
+    edited = convert_mermaid_to_nsd(_branchy_diagram(["a", "x", "c"]))
+    stats = layout_memo.stats()
+    assert stats['hits'] == hits + 10 and stats['entries'] == 8
+    assert edited.count('<g transform=') == 3
+    assert '>x?</text>' in edited and '>b?</text>' not in edited
+
+NESTED = """graph TD
+S[{start}] --> A{{a > 1?}}
+A -->|Yes| B{{b > 2?}}
+B -->|Yes| C[c = 1]
+B -->|No| D[d = 1]
+A -->|No| E[e = 1]
+C --> F[f = 1]
+D --> F
+E --> F
+F --> G[End]
+"""
+
+def test_memoized_subtree_at_another_width():
+    # The nested decision's subtree is memoized at one width, then needed at
+    # a wider one: its children must be laid out again from the memoized min widths
+    wide = NESTED.format(start='S' * 150)
+    layout_memo.clear()
+    fresh = convert_mermaid_to_nsd(wide)
+    layout_memo.clear()
+    convert_mermaid_to_nsd(NESTED.format(start='S'))
+    assert convert_mermaid_to_nsd(wide) == fresh
+
+def test_compact_output():
+    import xml.etree.ElementTree as ET
+    code = _branchy_diagram(["a", "b", "a", "b"])
+    layout_memo.clear()
+    plain = convert_mermaid_to_nsd(code)
+    compact = convert_mermaid_to_nsd(code, compact=True)
+    assert len(compact) < len(plain) * 0.7
+    assert 'stroke-width' not in compact and '<style>' in compact
+
+    ns = '{http://www.w3.org/2000/svg}'
+    root = ET.fromstring(compact)
+    # Equal subtrees are defined once and placed twice
+    assert len(root.findall(f'.//{ns}defs')) == 2 and len(root.findall(f'{ns}use')) == 4
+    labels = [''.join(t.itertext()) for t in ET.fromstring(plain).iter(f'{ns}text')]
+    defined = {g.get('id'): g for g in root.iter(f'{ns}g')}
+    compact_labels = []
+    for element in root:
+        if element.tag == f'{ns}use':
+            unit = defined[element.get('{http://www.w3.org/1999/xlink}href')[1:]]
+            compact_labels += [''.join(t.itertext()) for t in unit.iter(f'{ns}text')]
+        elif element.tag == f'{ns}text':
+            compact_labels.append(''.join(element.itertext()))
+    # True/False of a decision share one <text>
+    assert ''.join(compact_labels) == ''.join(labels)
+
+    # Both modes are memoized separately
+    assert convert_mermaid_to_nsd(code) == plain
+    assert convert_mermaid_to_nsd(code, compact=True) == compact
+
+    # Plain first, then compact, with nested compound blocks in the memoized unit
+    nested = NESTED.format(start='Start')
+    layout_memo.clear()
+    fresh = convert_mermaid_to_nsd(nested, compact=True)
+    layout_memo.clear()
+    convert_mermaid_to_nsd(nested)
+    assert convert_mermaid_to_nsd(nested, compact=True) == fresh
+
+def test_synthetic_workloads_structure():
+    # The benchmark generators produce the shapes they are named after
+    from benchmarks.workloads import mermaid_deep_if, mermaid_nested_loops, mermaid_wide_fan
+
+    graph, start = parse_mermaid(mermaid_nested_loops(2, depth=3))
+    loops = find_loops(graph, start)
+    assert len(loops) == 6
+    blocks = build_structure(graph, start, None, set(), loops)
+    assert [b.type for b in blocks] == ['process', 'loop', 'process', 'loop', 'process', 'process']
+    assert blocks[1].body[0].type == 'loop' and blocks[1].body[0].body[0].type == 'loop'
+
+    graph, start = parse_mermaid(mermaid_deep_if(5))
+    blocks = build_structure(graph, start, None, set())
+    depth, decision = 0, blocks[1]
+    while decision.type == 'decision':
+        depth += 1
+        decision = decision.yes[0]
+    assert depth == 5
+
+    graph, start = parse_mermaid(mermaid_wide_fan(4))
+    blocks = build_structure(graph, start, None, set())
+    assert [b.label for b in blocks] == ['Start', 'case == 0?', 'done()', 'End']
 
 if __name__ == "__main__":
     test_loop_rendering()
+    test_loop_detection_uses_back_edges()
+    test_long_branches_merge_once()
+    test_deep_nesting_is_stack_safe()
+    test_streaming_writer_matches_string_api()
+    test_networkx_backend_parity()
+    test_subtree_memo_reuses_unchanged_branches()
+    test_memoized_subtree_at_another_width()
+    test_compact_output()
+    test_synthetic_workloads_structure()
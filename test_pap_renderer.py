@@ -0,0 +1,72 @@
+from converter import parse_mermaid
+from pap_renderer import (_crossings, _order_layers, layout_flowchart, convert_mermaid_to_pap,
+                          convert_source_to_pap, pap_cache)
+from benchmarks.workloads import mermaid_nested_loops
+
+LOOP = """
+graph TD
+A([Start]) --> B{x < 10?}
+B -->|Yes| C[x += 1]
+C --> B
+B -->|No| D([End])
+"""
+
+def layout(source):
+    graph, start = parse_mermaid(source)
+    result = layout_flowchart(graph, start)
+    return result, {node['name']: node for node in result['nodes']}
+
+def test_layers_follow_the_flow():
+    result, nodes = layout(LOOP)
+    assert nodes['A']['y'] < nodes['B']['y'] < nodes['C']['y']
+    assert nodes['C']['y'] == nodes['D']['y']  # Both branches of the decision
+    edges = {(e['source'], e['target']): e for e in result['edges']}
+    assert edges[('C', 'B')]['back']
+    assert not edges[('B', 'C')]['back']
+    # The back edge runs up to the right of everything it passes
+    lane_x = max(x for x, _ in edges[('C', 'B')]['points'])
+    assert lane_x > max(n['x'] + n['w'] for n in nodes.values())
+
+def test_edges_are_orthogonal_and_nodes_do_not_overlap():
+    result, nodes = layout(mermaid_nested_loops(3, depth=3))
+    for edge in result['edges']:
+        for (ax, ay), (bx, by) in zip(edge['points'], edge['points'][1:]):
+            assert ax == bx or ay == by
+    rows = {}
+    for node in nodes.values():
+        rows.setdefault(node['y'] + node['h'] / 2, []).append(node)
+    for row in rows.values():
+        row.sort(key=lambda n: n['x'])
+        for left, right in zip(row, row[1:]):
+            assert left['x'] + left['w'] <= right['x']
+
+def test_crossing_reduction():
+    # 0 -> 3 and 1 -> 2 cross in the given order
+    up = [[], [], [1], [0]]
+    down = [[3], [2], [], []]
+    layers = [[0, 1], [2, 3]]
+    assert _crossings(layers, down, [0, 1, 0, 1]) == 1
+    ordered = _order_layers([list(layer) for layer in layers], up, down)
+    pos = [0] * 4
+    for layer in ordered:
+        for i, v in enumerate(layer):
+            pos[v] = i
+    assert _crossings(ordered, down, pos) == 0
+
+def test_svg_is_cached_by_input():
+    pap_cache.clear()
+    svg = convert_mermaid_to_pap(LOOP)
+    assert svg.startswith('<svg') and svg.endswith('</svg>')
+    assert svg.count('<polygon') == 1 and 'x &lt; 10?' in svg
+    hits = pap_cache.hits
+    assert convert_mermaid_to_pap(LOOP) == svg
+    assert pap_cache.hits == hits + 1
+    python_svg = convert_source_to_pap("x = 0\nwhile x < 3:\n    x += 1\n", 'python')
+    assert 'x += 1' in python_svg
+
+if __name__ == "__main__":
+    test_layers_follow_the_flow()
+    test_edges_are_orthogonal_and_nodes_do_not_overlap()
+    test_crossing_reduction()
+    test_svg_is_cached_by_input()
+    print("\nAll tests passed!")
@@ -0,0 +1,31 @@
+import metrics
+from converter import iter_nsd_svg, convert_mermaid_to_nsd
+from profiling import profile_conversion
+
+MERMAID = """
+graph TD
+A[Start] --> B{x < 10?}
+B -->|Yes| C{even?}
+C -->|Yes| D[x += 2]
+C -->|No| E[x += 1]
+D --> F[print x]
+E --> F
+F --> B
+B -->|No| G[End]
+"""
+
+def test_profile_report():
+    report = profile_conversion(iter_nsd_svg, (MERMAID,), top=5)
+    assert report['output_bytes'] == len(convert_mermaid_to_nsd(MERMAID))
+    assert [span['name'] for span in report['spans']['children']] == ['parse', 'structure', 'layout', 'render']
+    assert report['work']['loop_lookups'] > 0
+    assert report['work']['merge_lookups'] == 1
+    assert report['work']['blocks_rendered'] == 7
+    assert 0 < len(report['functions']) <= 5
+    assert 'function calls' in report['pstats']
+    # Tracing ends with the report
+    assert metrics.stage('parse') is metrics.stage('layout')
+
+if __name__ == "__main__":
+    test_profile_report()
+    print("\nAll tests passed!")
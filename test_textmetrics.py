@@ -0,0 +1,57 @@
+from textmetrics import text_width, wrap_text, char_width
+from converter import (parse_mermaid, find_loops, find_post_dominators, build_structure,
+                       calculate_min_widths, calculate_heights, iter_blocks, render_blocks,
+                       LINE_HEIGHT, PADDING_Y)
+
+def test_glyph_widths():
+    # Narrow and wide glyphs are no longer measured alike
+    assert text_width('iiii') < text_width('MMMM')
+    assert text_width('A', 14) == 667 * 14 / 1000
+    assert char_width('ü') == char_width('u')
+    assert char_width('中') == 1000
+
+def test_wrap_text_fits_width():
+    lines = wrap_text('the quick brown fox jumps over the lazy dog', 100)
+    assert len(lines) > 1
+    assert all(text_width(line) <= 100 for line in lines)
+    assert " ".join(lines) == 'the quick brown fox jumps over the lazy dog'
+
+    # A single word wider than the line is broken between characters
+    lines = wrap_text('x' * 40, 100)
+    assert "".join(lines) == 'x' * 40
+    assert all(text_width(line) <= 100 for line in lines)
+
+    assert wrap_text('', 100) == ('',)
+
+def test_heights_match_rendered_lines():
+    label = 'a rather long process label that has to wrap inside a narrow branch'
+    mermaid_code = f"""
+graph TD
+A[Start] --> B{{c?}}
+B -->|Yes| C[{label}]
+B -->|No| D[{label} too]
+C --> E[End]
+D --> E
+"""
+    graph, start = parse_mermaid(mermaid_code)
+    loops = find_loops(graph, start)
+    blocks = build_structure(graph, start, None, set(), loops, find_post_dominators(graph, start, loops))
+    # Narrower than the minimum width, so the branch labels have to wrap
+    calculate_min_widths(blocks)
+    calculate_heights(blocks, 300)
+    svg = render_blocks(blocks, 0, 0, 300)
+
+    branch = blocks[1].yes[0]
+    drawn = svg.count('<text') - svg.count('>True<') - svg.count('>False<')
+    wrapped = sum(1 for b in iter_blocks(blocks) if b.type != 'process')
+    for block in iter_blocks(blocks):
+        if block.type == 'process':
+            lines = (block.height - PADDING_Y * 2) // LINE_HEIGHT
+            wrapped += lines
+    assert branch.height > 40
+    assert drawn == wrapped
+
+if __name__ == "__main__":
+    test_glyph_widths()
+    test_wrap_text_fits_width()
+    test_heights_match_rendered_lines()
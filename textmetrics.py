@@ -0,0 +1,97 @@
+# Text measurement for the structogram layout.
+# Widths come from the glyph metrics of Arial (identical to Helvetica), in
+# 1/1000 em. Layout and rendering both wrap labels through wrap_text, so the
+# computed heights always match the lines that are drawn, and repeated labels
+# are measured only once.
+from functools import lru_cache
+import unicodedata
+
+FONT_SIZE = 14
+CACHE_SIZE = 64 * 1024  # Labels (or label/width pairs) remembered per function
+
+_ASCII_WIDTHS = (
+    # ' ' to '/'
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    # '0' to '?'
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    # '@' to 'O'
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    # 'P' to '_'
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    # '`' to 'o'
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    # 'p' to '~'
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+
+GLYPH_WIDTHS = {chr(32 + i): w for i, w in enumerate(_ASCII_WIDTHS)}
+GLYPH_WIDTHS.update({
+    'ä': 556, 'ö': 556, 'ü': 556, 'Ä': 667, 'Ö': 778, 'Ü': 722, 'ß': 611,
+    'é': 556, 'è': 556, 'à': 556, '€': 556, '°': 400, '²': 333, '³': 333,
+    '≤': 549, '≥': 549, '≠': 549, '→': 1000, '←': 1000, '…': 1000, '–': 556, '—': 1000,
+})
+DEFAULT_WIDTH = 556  # Average glyph for characters without an entry
+WIDE_WIDTH = 1000    # East Asian full-width characters
+
+def char_width(char):
+    width = GLYPH_WIDTHS.get(char)
+    if width is None:
+        if unicodedata.east_asian_width(char) in ('W', 'F'):
+            width = WIDE_WIDTH
+        else:
+            width = DEFAULT_WIDTH
+        GLYPH_WIDTHS[char] = width
+    return width
+
+@lru_cache(maxsize=CACHE_SIZE)
+def text_width(text, font_size=FONT_SIZE):
+    # Width of text in pixels when rendered on a single line
+    return sum(char_width(c) for c in text) * font_size / 1000
+
+@lru_cache(maxsize=CACHE_SIZE)
+def wrap_text(text, max_width, font_size=FONT_SIZE):
+    # Word-wrap text into lines no wider than max_width. Words that do not fit
+    # on a line of their own are broken between characters. Returns a tuple.
+    space = text_width(' ', font_size)
+    lines = []
+    current_line = []
+    current_len = 0
+
+    for word in text.split():
+        word_len = text_width(word, font_size)
+        if current_line and current_len + space + word_len <= max_width:
+            current_line.append(word)
+            current_len += space + word_len
+            continue
+        if current_line:
+            lines.append(" ".join(current_line))
+        if word_len > max_width:
+            pieces = _break_word(word, max_width, font_size)
+            lines.extend(pieces[:-1])
+            word = pieces[-1]
+            word_len = text_width(word, font_size)
+        current_line = [word]
+        current_len = word_len
+
+    if current_line:
+        lines.append(" ".join(current_line))
+
+    return tuple(lines) if lines else (text,)
+
+def _break_word(word, max_width, font_size):
+    pieces = []
+    start = 0
+    width = 0
+    for i, char in enumerate(word):
+        w = char_width(char) * font_size / 1000
+        if width + w > max_width and i > start:
+            pieces.append(word[start:i])
+            start = i
+            width = 0
+        width += w
+    pieces.append(word[start:])
+    return pieces
+
+def cache_info():
+    return {'text_width': text_width.cache_info()._asdict(),
+            'wrap_text': wrap_text.cache_info()._asdict()}